@@ -2,12 +2,12 @@ import os
 import sys
 import streamlit as st
 import tempfile
-import shutil
 from datetime import datetime
 import traceback
 from io import StringIO
 import json
-import zipfile
+import time
+import uuid
 
 # Add current directory to path to help with imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -63,6 +63,14 @@ except Exception as e:
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
+from src.upload_store import UploadStore
+from src.workspace import WorkspaceManager
+from src.job_queue import JobQueue, ACTIVE_STATES
+from src.render_jobs import RENDER_JOB_HANDLERS
+from src.ffmpeg_utils import probe_video
+from src.zip_export import zip_batch, STATIC_FILE_LIMIT
+from src.generator import load_plans, plan_files
+
 # Title with custom styling
 st.markdown("""
     <h1 style='text-align: center; font-size: 3rem; margin-bottom: 1rem; color: #000000;'>
@@ -75,9 +83,52 @@ st.markdown("""
 
 st.write("Upload multiple videos and an audio file to create remixed scrambled versions!")
 
-# Create a temporary directory for uploads
-temp_dir = tempfile.mkdtemp()
-st.session_state['temp_dir'] = temp_dir
+# Normalized proxies of uploads, reused across sessions and batches (see src/proxy_cache.py)
+PROXY_CACHE_DIR = os.environ.get('SCRAMBLECLIP_PROXY_CACHE', os.path.join(tempfile.gettempdir(), "scrambleclip_proxies"))
+
+# Files under static/ are streamed from disk by Streamlit (server.enableStaticServing)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+@st.cache_resource
+def get_workspace():
+    """Workspace shared by every session of this server, kept under a disk budget."""
+    root_dir = os.environ.get('SCRAMBLECLIP_WORKSPACE', os.path.join(tempfile.gettempdir(), "scrambleclip_workspace"))
+    budget_mb = int(os.environ.get('SCRAMBLECLIP_DISK_BUDGET_MB', 4096))
+    # Download archives go where Streamlit can serve them, if static serving is enabled
+    public_dir = os.path.join(STATIC_DIR, "downloads") if st.get_option("server.enableStaticServing") else None
+    return WorkspaceManager(root_dir, max_bytes=budget_mb * 1024 ** 2, public_dir=public_dir)
+
+# Each session works in its own directory of the workspace, kept for the whole session
+# so previews and their saved plans are still there on the next rerun
+workspace = get_workspace()
+new_session = 'session_id' not in st.session_state
+if new_session:
+    st.session_state['session_id'] = uuid.uuid4().hex
+session_id = st.session_state['session_id']
+temp_dir = workspace.session_dir(session_id)
+
+# Uploads are written once per session; reruns with the same files reuse them
+if 'upload_store' not in st.session_state:
+    st.session_state['upload_store'] = UploadStore(workspace.artifact_dir(session_id, "uploads"))
+upload_store = st.session_state['upload_store']
+
+@st.cache_resource
+def get_job_queue():
+    """Render queue shared by every session; its workers keep running across reruns."""
+    workers = int(os.environ.get('SCRAMBLECLIP_RENDER_WORKERS', 1))
+    return JobQueue(os.path.join(workspace.root_dir, "jobs.sqlite3"), RENDER_JOB_HANDLERS, workers=workers)
+
+job_queue = get_job_queue()
+
+def make_room():
+    """Evict the least recently active other sessions (but not ones with queued renders) if over budget."""
+    workspace.enforce(protect={session_id} | job_queue.active_sessions())
+
+# The budget is checked when files are added (new sessions, uploads, queued renders),
+# not on every poll, since measuring walks the whole workspace
+if new_session:
+    make_room()
+session_jobs = job_queue.list_jobs(session_id)
 
 # Create error logging
 class ErrorLogger:
@@ -136,20 +187,24 @@ error_logger.log_error("Starting app with debug info", debug_info)
 uploaded_videos = st.file_uploader("Upload Videos", type=["mp4", "mov"], accept_multiple_files=True)
 uploaded_audio = st.file_uploader("Upload Audio (optional)", type=["mp3", "wav", "m4a"])
 
-# Save uploaded files
+# Save uploaded files (only the ones this session hasn't stored yet)
 video_paths = []
+uploads_written = False
 
 if uploaded_videos:
     st.write(f"Received {len(uploaded_videos)} video files")
     
     for video in uploaded_videos:
         try:
-            # Save video file
-            video_path = os.path.join(temp_dir, video.name)
-            with open(video_path, "wb") as f:
-                f.write(video.getbuffer())
-            video_paths.append(video_path)
-            st.write(f"Saved: {video.name}")
+            # Save video file (copied to disk in chunks, hashed on the way)
+            entry = upload_store.add(video)
+            video_paths.append(entry['path'])
+            uploads_written = uploads_written or entry['written']
+            
+            # Probe once per upload; reruns reuse the result
+            info = upload_store.metadata(entry['sha1'], "probe", probe_video)
+            st.write(f"{'Saved' if entry['written'] else 'Ready'}: {video.name} "
+                     f"({info['duration']:.1f}s, {info['width']}x{info['height']})")
         except Exception as e:
             error_logger.log_error(f"Error saving video {video.name}", str(e))
             st.error(f"Failed to save video: {video.name}")
@@ -158,14 +213,38 @@ audio_path = None
 if uploaded_audio:
     try:
         # Save audio file
-        audio_path = os.path.join(temp_dir, uploaded_audio.name)
-        with open(audio_path, "wb") as f:
-            f.write(uploaded_audio.getbuffer())
-        st.write(f"Saved audio: {uploaded_audio.name}")
+        entry = upload_store.add(uploaded_audio)
+        audio_path = entry['path']
+        uploads_written = uploads_written or entry['written']
+        st.write(f"{'Saved' if entry['written'] else 'Ready'} audio: {uploaded_audio.name}")
     except Exception as e:
         error_logger.log_error("Error saving audio", str(e))
         st.error(f"Failed to save audio: {uploaded_audio.name}")
 
+# New uploads take disk space, so check the budget now
+if uploads_written:
+    make_room()
+
+# Drop stored uploads the user has removed from the uploaders, except files a render
+# may still need: inputs of queued or running jobs, and the sources of the latest
+# preview's plans (rendered again by "Render Selected")
+referenced_files = set()
+pending_plans = []
+for job in session_jobs:
+    if job['state'] in ACTIVE_STATES:
+        referenced_files.update(job['params'].get('video_paths', []))
+        if job['params'].get('audio_path'):
+            referenced_files.add(job['params']['audio_path'])
+        pending_plans.append(job['params'].get('plans_path'))
+preview_jobs = [job for job in session_jobs if job['state'] == "done" and job['params'].get('preview')]
+if preview_jobs:
+    pending_plans.append(preview_jobs[-1]['params'].get('plans_path'))
+for plans_path in pending_plans:
+    if plans_path and os.path.exists(plans_path):
+        referenced_files.update(plan_files(load_plans(plans_path)))
+upload_store.retain(list(uploaded_videos or []) + ([uploaded_audio] if uploaded_audio else []),
+                    keep_paths=referenced_files)
+
 # Control options
 with st.container():
     col1, col2 = st.columns(2)
@@ -177,6 +256,18 @@ with st.container():
     with col2:
         use_effects = st.checkbox("Use AI effects", value=True)
         use_text = st.checkbox("Add text overlay", value=False)
+        encode_profile = st.selectbox(
+            "Quality",
+            ["draft", "standard", "archive"],
+            index=1,
+            help="Draft renders at 540x960 with the fastest settings; archive uses a slower, higher quality encode"
+        )
+        use_proxies = st.checkbox(
+            "Reuse normalized sources",
+            value=os.environ.get('SCRAMBLECLIP_USE_PROXIES', '0') == '1',
+            help="Transcode each upload once to a 9:16 proxy with frequent keyframes; "
+                 "later batches from the same files render faster"
+        )
 
 # Text overlay options
 overlay_text = None
@@ -201,171 +292,248 @@ if use_text:
             - Enabled: {use_text}
         """)
 
-# Generation button
-if st.button("Generate Scrambled Videos"):
-    if not video_paths:
-        st.error("Please upload at least one video")
+def static_url(path):
+    """URL Streamlit serves a file under STATIC_DIR at, or None if it can't serve it."""
+    static_dir = os.path.realpath(STATIC_DIR)
+    path = os.path.realpath(path)
+    if not path.startswith(static_dir + os.sep) or os.path.getsize(path) > STATIC_FILE_LIMIT:
+        return None
+    return "app/static/" + os.path.relpath(path, static_dir).replace(os.sep, "/")
+
+def show_video(video_path):
+    """Play a video; the browser fetches it from the static route instead of st.video reading it into memory."""
+    url = static_url(video_path)
+    if url:
+        st.markdown(f'<video src="{url}" controls preload="metadata" style="width: 100%"></video>',
+                    unsafe_allow_html=True)
     else:
-        with st.spinner("Generating videos..."):
-            try:
-                # Clear previous errors
-                error_logger.clear()
-                error_logger.log_error("Starting video generation", debug_info)
+        st.video(video_path, start_time=0)
+
+def show_output_videos(output_videos, key_prefix="", zip_dir=None):
+    """Show generated videos in a grid with download buttons."""
+    output_videos = [video_path for video_path in output_videos if os.path.exists(video_path)]
+
+    # Display download all button if multiple videos
+    if len(output_videos) > 1:
+        try:
+            zip_dir = zip_dir or os.path.join(workspace.artifact_dir(session_id, "zips"), key_prefix.strip("_") or "latest")
+            # Stored-mode archive of the batch, reused if its render already wrote it
+            zip_parts = zip_batch(output_videos, zip_dir)
+            for n, zip_path in enumerate(zip_parts):
+                label = "⬇️ Download All Videos"
+                if len(zip_parts) > 1:
+                    label += f" (part {n + 1} of {len(zip_parts)})"
                 
-                # Create output directory
-                output_dir = os.path.join(temp_dir, "output")
-                os.makedirs(output_dir, exist_ok=True)
-                error_logger.log_error("Created output directory", {
-                    "output_dir": output_dir,
-                    "exists": os.path.exists(output_dir),
-                    "writable": os.access(output_dir, os.W_OK)
-                })
+                # Link to the archive so the server streams it from disk; otherwise hand it to a
+                # download button, which reads it into memory
+                url = static_url(zip_path)
+                if url:
+                    st.markdown(f'<a href="{url}" download="{os.path.basename(zip_path)}">{label}</a>',
+                                unsafe_allow_html=True)
+                else:
+                    with open(zip_path, "rb") as f:
+                        st.download_button(
+                            label=label,
+                            data=f,
+                            file_name=os.path.basename(zip_path),
+                            mime="application/zip",
+                            key=f"{key_prefix}download_all_button_{n}"
+                        )
+        except Exception as e:
+            st.error(f"Error creating zip file: {e}")
+    
+    # Display videos in a grid
+    num_cols = 3  # Number of columns in the grid
+    rows = [output_videos[i:i + num_cols] for i in range(0, len(output_videos), num_cols)]
+    
+    for row in rows:
+        cols = st.columns(num_cols)
+        
+        for i, video_path in enumerate(row):
+            with cols[i]:
+                show_video(video_path)
                 
-                try:
-                    # Import here, after we've configured the path
-                    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-                    
-                    # Override configuration for current process
-                    import moviepy.config
-                    moviepy.config.IMAGEMAGICK_BINARY = IMAGEMAGICK_BINARY
-                    moviepy.config.change_settings({"IMAGEMAGICK_BINARY": IMAGEMAGICK_BINARY})
-                    
-                    # Try to find the generator module
-                    generator_paths = [
-                        "scrambleclip2.src.generator",  # Original path
-                        "src.generator",                # Alternative path
-                    ]
-                    
-                    VideoGenerator = None
-                    last_error = None
-                    for path in generator_paths:
-                        try:
-                            error_logger.log_error(f"Attempting to import from {path}")
-                            module = __import__(path, fromlist=['VideoGenerator'])
-                            VideoGenerator = module.VideoGenerator
-                            error_logger.log_error(f"Successfully imported VideoGenerator from {path}")
-                            break
-                        except ImportError as e:
-                            last_error = e
-                            error_logger.log_error(f"Failed to import from {path}: {e}")
-                            error_logger.log_error(f"Traceback: {traceback.format_exc()}")
-                    
-                    if VideoGenerator is None:
-                        error_traceback = traceback.format_exc() if last_error else "No traceback available"
-                        error_logger.log_error(f"Import paths tried: {generator_paths}")
-                        error_logger.log_error(f"Current sys.path: {sys.path}")
-                        error_logger.log_error(f"Last error traceback: {error_traceback}")
-                        raise ImportError("Could not find VideoGenerator in any of the expected modules. Check the logs for details.")
-                    
-                    # Generate scrambled videos
-                    generator = VideoGenerator(video_paths[0])
-                    error_logger.log_error("VideoGenerator initialized", {
-                        "base_video": video_paths[0],
-                        "generator_type": "VideoGenerator"
-                    })
-                    
-                    # Prepare text overlay parameters if enabled
-                    text_params = None
-                    if use_text and overlay_text:
-                        text_params = {
-                            'text': overlay_text,
-                            'color': text_color,
-                            'stroke_color': stroke_color,
-                            'font_size': font_size,
-                            'stroke_width': stroke_width,
-                            'opacity': text_opacity
-                        }
-                        error_logger.log_error("Text overlay parameters prepared", text_params)
-                    
-                    # Run generation
-                    output_videos = generator.generate_scrambled_videos(
-                        num_videos=num_videos,
-                        segment_duration=segment_duration,
-                        output_dir=output_dir,
-                        additional_videos=video_paths[1:] if len(video_paths) > 1 else None,
-                        audio_path=audio_path,
-                        text_overlay=text_params,
-                        use_effects=use_effects
-                    )
-                    
-                    # Display results
-                    if output_videos and len(output_videos) > 0:
-                        st.success(f"Generated {len(output_videos)} videos!")
-                        
-                        # Function to create a zip file of all videos
-                        def create_zip_of_videos(video_paths):
-                            zip_path = os.path.join(temp_dir, "all_videos.zip")
-                            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                                for video_path in video_paths:
-                                    zipf.write(video_path, arcname=os.path.basename(video_path))
-                            return zip_path
-                        
-                        # Display download all button if multiple videos
-                        if len(output_videos) > 1:
-                            try:
-                                zip_path = create_zip_of_videos(output_videos)
-                                with open(zip_path, "rb") as f:
-                                    st.download_button(
-                                        label="⬇️ Download All Videos",
-                                        data=f,
-                                        file_name="all_videos.zip",
-                                        mime="application/zip",
-                                        key="download_all_button"
-                                    )
-                            except Exception as e:
-                                st.error(f"Error creating zip file: {e}")
-                        
-                        # Display videos in a grid
-                        num_cols = 3  # Number of columns in the grid
-                        rows = [output_videos[i:i + num_cols] for i in range(0, len(output_videos), num_cols)]
-                        
-                        for row in rows:
-                            cols = st.columns(num_cols)
-                            
-                            for i, video_path in enumerate(row):
-                                with cols[i]:
-                                    # Display video with reduced height
-                                    st.video(video_path, start_time=0)
-                                    
-                                    # Get just the filename
-                                    video_name = os.path.basename(video_path)
-                                    
-                                    # Display download button
-                                    with open(video_path, "rb") as file:
-                                        st.download_button(
-                                            label=f"⬇️ Download {video_name}",
-                                            data=file,
-                                            file_name=video_name,
-                                            mime="video/mp4",
-                                            key=f"download_button_{video_name}"
-                                        )
-                    else:
-                        st.error("No videos were generated. Check the error log.")
-                        
-                except Exception as e:
-                    error_msg = f"Error in video generation: {e}"
-                    st.error(error_msg)
-                    st.code(traceback.format_exc())
-                    error_logger.log_error(error_msg, traceback.format_exc())
-                    
-            except Exception as e:
-                error_msg = f"Error during app execution: {e}"
-                st.error(error_msg)
-                st.code(traceback.format_exc())
-                error_logger.log_error(error_msg, traceback.format_exc())
+                # Get just the filename
+                video_name = os.path.basename(video_path)
+                
+                # Display download link (or a button, which reads the file into memory)
+                url = static_url(video_path)
+                if url:
+                    st.markdown(f'<a href="{url}" download="{video_name}">⬇️ Download {video_name}</a>',
+                                unsafe_allow_html=True)
+                else:
+                    with open(video_path, "rb") as file:
+                        st.download_button(
+                            label=f"⬇️ Download {video_name}",
+                            data=file,
+                            file_name=video_name,
+                            mime="video/mp4",
+                            key=f"{key_prefix}download_button_{video_name}"
+                        )
+
+# Generation buttons: full quality straight away, or cheap previews to choose from first
+col_generate, col_preview = st.columns(2)
+with col_generate:
+    generate_clicked = st.button("Generate Scrambled Videos")
+with col_preview:
+    preview_clicked = st.button("Preview First (fast, low resolution)")
+
+if generate_clicked or preview_clicked:
+    if not video_paths:
+        st.error("Please upload at least one video")
+    else:
+        try:
+            # Clear previous errors
+            error_logger.clear()
+            error_logger.log_error("Queueing video generation", debug_info)
+            
+            # Each batch gets its own output directory, so queued batches don't overwrite each other
+            batch_id = uuid.uuid4().hex[:8]
+            output_dir = os.path.join(workspace.artifact_dir(session_id, "preview" if preview_clicked else "output"), batch_id)
+            
+            # Prepare text overlay parameters if enabled
+            text_params = None
+            if use_text and overlay_text:
+                text_params = {
+                    'text': overlay_text,
+                    'color': text_color,
+                    'stroke_color': stroke_color,
+                    'font_size': font_size,
+                    'stroke_width': stroke_width,
+                    'opacity': text_opacity
+                }
+                error_logger.log_error("Text overlay parameters prepared", text_params)
+            
+            # Previews keep their plans so approved ones can be rendered again at full quality
+            # (kept in the session directory, not with the previews the browser can fetch)
+            plans_path = os.path.join(workspace.session_dir(session_id), f"preview_plans_{batch_id}.json") if preview_clicked else None
             
-            # Show any errors
-            error_logger.show()
+            # Queue the render; a worker runs it while this page polls for progress
+            make_room()
+            job_queue.submit("generate", {
+                'video_paths': video_paths,
+                'audio_path': audio_path,
+                'num_videos': int(num_videos),
+                'segment_duration': segment_duration,
+                'output_dir': output_dir,
+                'text_overlay': text_params,
+                'use_effects': use_effects,
+                'encode_profile': "preview" if preview_clicked else encode_profile,
+                'plans_path': plans_path,
+                'preview': preview_clicked,
+                # Full renders are archived for download as each output finishes
+                'zip_dir': None if preview_clicked else os.path.join(workspace.artifact_dir(session_id, "zips"), batch_id),
+                # Proxies are shared by every session (addressed by content), outside the workspace
+                'proxy_cache_dir': PROXY_CACHE_DIR if use_proxies else None,
+            }, session_id=session_id)
+            session_jobs = job_queue.list_jobs(session_id)
+        except Exception as e:
+            error_msg = f"Error queueing video generation: {e}"
+            st.error(error_msg)
+            st.code(traceback.format_exc())
+            error_logger.log_error(error_msg, traceback.format_exc())
+        
+        # Show any errors
+        error_logger.show()
+
+# Renders of this session: progress while they run, results once they are done.
+# Only one finished batch is shown (the latest, unless another was picked), so reruns
+# and progress polls don't grow with the session's history.
+finished_jobs = [job for job in session_jobs if job['state'] == "done" and not job['result']['preview']]
+shown_job = None
+if finished_jobs:
+    shown_job = next((job for job in finished_jobs if job['id'] == st.session_state.get('shown_job')),
+                     finished_jobs[-1])
+
+if session_jobs:
+    st.markdown("### Renders")
+    for job in reversed(session_jobs):
+        label = "Previews" if job['params'].get('preview') else (
+            "Selected videos" if job['kind'] == "render_selected" else "Videos")
+        submitted = datetime.fromtimestamp(job['created']).strftime('%H:%M:%S')
+        
+        if job['state'] in ACTIVE_STATES:
+            st.progress(int(job['progress']) / 100,
+                        text=f"{label} ({submitted}): {job['message'] or job['state'].title()}")
+            if job['state'] == "queued" and st.button("Cancel", key=f"cancel_{job['id']}"):
+                job_queue.cancel(job['id'])
+                st.rerun()
+        elif job['state'] == "failed":
+            st.error(f"{label} ({submitted}) failed: {job['message']}")
+            with st.expander("Details"):
+                st.code(job['error'])
+        elif job['state'] == "done" and not job['result']['preview']:
+            col_label, col_show = st.columns([4, 1])
+            col_label.write(f"{label} ({submitted}): {len(job['result']['videos'])} videos")
+            if job is shown_job:
+                col_show.write("Shown below")
+            elif col_show.button("Show", key=f"show_{job['id']}"):
+                st.session_state['shown_job'] = job['id']
+                st.rerun()
+    
+    if shown_job:
+        show_output_videos(shown_job['result']['videos'], key_prefix=f"{shown_job['id']}_",
+                           zip_dir=shown_job['params'].get('zip_dir'))
 
-# Cleanup on session end
-def cleanup():
-    if 'temp_dir' in st.session_state:
+# Previews: pick the variants worth keeping, then render only those at full quality
+# (the latest finished preview batch; gone if the session was evicted while inactive)
+preview = None
+for job in reversed(session_jobs):
+    if job['state'] == "done" and job['result']['preview']:
+        if job['result']['plans_path'] and os.path.exists(job['result']['plans_path']):
+            preview = job['result']
+        break
+if preview and preview['videos']:
+    st.markdown("### Previews")
+    st.write("Tick the variants you want to keep, then render them at full quality. "
+             "Each one is rendered from the same plan as its preview.")
+    
+    approved = []
+    num_cols = 3
+    rows = [preview['videos'][i:i + num_cols] for i in range(0, len(preview['videos']), num_cols)]
+    for row in rows:
+        cols = st.columns(num_cols)
+        for i, video_path in enumerate(row):
+            with cols[i]:
+                show_video(video_path)
+                video_name = os.path.basename(video_path)
+                if st.checkbox(f"Keep {video_name}", key=f"approve_{video_name}"):
+                    approved.append(video_name)
+    
+    if st.button(f"Render {len(approved)} Selected at {encode_profile.title()} Quality", disabled=not approved):
         try:
-            shutil.rmtree(st.session_state['temp_dir'])
-            print(f"Cleaned up temporary directory: {st.session_state['temp_dir']}")
+            error_logger.clear()
+            batch_id = uuid.uuid4().hex[:8]
+            make_room()
+            job_queue.submit("render_selected", {
+                'plans_path': preview['plans_path'],
+                'output_names': approved,
+                'output_dir': os.path.join(workspace.artifact_dir(session_id, "output"), batch_id),
+                'encode_profile': encode_profile,
+                'zip_dir': os.path.join(workspace.artifact_dir(session_id, "zips"), batch_id),
+                # Previews made from proxies get any evicted ones rebuilt here
+                'proxy_cache_dir': PROXY_CACHE_DIR,
+            }, session_id=session_id)
+            st.rerun()
         except Exception as e:
-            print(f"Error cleaning up: {e}")
+            error_msg = f"Error queueing selected videos: {e}"
+            st.error(error_msg)
+            st.code(traceback.format_exc())
+            error_logger.log_error(error_msg, traceback.format_exc())
+        
+        error_logger.show()
+
+# Disk usage of this session and of the whole workspace (re-measured at most every 30 seconds)
+usage = workspace.usage(max_age=30)
+session_usage = usage['sessions'].get(session_id, {'bytes': 0, 'by_type': {}})
+st.sidebar.markdown("## Workspace")
+st.sidebar.write(f"All sessions: {usage['total_bytes'] / 1024 ** 2:.0f} MB of "
+                 f"{usage['max_bytes'] / 1024 ** 2:.0f} MB ({len(usage['sessions'])} sessions)")
+st.sidebar.write(f"This session: {session_usage['bytes'] / 1024 ** 2:.1f} MB")
+for artifact, size in sorted(session_usage['by_type'].items()):
+    st.sidebar.write(f"- {artifact}: {size / 1024 ** 2:.1f} MB")
 
-# Register cleanup
-import atexit
-atexit.register(cleanup) 
\ No newline at end of file
+# Poll while renders are queued or running
+if any(job['state'] in ACTIVE_STATES for job in session_jobs):
+    time.sleep(2)
+    st.rerun()
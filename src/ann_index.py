@@ -0,0 +1,225 @@
+"""
+Approximate nearest-neighbour search over feature vectors (whole sources or segments),
+for libraries too large to compare against every entry.
+
+SegmentIndex is a small inverted-file (IVF) index: the L2-normalized vectors are
+clustered with spherical k-means into about sqrt(n) lists. A query scores the list
+centroids, then scores exactly only the members of the few lists closest to it (for
+near-duplicates) or farthest from it (for the most dissimilar items). Small indexes skip
+the lists and score everything, which is faster below a few hundred vectors.
+"""
+
+import os
+import json
+import numpy as np
+
+# Below this many vectors every query is answered exactly
+EXACT_LIMIT = 256
+
+def _normalize(vectors):
+    """L2-normalize the rows of a float32 array (zero rows stay zero)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+class SegmentIndex:
+    """
+    Inverted-file index of L2-normalized vectors, with cosine similarity queries.
+    """
+
+    def __init__(self, vectors, keys=None, num_lists=None, iterations=8, seed=0):
+        """
+        Build the index.
+
+        Args:
+            vectors: Array of shape (n, features), one row per item
+            keys: Key of each row (JSON-serializable, e.g. a clip index or (path, start));
+                defaults to the row numbers
+            num_lists: Number of k-means lists (default: about sqrt(n))
+            iterations: k-means iterations
+            seed: Seed for picking the initial centroids and the training sample
+        """
+        self.vectors = _normalize(vectors).reshape(len(vectors), -1)
+        self.keys = list(range(len(self.vectors))) if keys is None else list(keys)
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+
+        n = len(self.vectors)
+        if num_lists is None:
+            num_lists = int(np.sqrt(n)) if n > EXACT_LIMIT else 1
+        num_lists = max(1, min(num_lists, n))
+
+        # Spherical k-means on a sample (a few dozen vectors per list is plenty)
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[rng.choice(n, min(n, 64 * num_lists), replace=False)] if n else self.vectors
+        self.centroids = sample[rng.choice(len(sample), num_lists, replace=False)] if n else sample[:0]
+        for _ in range(iterations if num_lists > 1 else 0):
+            assignment = np.argmax(sample @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=num_lists) > 0
+            self.centroids[filled] = _normalize(sums[filled])
+
+        # Rows grouped by list: list l holds order[offsets[l]:offsets[l + 1]]
+        assignment = self._assign(self.vectors)
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def _assign(self, vectors, chunk=8192):
+        """Index of the closest centroid of each vector."""
+        if not len(self.centroids):
+            return np.zeros(len(vectors), dtype=np.int64)
+        return np.concatenate([np.argmax(vectors[n:n + chunk] @ self.centroids.T, axis=1)
+                               for n in range(0, len(vectors), chunk)] or [np.zeros(0, dtype=np.int64)])
+
+    def candidates(self, vector, k=1, probes=4, farthest=False):
+        """
+        Rows worth scoring exactly for a query.
+
+        Args:
+            vector: Normalized query vector
+            k: Number of results wanted; more lists are probed until there are this many rows
+            probes: Number of lists to look in
+            farthest: Look in the lists least similar to the query instead of the most similar
+
+        Returns:
+            numpy.ndarray: Row numbers
+        """
+        if len(self.vectors) <= EXACT_LIMIT or len(self.centroids) <= 1:
+            return np.arange(len(self.vectors))
+
+        ranked = np.argsort(self.centroids @ vector)
+        if not farthest:
+            ranked = ranked[::-1]
+
+        found, count = [], 0
+        for n, lst in enumerate(ranked):
+            if n >= probes and count >= k:
+                break
+            rows = self.order[self.offsets[lst]:self.offsets[lst + 1]]
+            found.append(rows)
+            count += len(rows)
+        return np.concatenate(found)
+
+    def _search(self, vector, k, probes, exclude, farthest):
+        """Score the candidate rows of a query, returning the k best (row, similarity) pairs."""
+        rows = self.candidates(vector, k + len(exclude or ()), probes, farthest)
+        if exclude:
+            excluded = np.array([self.rows[key] for key in exclude if key in self.rows], dtype=np.int64)
+            rows = rows[~np.isin(rows, excluded)]
+        if not len(rows):
+            return []
+
+        similarities = self.vectors[rows] @ vector
+        best = np.argsort(similarities if farthest else -similarities, kind="stable")[:k]
+        return [(rows[n], float(similarities[n])) for n in best]
+
+    def nearest(self, vector, k=10, probes=4, exclude=None):
+        """
+        Approximate k most similar items to a vector.
+
+        Args:
+            vector: Query vector (does not need to be normalized)
+            k: Number of items to return
+            probes: Number of lists to look in (more is slower but misses less)
+            exclude: Keys to leave out of the result
+
+        Returns:
+            list: (key, cosine similarity) tuples, most similar first
+        """
+        vector = _normalize(vector)
+        if not np.any(vector):
+            return []
+        return [(self.keys[row], similarity)
+                for row, similarity in self._search(vector, k, probes, exclude, farthest=False)]
+
+    def near_duplicates(self, vector, threshold=0.95, probes=2):
+        """
+        Items whose cosine similarity to a vector is at least `threshold`.
+
+        Returns:
+            list: (key, cosine similarity) tuples, most similar first
+        """
+        vector = _normalize(vector)
+        if not np.any(vector):
+            return []
+        rows = self.candidates(vector, 1, probes)
+        similarities = self.vectors[rows] @ vector
+        close = np.flatnonzero(similarities >= threshold)
+        close = close[np.argsort(-similarities[close], kind="stable")]
+        return [(self.keys[rows[n]], float(similarities[n])) for n in close]
+
+    def farthest_from(self, vectors, k=10, probes=4, exclude=None):
+        """
+        Approximate k items with the highest average dissimilarity (1 - cosine
+        similarity) to a set of vectors.
+
+        For normalized items the average similarity to the set is the dot product with
+        the set's mean, so only the lists whose centroids score lowest against it are searched.
+
+        Args:
+            vectors: Array of shape (m, features), the set to move away from
+            k: Number of items to return
+            probes: Number of lists to look in
+            exclude: Keys to leave out of the result
+
+        Returns:
+            list: (key, average dissimilarity) tuples, most dissimilar first
+        """
+        unit = _normalize(vectors).reshape(-1, self.vectors.shape[1])
+        if not len(unit):
+            return []
+        mean = unit.mean(axis=0)
+        return [(self.keys[row], 1.0 - similarity)
+                for row, similarity in self._search(mean, k, probes, exclude, farthest=True)]
+
+    def save(self, path):
+        """
+        Write the index to an .npz file (atomically, like FeatureCache.save).
+
+        Returns:
+            str: The path written
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        try:
+            np.savez(tmp_path, vectors=self.vectors, centroids=self.centroids, order=self.order,
+                     offsets=self.offsets, keys=np.array(json.dumps(self.keys)))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an index written by save.
+
+        Returns:
+            SegmentIndex: The index, or None if the file is missing or unreadable
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                index = cls.__new__(cls)
+                index.vectors = data['vectors']
+                index.centroids = data['centroids']
+                index.order = data['order']
+                index.offsets = data['offsets']
+                index.keys = [tuple(key) if isinstance(key, list) else key
+                              for key in json.loads(str(data['keys']))]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable index {path}: {e}")
+            return None
+
+        index.rows = {key: row for row, key in enumerate(index.keys)}
+
+        # Mark as recently used, for the feature cache's LRU eviction
+        os.utime(path)
+        return index
@@ -0,0 +1,110 @@
+"""
+Named encode profiles (resolution, x264 preset and CRF) and CPU-aware thread counts.
+"""
+
+import os
+
+# Output size, x264 preset and CRF for each profile, plus an optional frame rate cap
+ENCODE_PROFILES = {
+    # Throwaway previews to pick variants from before rendering them properly
+    "preview": {'width': 360, 'height': 640, 'preset': "ultrafast", 'crf': 32, 'fps': 12},
+    # Quick look at a batch: a quarter of the pixels and the cheapest preset
+    "draft": {'width': 540, 'height': 960, 'preset': "ultrafast", 'crf': 28},
+    # What the app has always produced
+    "standard": {'width': 1080, 'height': 1920, 'preset': "fast", 'crf': 23},
+    # Final masters: slower preset, near-transparent quality
+    "archive": {'width': 1080, 'height': 1920, 'preset': "slow", 'crf': 18},
+}
+
+DEFAULT_PROFILE = "standard"
+
+def _cgroup_cpu_limit():
+    """
+    Read the CPU quota of the current container, if any.
+
+    Returns:
+        float: Number of CPUs the cgroup allows, or None if unlimited or unknown
+    """
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max" and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v1: separate quota and period files, quota -1 means unlimited
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read().strip())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read().strip())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def available_cpus():
+    """
+    Count the CPUs this process can actually use: the smallest of the CPU count,
+    the scheduler affinity mask and the container's cgroup quota.
+
+    Returns:
+        int: Usable CPUs (at least 1)
+    """
+    cpus = os.cpu_count() or 1
+
+    if hasattr(os, "sched_getaffinity"):
+        cpus = min(cpus, len(os.sched_getaffinity(0)))
+
+    limit = _cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, int(limit)))
+
+    return max(1, cpus)
+
+def encode_threads(workers=1):
+    """
+    Get the number of encoder threads for each of `workers` concurrent renders.
+
+    Args:
+        workers: Number of renders running at the same time
+
+    Returns:
+        int: Threads per encode (at least 1)
+    """
+    return max(1, available_cpus() // max(1, workers))
+
+def encode_settings(profile=DEFAULT_PROFILE, workers=1):
+    """
+    Turn an encode profile into render settings.
+
+    Args:
+        profile: Profile name from ENCODE_PROFILES, or a dict with width, height,
+            preset, crf and optionally fps for a custom profile
+        workers: Number of renders running at the same time (used to split the threads)
+
+    Returns:
+        dict: Render settings with encode_profile, target_width, target_height,
+        preset, crf, threads and fps (None to keep the source frame rate)
+    """
+    if isinstance(profile, dict):
+        name, values = profile.get('name', "custom"), profile
+    elif profile in ENCODE_PROFILES:
+        name, values = profile, ENCODE_PROFILES[profile]
+    else:
+        raise ValueError(f"Unknown encode profile: {profile}. Choose from {', '.join(ENCODE_PROFILES)}")
+
+    return {
+        'encode_profile': name,
+        'target_width': values['width'],
+        'target_height': values['height'],
+        'preset': values['preset'],
+        'crf': values['crf'],
+        'threads': encode_threads(workers),
+        'fps': values.get('fps'),
+    }
@@ -0,0 +1,177 @@
+"""
+Content-addressed on-disk cache of analysis features (.npy arrays).
+
+Features are keyed by the video's content hash, the kind of feature, its sampling
+parameters and FEATURE_VERSION, so the same upload analysed in a later session (or by
+another process) is a memory-mapped read instead of a decode.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from .utils import hash_file
+
+# Bump when any feature extraction changes, so stale arrays are not reused
+FEATURE_VERSION = 1
+
+class FeatureCache:
+    """
+    Feature arrays stored as .npy files under a content-derived key, with a
+    least-recently-used size cap.
+    """
+
+    def __init__(self, cache_dir=".clip_cache", max_bytes=512 * 1024 ** 2):
+        """
+        Initialize the feature cache.
+
+        Args:
+            cache_dir: Directory to store feature arrays in
+            max_bytes: Total size the cache is trimmed to after adding an array
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Content hashes of files already seen, keyed by (path, size, mtime)
+        self._hashes = {}
+
+    def _content_hash(self, video_path):
+        """Hash a file's content, reusing the result while the file is unchanged."""
+        stat = os.stat(video_path)
+        key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            self._hashes[key] = hash_file(video_path)
+        return self._hashes[key]
+
+    def feature_path(self, video_path, kind, params=None):
+        """
+        Get the path a feature array is (or would be) stored at.
+
+        Args:
+            video_path: Path to the analysed video
+            kind: Name of the feature, e.g. "frames" or "timeline"
+            params: JSON-serializable sampling parameters the array depends on
+        """
+        key = json.dumps({'kind': kind, 'params': params or {}, 'version': FEATURE_VERSION}, sort_keys=True)
+        name = f"{self._content_hash(video_path)}_{kind}_{hashlib.sha1(key.encode('utf8')).hexdigest()[:16]}.npy"
+        return os.path.join(self.cache_dir, name)
+
+    def index_path(self, name, params=None):
+        """
+        Get the path of an index over several videos (e.g. a SegmentIndex .npz), stored
+        alongside the feature arrays and evicted with them.
+
+        Args:
+            name: Name of the index, e.g. "library"
+            params: JSON-serializable description of what was indexed
+        """
+        key = json.dumps({'name': name, 'params': params or {}, 'version': FEATURE_VERSION}, sort_keys=True)
+        return os.path.join(self.cache_dir, f"index_{name}_{hashlib.sha1(key.encode('utf8')).hexdigest()[:16]}.npz")
+
+    def load(self, video_path, kind, params=None):
+        """
+        Load a cached feature array, memory-mapped read-only.
+
+        Returns:
+            numpy.ndarray: The array, or None if it isn't cached
+        """
+        path = self.feature_path(video_path, kind, params)
+        if not os.path.exists(path):
+            return None
+        try:
+            array = np.load(path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable feature cache entry {path}: {e}")
+            return None
+
+        # Mark as recently used for LRU eviction
+        os.utime(path)
+        return array
+
+    def save(self, video_path, kind, params, array):
+        """
+        Store a feature array and trim the cache.
+
+        Returns:
+            str: Path of the stored array
+        """
+        path = self.feature_path(video_path, kind, params)
+
+        # Write to a temporary name first so readers never see a partial array
+        tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+        try:
+            np.save(tmp_path, np.ascontiguousarray(array))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict(keep={path})
+        return path
+
+    def get_or_compute(self, video_path, kind, params, compute):
+        """
+        Load a feature array, computing and storing it on a miss.
+
+        Args:
+            video_path: Path to the analysed video
+            kind: Name of the feature
+            params: Sampling parameters the array depends on
+            compute: Function returning the array when it isn't cached
+
+        Returns:
+            numpy.ndarray: The (possibly memory-mapped) array
+        """
+        array = self.load(video_path, kind, params)
+        if array is None:
+            array = compute()
+            try:
+                self.save(video_path, kind, params, array)
+            except OSError as e:
+                print(f"Could not cache {kind} features for {video_path}: {e}")
+        return array
+
+    def usage(self):
+        """
+        Get the arrays (and indexes) currently in the cache.
+
+        Returns:
+            list: (path, size_in_bytes, last_used) tuples, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith((".npy", ".npz")) and ".tmp." not in name and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used arrays until the cache fits in max_bytes.
+
+        Args:
+            keep: Paths that must not be removed
+
+        Returns:
+            int: Number of bytes freed
+        """
+        entries = self.usage()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep and path in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                freed += size
+            except OSError as e:
+                print(f"Could not evict feature array {path}: {e}")
+
+        return freed
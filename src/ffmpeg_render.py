@@ -0,0 +1,324 @@
+"""
+Render backends that hand the whole edit to ffmpeg instead of MoviePy.
+"""
+
+import os
+import shutil
+import tempfile
+
+from .ffmpeg_utils import run_ffmpeg, normalize_filter, write_concat_list
+
+# Fade length used for the first/last clip and the crossfadein effect (matches generator.py)
+FADE_DURATION = 0.3
+
+# Audio format every segment is converted to, so segments can be joined as-is
+AUDIO_RATE = 44100
+AUDIO_LAYOUT = "stereo"
+
+# Color boost applied by the "colorx" effect at the default intensity of 0.3
+COLORX_FACTOR = 1.0 + (0.3 * 0.2)
+
+def render_stream_copy(plan, output_path, settings, progress_callback=None):
+    """
+    Render an effect-free, text-free plan by cutting every segment with ffmpeg,
+    normalizing it once, and joining the segments with the concat demuxer
+    using stream copy. No frames pass through Python.
+
+    Every segment is encoded with identical size, frame rate and codec settings,
+    which is what lets the concat demuxer join them without re-encoding.
+
+    Args:
+        plan: Edit decision list from plan_output in generator.py
+        output_path: Path of the video to write
+        settings: Render settings dict from render_plan; uses num_videos,
+            target_width, target_height, target_duration, preset, crf and threads
+        progress_callback: Function to report progress (progress_pct, status_message)
+
+    Returns:
+        str: Path to the written video, or None if rendering failed
+    """
+    i = plan['index']
+    num_videos = settings['num_videos']
+    target_width = settings['target_width']
+    target_height = settings['target_height']
+
+    # Calculate overall progress: each video is worth (90/num_videos)% of progress
+    base_progress = 10 + (i * (80 / num_videos))
+
+    if progress_callback:
+        progress_callback(int(base_progress), f"Cutting segments for video {i+1}/{num_videos}...")
+    else:
+        print(f"Building {output_path} with ffmpeg stream copy...")
+
+    work_dir = tempfile.mkdtemp(prefix="segments_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        segment_paths = []
+        total_duration = 0
+        num_segments = len(plan['segments'])
+
+        for k, segment in enumerate(plan['segments']):
+            source = plan['sources'][segment['source']]
+            clip_duration = segment['end'] - segment['start']
+            segment_path = os.path.join(work_dir, f"segment_{k:03d}.mp4")
+
+            # Input seeking (-ss before -i) jumps to the nearest keyframe and decodes
+            # only what the segment needs
+            args = ["-ss", f"{segment['start']:.3f}", "-t", f"{clip_duration:.3f}", "-i", source['path']]
+
+            if plan['audio']:
+                # The plan's audio replaces the source audio when the segments are joined
+                args += ["-map", "0:v:0", "-an"]
+            elif source.get('has_audio'):
+                # Keep the source audio, like the MoviePy backend does without an audio track
+                args += ["-map", "0:v:0", "-map", "0:a:0", "-c:a", "aac",
+                         "-ar", str(AUDIO_RATE), "-ac", "2"]
+            else:
+                # Silence, so every segment has the same streams for the concat demuxer
+                args += ["-f", "lavfi", "-t", f"{clip_duration:.3f}",
+                         "-i", f"anullsrc=r={AUDIO_RATE}:cl={AUDIO_LAYOUT}",
+                         "-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac"]
+
+            run_ffmpeg(args + [
+                "-vf", f"{normalize_filter(source['width'], source['height'], target_width, target_height)},fps={plan['fps']},setsar=1,format=yuv420p",
+                "-c:v", "libx264",
+                "-preset", settings['preset'],
+                "-crf", str(settings['crf']),
+                "-threads", str(settings['threads']),
+                "-video_track_timescale", "90000",
+                "-t", f"{clip_duration:.3f}",
+                segment_path
+            ])
+
+            segment_paths.append(segment_path)
+            total_duration += clip_duration
+
+            if progress_callback:
+                segment_progress = base_progress + (((k + 1) / num_segments) * (70 / num_videos))
+                progress_callback(int(segment_progress), f"Cut segment {k+1}/{num_segments} for video {i+1}/{num_videos}")
+
+        # Progress update for joining stage
+        render_progress = base_progress + (75 / num_videos)
+        if progress_callback:
+            progress_callback(int(render_progress), f"Joining segments for video {i+1}/{num_videos}...")
+
+        list_path = write_concat_list(segment_paths, os.path.join(work_dir, "segments.txt"))
+
+        # Match the MoviePy path: trim anything longer than the target plus a 1 second buffer
+        output_duration = total_duration
+        if output_duration > settings['target_duration'] + 1:
+            output_duration = settings['target_duration']
+
+        args = ["-f", "concat", "-safe", "0", "-i", list_path]
+        if plan['audio']:
+            args += audio_input_args(plan['audio'])
+            args += ["-map", "0:v:0", "-map", "1:a:0", "-c:a", "aac"]
+        else:
+            args += ["-c:a", "copy"]
+        args += ["-c:v", "copy", "-t", f"{output_duration:.3f}", "-movflags", "+faststart", output_path]
+        run_ffmpeg(args)
+
+        if progress_callback:
+            progress_callback(int(base_progress + (90 / num_videos)), f"Video {i+1}/{num_videos} complete!")
+        else:
+            print(f"Video {output_path} is ready!")
+
+        if os.path.exists(output_path):
+            return output_path
+        print(f"Warning: Output file was not created: {output_path}")
+        return None
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def audio_input_args(audio):
+    """
+    ffmpeg input arguments for a plan's audio: start at the planned offset and loop
+    so the audio always covers the whole video (the output is cut with -t).
+    """
+    args = ["-stream_loop", "-1"]
+    if audio.get('offset'):
+        args += ["-ss", f"{audio['offset']:.3f}"]
+    return args + ["-i", audio['path']]
+
+def build_filter_graph(plan, settings, caption_input=None):
+    """
+    Build the filter_complex graph for a plan, assuming one ffmpeg input per segment
+    (already cut with -ss/-t) followed by the optional caption image input.
+
+    Args:
+        plan: Edit decision list from plan_output in generator.py
+        settings: Render settings dict from render_plan
+        caption_input: Input index of the caption image, or None for no text
+
+    Returns:
+        str: The filter_complex graph, with the final video labelled [vout] and,
+        when the plan has no audio track, the joined source audio labelled [aout]
+    """
+    target_width = settings['target_width']
+    target_height = settings['target_height']
+    segments = plan['segments']
+    chains = []
+
+    for k, segment in enumerate(segments):
+        source = plan['sources'][segment['source']]
+        clip_duration = segment['end'] - segment['start']
+        filters = [normalize_filter(source['width'], source['height'], target_width, target_height),
+                   f"fps={plan['fps']}", "setsar=1"]
+
+        # Per-segment effects and transitions, mirroring the MoviePy backend
+        for effect in segment['effects']:
+            if effect == "colorx":
+                filters.append(f"colorchannelmixer=rr={COLORX_FACTOR}:gg={COLORX_FACTOR}:bb={COLORX_FACTOR}")
+            elif effect in ("crossfadein", "fadein"):
+                filters.append(f"fade=t=in:st=0:d={FADE_DURATION}")
+            elif effect == "fadeout":
+                filters.append(f"fade=t=out:st={max(0, clip_duration - FADE_DURATION):.3f}:d={FADE_DURATION}")
+
+        filters.append("format=yuv420p")
+        chains.append(f"[{k}:v]{','.join(filters)}[v{k}]")
+
+        # Without a plan audio track, keep the source audio (or silence) per segment
+        if not plan['audio']:
+            if source.get('has_audio'):
+                chains.append(f"[{k}:a]aformat=sample_rates={AUDIO_RATE}:channel_layouts={AUDIO_LAYOUT},"
+                              f"asetpts=PTS-STARTPTS[a{k}]")
+            else:
+                chains.append(f"anullsrc=r={AUDIO_RATE}:cl={AUDIO_LAYOUT},atrim=duration={clip_duration:.3f}[a{k}]")
+
+    concat_label = "vcat" if caption_input is not None else "vout"
+    if plan['audio']:
+        concat_inputs = "".join(f"[v{k}]" for k in range(len(segments)))
+        chains.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=0[{concat_label}]")
+    else:
+        concat_inputs = "".join(f"[v{k}][a{k}]" for k in range(len(segments)))
+        chains.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a=1[{concat_label}][aout]")
+
+    if caption_input is not None:
+        # A single still image: overlay keeps repeating its last frame for the whole video
+        chains.append(f"[vcat][{caption_input}:v]overlay=(W-w)/2:(H-h)/2:format=auto,format=yuv420p[vout]")
+
+    return ";".join(chains)
+
+def write_caption_image(caption, settings, image_path):
+    """
+    Render a plan's caption once to a transparent PNG with the same TextClip settings
+    the MoviePy backend uses, so both backends produce the same text.
+
+    Returns:
+        str: image_path, or None if the text could not be rendered
+    """
+    # Imported here because generator.py imports this module
+    from PIL import Image
+    from .generator import create_text_overlay, caption_scale
+
+    # Caption sizes are given for a full-size output
+    scale = caption_scale(settings)
+    txt_clip = create_text_overlay(
+        caption['text'],
+        (settings['target_width'], settings['target_height']),
+        color=caption['color'],
+        font_size=max(1, int(round(caption['font_size'] * scale))),
+        opacity=caption['opacity'],
+        stroke_color=caption['stroke_color'],
+        stroke_width=caption['stroke_width'] * scale
+    )
+    if txt_clip is None:
+        return None
+
+    rgb = txt_clip.get_frame(0).astype('uint8')
+    alpha = (txt_clip.mask.get_frame(0) * 255).astype('uint8')
+    image = Image.fromarray(rgb).convert("RGBA")
+    image.putalpha(Image.fromarray(alpha))
+    image.save(image_path)
+    txt_clip.close()
+    return image_path
+
+def render_filter_complex(plan, output_path, settings, progress_callback=None):
+    """
+    Render a plan with a single ffmpeg call: segments, scale/crop/pad, effects,
+    fades, caption and looped audio are all expressed as one filter_complex graph,
+    so no frames pass through Python.
+
+    Args:
+        plan: Edit decision list from plan_output in generator.py
+        output_path: Path of the video to write
+        settings: Render settings dict from render_plan
+        progress_callback: Function to report progress (progress_pct, status_message)
+
+    Returns:
+        str: Path to the written video, or None if rendering failed
+    """
+    i = plan['index']
+    num_videos = settings['num_videos']
+
+    # Calculate overall progress: each video is worth (90/num_videos)% of progress
+    base_progress = 10 + (i * (80 / num_videos))
+
+    if progress_callback:
+        progress_callback(int(base_progress), f"Building filter graph for video {i+1}/{num_videos}...")
+    else:
+        print(f"Building {output_path} with an ffmpeg filter graph...")
+
+    work_dir = tempfile.mkdtemp(prefix="graph_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        args = []
+        total_duration = 0
+
+        # One input per segment; input seeking decodes only what each segment needs
+        for segment in plan['segments']:
+            clip_duration = segment['end'] - segment['start']
+            args += ["-ss", f"{segment['start']:.3f}", "-t", f"{clip_duration:.3f}",
+                     "-i", plan['sources'][segment['source']]['path']]
+            total_duration += clip_duration
+        next_input = len(plan['segments'])
+
+        caption_input = None
+        if plan['caption']:
+            try:
+                if write_caption_image(plan['caption'], settings, os.path.join(work_dir, "caption.png")):
+                    args += ["-i", os.path.join(work_dir, "caption.png")]
+                    caption_input = next_input
+                    next_input += 1
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(int(base_progress), f"Error adding text: {e}")
+                else:
+                    print(f"Error adding text overlay: {e}")
+
+        audio_input = None
+        if plan['audio']:
+            args += audio_input_args(plan['audio'])
+            audio_input = next_input
+
+        # Match the MoviePy path: trim anything longer than the target plus a 1 second buffer
+        output_duration = total_duration
+        if output_duration > settings['target_duration'] + 1:
+            output_duration = settings['target_duration']
+
+        args += ["-filter_complex", build_filter_graph(plan, settings, caption_input), "-map", "[vout]"]
+        if audio_input is not None:
+            args += ["-map", f"{audio_input}:a:0", "-c:a", "aac"]
+        else:
+            args += ["-map", "[aout]", "-c:a", "aac"]
+        args += ["-c:v", "libx264", "-preset", settings['preset'], "-crf", str(settings['crf']),
+                 "-threads", str(settings['threads']), "-t", f"{output_duration:.3f}",
+                 "-movflags", "+faststart", output_path]
+
+        render_progress = base_progress + (75 / num_videos)
+        if progress_callback:
+            progress_callback(int(render_progress), f"Rendering video {i+1}/{num_videos}...")
+
+        run_ffmpeg(args)
+
+        if progress_callback:
+            progress_callback(int(base_progress + (90 / num_videos)), f"Video {i+1}/{num_videos} complete!")
+        else:
+            print(f"Video {output_path} is ready!")
+
+        if os.path.exists(output_path):
+            return output_path
+        print(f"Warning: Output file was not created: {output_path}")
+        return None
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
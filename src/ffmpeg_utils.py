@@ -0,0 +1,329 @@
+"""
+Helpers for driving the ffmpeg binary directly, without decoding frames in Python.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import numpy as np
+
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from .utils import normalize_geometry
+
+def get_ffmpeg_binary():
+    """
+    Get the ffmpeg binary used by MoviePy (honours the FFMPEG_BINARY setting).
+    """
+    return get_setting("FFMPEG_BINARY")
+
+def get_ffprobe_binary():
+    """
+    Get the ffprobe binary: FFPROBE_BINARY if set, otherwise the ffprobe installed
+    next to ffmpeg or on the PATH.
+
+    Returns:
+        str: Path to ffprobe, or None if it isn't available (e.g. imageio-ffmpeg only)
+    """
+    if os.environ.get("FFPROBE_BINARY"):
+        return os.environ["FFPROBE_BINARY"]
+
+    ffmpeg = get_ffmpeg_binary()
+    if os.path.dirname(ffmpeg):
+        candidate = os.path.join(os.path.dirname(ffmpeg), os.path.basename(ffmpeg).replace("ffmpeg", "ffprobe"))
+        if candidate != ffmpeg and os.path.exists(candidate):
+            return candidate
+    return shutil.which("ffprobe")
+
+def run_ffmpeg(args, loglevel="error"):
+    """
+    Run ffmpeg with the given arguments, overwriting outputs.
+
+    Args:
+        args: List of ffmpeg arguments (without the binary name)
+        loglevel: ffmpeg log level; raise it to read filter output such as showinfo
+
+    Returns:
+        str: What ffmpeg logged to stderr
+
+    Raises:
+        RuntimeError: If ffmpeg exits with a non-zero status
+    """
+    cmd = [get_ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", loglevel] + list(args)
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = result.stderr.decode('utf8', errors='ignore')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.strip()[-2000:]}")
+    return stderr
+
+# Largest jump (in frames) read through by decoding instead of seeking, as in MoviePy's reader
+SEEK_GAP_FRAMES = 100
+
+# How sample_frames picks frames: exactly at the requested times, or the nearest keyframes
+SAMPLING_STRATEGIES = ("accurate", "keyframes")
+
+def _frame_shape(width, height, pix_fmt):
+    """Shape of one raw frame: (height, width, 3) for rgb24, (height, width) for gray."""
+    return (height, width, 3) if pix_fmt == "rgb24" else (height, width)
+
+def iter_frame_batches(video_path, width, height, fps=None, pix_fmt="rgb24", batch_size=32):
+    """
+    Decode a video once, front to back, scaled down by ffmpeg before the frames reach Python.
+
+    Args:
+        video_path: Path to the video file
+        width: Width of the returned frames
+        height: Height of the returned frames
+        fps: Frame rate to decimate to (frame k is at k / fps seconds), or None for every frame
+        pix_fmt: "rgb24" for (height, width, 3) frames or "gray" for (height, width)
+        batch_size: Frames per batch (the last batch may be shorter)
+
+    Yields:
+        numpy.ndarray: uint8 arrays of shape (frames,) + frame shape, in display order
+    """
+    filters = []
+    if fps:
+        filters.append(f"fps={fps}")
+    # Area averaging keeps channel means close to those of the full-size frame
+    filters.append(f"scale={width}:{height}:flags=area")
+
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-i", video_path,
+           "-an", "-vf", ",".join(filters), "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    shape = _frame_shape(width, height, pix_fmt)
+    frame_size = int(np.prod(shape))
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=frame_size * 8)
+    try:
+        while True:
+            data = proc.stdout.read(frame_size * batch_size)
+            frames = len(data) // frame_size
+            if frames:
+                yield np.frombuffer(data[:frames * frame_size], dtype=np.uint8).reshape((frames,) + shape)
+            if frames < batch_size:
+                break
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+def iter_frames(video_path, width, height, fps=None, pix_fmt="rgb24"):
+    """
+    Decode a video once, front to back, scaled down by ffmpeg (see iter_frame_batches).
+
+    Yields:
+        numpy.ndarray: uint8 frames in display order
+    """
+    for batch in iter_frame_batches(video_path, width, height, fps, pix_fmt):
+        yield from batch
+
+def read_frames(video_path, times, width, height, pix_fmt="gray", fps=None):
+    """
+    Grab single frames at given times, scaled down by ffmpeg, in one ffmpeg process.
+
+    Nearby times are read in one forward pass; a new input with a fast seek (-ss before -i)
+    starts wherever the next time is more than SEEK_GAP_FRAMES ahead, as MoviePy's reader
+    does. Only width x height pixels per frame are piped back, instead of full-size RGB
+    frames through MoviePy.
+
+    Args:
+        video_path: Path to the video file
+        times: Times in seconds; times past the last frame get the last frame
+        width: Width of the returned frames
+        height: Height of the returned frames
+        pix_fmt: "gray" for (height, width) frames or "rgb24" for (height, width, 3)
+        fps: Frame rate of the video (probed if not given)
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (len(times),) + frame shape, in the order of `times`
+    """
+    shape = _frame_shape(width, height, pix_fmt)
+    times = np.asarray(times, dtype=np.float64).reshape(-1)
+    if not len(times):
+        return np.zeros((0,) + shape, dtype=np.uint8)
+    if not fps:
+        fps = probe_video(video_path)['fps'] or 30.0
+
+    # Distinct frames to read, in time order (so missing frames can only be the last ones)
+    frame_numbers = np.round(np.maximum(times, 0) * fps).astype(np.int64)
+    wanted, position = np.unique(frame_numbers, return_inverse=True)
+    runs = np.split(wanted, np.flatnonzero(np.diff(wanted) > SEEK_GAP_FRAMES) + 1)
+
+    inputs, chains = [], []
+    for n, run in enumerate(runs):
+        # Seek to just before the run, then keep the first frame at or after each wanted time
+        seek = max(0.0, (run[0] - 0.5) / fps)
+        length = (run[-1] - run[0] + 2) / fps
+        terms = [f"gte(t\\,{th:.6f})*not(gte(prev_pts*TB\\,{th:.6f}))"
+                 for th in ((run - 0.5) / fps - seek)]
+        inputs += ["-ss", f"{seek:.6f}", "-t", f"{length:.6f}", "-i", video_path]
+        chains.append(f"[{n}:v]select='{'+'.join(terms)}',scale={width}:{height}:flags=area,setsar=1[v{n}]")
+    graph = ";".join(chains) + ";" + "".join(f"[v{n}]" for n in range(len(runs))) + \
+        f"concat=n={len(runs)}:v=1:a=0[out]"
+
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error"] + inputs + \
+        ["-filter_complex", graph, "-map", "[out]", "-vsync", "passthrough",
+         "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frame_size = int(np.prod(shape))
+    count = min(len(result.stdout) // frame_size, len(wanted))
+
+    frames = np.frombuffer(result.stdout[:count * frame_size], dtype=np.uint8).reshape((count,) + shape)
+
+    # Times past the end of the stream get the video's last frame (not the last one read,
+    # which may be from an earlier wanted time), then map back to the caller's times
+    if count < len(wanted):
+        last_frame = _read_last_frame(video_path, width, height, pix_fmt)
+        if last_frame is None:
+            if count == 0:
+                stderr = result.stderr.decode('utf8', errors='ignore').strip()
+                raise RuntimeError(f"Could not read frames from {video_path}: {stderr[-2000:]}")
+            last_frame = frames[-1:]
+        frames = np.concatenate([frames, np.repeat(last_frame, len(wanted) - count, axis=0)])
+    return frames[position]
+
+def read_keyframes(video_path, width, height, pix_fmt="gray"):
+    """
+    Decode only the keyframes (intra frames) of a video, scaled down by ffmpeg.
+
+    With -skip_frame nokey the decoder skips every predicted frame, so this costs
+    roughly one frame decode per GOP instead of every frame.
+
+    Args:
+        video_path: Path to the video file
+        width: Width of the returned frames
+        height: Height of the returned frames
+        pix_fmt: "gray" for (height, width) frames or "rgb24" for (height, width, 3)
+
+    Returns:
+        tuple: (uint8 array of shape (keyframes,) + frame shape, float64 array of their times)
+    """
+    shape = _frame_shape(width, height, pix_fmt)
+    frame_size = int(np.prod(shape))
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "info", "-skip_frame", "nokey",
+           "-i", video_path, "-map", "0:v:0", "-an", "-vf", f"scale={width}:{height}:flags=area,showinfo",
+           "-vsync", "passthrough", "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr = result.stderr.decode('utf8', errors='ignore')
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.strip()[-2000:]}")
+
+    # showinfo logs one line per frame that reached the output, in output order
+    times = np.asarray([float(t) for t in re.findall(r"pts_time:\s*([-\d.]+)", stderr)], dtype=np.float64)
+    count = min(len(result.stdout) // frame_size, len(times))
+    frames = np.frombuffer(result.stdout[:count * frame_size], dtype=np.uint8).reshape((count,) + shape)
+    return frames, times[:count]
+
+def sample_frames(video_path, times, width, height, pix_fmt="gray", strategy="accurate", fps=None):
+    """
+    Sample frames near given times, reporting when each sample was actually taken.
+
+    Args:
+        video_path: Path to the video file
+        times: Requested times in seconds
+        width: Width of the returned frames
+        height: Height of the returned frames
+        pix_fmt: "gray" or "rgb24"
+        strategy: "accurate" reads the frame at each time (read_frames); "keyframes" decodes
+            only keyframes and uses the one nearest each time, which is much cheaper for
+            coarse analysis but may repeat a keyframe for times in the same GOP
+        fps: Frame rate of the video, if known (accurate strategy only)
+
+    Returns:
+        tuple: (uint8 array of shape (len(times),) + frame shape, float64 array of the
+        times the frames are from)
+    """
+    times = np.asarray(times, dtype=np.float64).reshape(-1)
+    if strategy == "keyframes":
+        frames, keyframe_times = read_keyframes(video_path, width, height, pix_fmt)
+        if len(frames) and len(times):
+            nearest = np.abs(keyframe_times[None, :] - times[:, None]).argmin(axis=1)
+            return frames[nearest], keyframe_times[nearest]
+        # No keyframes decoded (e.g. an unusual stream): fall back to accurate sampling
+    elif strategy != "accurate":
+        raise ValueError(f"Unknown sampling strategy: {strategy}. Choose from {', '.join(SAMPLING_STRATEGIES)}")
+
+    return read_frames(video_path, times, width, height, pix_fmt, fps), times
+
+def _read_last_frame(video_path, width, height, pix_fmt="gray"):
+    """Decode the last second of a video and return its final frame as a batch of one (or None)."""
+    shape = _frame_shape(width, height, pix_fmt)
+    frame_size = int(np.prod(shape))
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-sseof", "-1", "-i", video_path,
+           "-an", "-vf", f"scale={width}:{height}:flags=area", "-f", "rawvideo", "-pix_fmt", pix_fmt, "-"]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    count = len(result.stdout) // frame_size
+    if not count:
+        return None
+    return np.frombuffer(result.stdout[(count - 1) * frame_size:count * frame_size], dtype=np.uint8).reshape((1,) + shape)
+
+def probe_video(video_path):
+    """
+    Read the duration, size and frame rate of a video without opening a frame reader.
+
+    Args:
+        video_path: Path to the video file
+
+    Returns:
+        dict: Source description with path, duration, width, height, fps and has_audio
+    """
+    infos = ffmpeg_parse_infos(video_path)
+    width, height = infos['video_size']
+    return {
+        'path': video_path,
+        'duration': infos['duration'],
+        'width': width,
+        'height': height,
+        'fps': infos['video_fps'],
+        'has_audio': infos['audio_found'],
+    }
+
+def normalize_filter(width, height, target_width=1080, target_height=1920):
+    """
+    Build an ffmpeg filter that normalizes a frame of the given size to the target size,
+    using the same geometry as FrameNormalizer (see normalize_geometry in utils.py):
+    vertical videos fill the frame (center crop), horizontal videos are
+    letterboxed with black bars on top and bottom.
+
+    Args:
+        width: Source width in pixels
+        height: Source height in pixels
+        target_width: Output width in pixels
+        target_height: Output height in pixels
+
+    Returns:
+        str: Comma separated ffmpeg filter chain
+    """
+    if (width, height) == (target_width, target_height):
+        # Already normalized (e.g. a proxy from proxy_cache.py)
+        return "null"
+
+    (crop_x, crop_y, crop_w, crop_h), (dest_x, dest_y, dest_w, dest_h) = normalize_geometry(
+        width, height, target_width, target_height)
+
+    filters = []
+    if (crop_w, crop_h) != (width, height):
+        filters.append(f"crop={crop_w}:{crop_h}:{crop_x}:{crop_y}")
+    filters.append(f"scale={dest_w}:{dest_h}")
+    if (dest_w, dest_h) != (target_width, target_height):
+        filters.append(f"pad={target_width}:{target_height}:{dest_x}:{dest_y}:black")
+    return ",".join(filters)
+
+def write_concat_list(paths, list_path):
+    """
+    Write a list file for ffmpeg's concat demuxer.
+
+    Args:
+        paths: Paths of the files to join, in order
+        list_path: Where to write the list file
+
+    Returns:
+        str: The list file path
+    """
+    with open(list_path, "w") as f:
+        for path in paths:
+            # The concat demuxer uses single quotes, so escape any in the path
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
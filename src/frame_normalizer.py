@@ -0,0 +1,59 @@
+"""
+Single-step frame normalization with OpenCV.
+"""
+
+import numpy as np
+import cv2
+
+from .utils import normalize_geometry
+
+class FrameNormalizer:
+    """
+    Normalizes frames of one source size to the output size with a single cv2.resize.
+    
+    The crop, scale and letterbox are worked out once from the source size. Each frame is
+    then resized straight into a preallocated output buffer whose black bars never change,
+    so no intermediate frames are allocated.
+    
+    The returned frame is the shared buffer and is overwritten by the next call,
+    so use one normalizer per clip and copy a frame if it must be kept.
+    """
+    
+    def __init__(self, width, height, target_width=1080, target_height=1920):
+        """
+        Precompute the transform for a source size.
+        
+        Args:
+            width: Source width in pixels
+            height: Source height in pixels
+            target_width: Output width in pixels
+            target_height: Output height in pixels
+        """
+        (crop_x, crop_y, crop_w, crop_h), (dest_x, dest_y, dest_w, dest_h) = normalize_geometry(
+            width, height, target_width, target_height)
+        
+        self.source_size = (width, height)
+        self.size = (target_width, target_height)
+        self.source_window = (slice(crop_y, crop_y + crop_h), slice(crop_x, crop_x + crop_w))
+        self.dest_size = (dest_w, dest_h)
+        
+        # Area averaging when shrinking, bilinear when enlarging (same choice as MoviePy's resize)
+        self.interpolation = cv2.INTER_AREA if dest_w < crop_w else cv2.INTER_LINEAR
+        
+        # Black output frame; only the picture area is ever written to
+        self.buffer = np.zeros((target_height, target_width, 3), dtype=np.uint8)
+        self.dest = self.buffer[dest_y:dest_y + dest_h, dest_x:dest_x + dest_w]
+    
+    def __call__(self, frame):
+        """
+        Normalize one RGB frame.
+        
+        Args:
+            frame: HxWx3 uint8 frame of the source size
+            
+        Returns:
+            The normalized frame (the shared output buffer)
+        """
+        cv2.resize(frame[self.source_window], self.dest_size, dst=self.dest,
+                   interpolation=self.interpolation)
+        return self.buffer
@@ -1,8 +1,13 @@
 import os, random
 import warnings
 import hashlib
+import json
+import queue
+import traceback
+import multiprocessing
 import numpy as np
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips, CompositeVideoClip, TextClip, ColorClip
 # Import specific effects
 from moviepy.video.fx.loop import loop
@@ -18,6 +23,14 @@ from moviepy.video.fx.blackwhite import blackwhite
 
 from .utils import get_video_files, get_random_clip, pad_clip_to_ratio, prepare_clip_for_concat
 from .video_analysis import VideoContentAnalyzer
+from .ffmpeg_render import render_stream_copy, render_filter_complex
+from .ffmpeg_utils import probe_video
+from .frame_normalizer import FrameNormalizer
+from .keyframes import KeyframeIndex
+from .similarity import SignatureMatrix, FingerprintTimeline, scan_sources, segment_matrix
+from .source_scan import restrict_to_shots
+from .ann_index import EXACT_LIMIT
+from .encode_profiles import encode_settings, DEFAULT_PROFILE
 
 # Suppress MoviePy warnings that might confuse users
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -34,7 +47,9 @@ class VideoGenerator:
         self.video_analyzer = VideoContentAnalyzer()
         
     def generate_scrambled_videos(self, num_videos=5, segment_duration=0.5, output_dir="outputs", 
-                                 additional_videos=None, audio_path=None, text_overlay=None):
+                                 additional_videos=None, audio_path=None, text_overlay=None, workers=1,
+                                 proxy_cache=None, use_effects=True, encode_profile=DEFAULT_PROFILE,
+                                 plans_path=None, progress_callback=None, output_callback=None):
         """
         Generate multiple unique scrambled versions of the input video(s).
         
@@ -51,6 +66,13 @@ class VideoGenerator:
                 - font_size: Size of the text
                 - stroke_width: Width of the stroke
                 - opacity: Text opacity (0-1)
+            workers (int): Number of processes used to render outputs in parallel
+            proxy_cache (ProxyCache): Cache of normalized proxies to render from, or None
+            use_effects (bool): Whether to use AI effects and transitions
+            encode_profile (str): Encode profile name: "preview", "draft", "standard" or "archive"
+            plans_path (str): Save the batch's plans here, for render_selected
+            progress_callback (callable): Function to report progress (progress_pct, status_message)
+            output_callback (callable): Function called with the path of each video as it is written
         """
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -70,18 +92,60 @@ class VideoGenerator:
             min_clip_duration=1.5,
             max_clip_duration=3.5,
             output_dir=output_dir,
-            use_effects=True,
+            use_effects=use_effects,
             use_text=bool(text_overlay),
             custom_text=text_overlay['text'] if text_overlay and 'text' in text_overlay else None,
             text_color=text_overlay['color'] if text_overlay and 'color' in text_overlay else '#FFFFFF',
             stroke_color=text_overlay['stroke_color'] if text_overlay and 'stroke_color' in text_overlay else '#000000',
             font_size=text_overlay['font_size'] if text_overlay and 'font_size' in text_overlay else 60,
             stroke_width=text_overlay['stroke_width'] if text_overlay and 'stroke_width' in text_overlay else 2,
-            text_opacity=text_overlay['opacity'] if text_overlay and 'opacity' in text_overlay else 1.00
+            text_opacity=text_overlay['opacity'] if text_overlay and 'opacity' in text_overlay else 1.00,
+            workers=workers,
+            proxy_cache=proxy_cache,
+            encode_profile=encode_profile,
+            plans_path=plans_path,
+            progress_callback=progress_callback,
+            output_callback=output_callback
         )
         
         return output_paths
 
+    def render_selected(self, plans_path, output_names, output_dir="outputs", encode_profile=DEFAULT_PROFILE,
+                        workers=1, proxy_cache=None, progress_callback=None, output_callback=None):
+        """
+        Render chosen outputs of a saved batch again, e.g. approved previews at full quality.
+        
+        The edits come from the saved plans, so each video matches its preview.
+        
+        Args:
+            plans_path (str): Plans saved by generate_scrambled_videos(plans_path=...)
+            output_names (list): File names of the outputs to render (e.g. "output_02.mp4")
+            output_dir (str): Directory to save output videos
+            encode_profile (str): Encode profile name for the final render
+            workers (int): Number of processes used to render outputs in parallel
+            proxy_cache (ProxyCache): Cache the batch's proxies came from, to rebuild evicted ones
+            progress_callback (callable): Function to report progress (progress_pct, status_message)
+            output_callback (callable): Function called with the path of each video as it is written
+            
+        Returns:
+            list: Paths to the generated video files
+        """
+        plans = load_plans(plans_path)
+        selected = [plan for plan in plans if plan['output_name'] in set(output_names)]
+        if not selected:
+            return []
+        resolve_sources(selected, proxy_cache)
+        
+        return render_batch(
+            selected,
+            output_dir=output_dir,
+            num_videos=len(plans),
+            encode_profile=encode_profile,
+            workers=workers,
+            progress_callback=progress_callback,
+            output_callback=output_callback
+        )
+
     def generate_scrambled_video(self, segment_duration, output_dir="outputs", additional_videos=None, audio_path=None):
         """
         Generate a single scrambled version of the input video(s).
@@ -159,18 +223,33 @@ INPUT_VIDEO_PATH = "../assets/input_videos"
 INPUT_AUDIO_PATH = "../assets/input_audio/audio.mp3"
 OUTPUT_PATH = "../outputs"
 
+# Target duration for output videos (16 seconds)
+TARGET_DURATION = 16.0
+
+# Set consistent dimensions for output videos
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+
 # Initialize video analyzer
 video_analyzer = VideoContentAnalyzer()
 
+# Keyframe times per source, used to place segment starts on keyframes
+keyframe_index = KeyframeIndex()
+
 def generate_batch(input_videos, audio_files=None, num_videos=5, min_clips=10, max_clips=30, 
                    min_clip_duration=1.5, max_clip_duration=3.5, output_dir="outputs", 
                    use_effects=False, use_text=False, custom_text=None, text_color='#FFFFFF',
                    stroke_color='#000000', font_size=60, stroke_width=2, text_opacity=1.00, 
-                   progress_callback=None):
+                   progress_callback=None, workers=1, stream_copy=True, backend="moviepy",
+                   proxy_cache=None, keyframe_mode=None, keyframe_tolerance=0.5,
+                   encode_profile=DEFAULT_PROFILE, plans_path=None,
+                   output_callback=None):
     """
     Generate a batch of videos by randomly selecting clips from input videos
     and concatenating them.
     
+    This is plan_batch followed by render_plan for every plan.
+    
     Parameters:
         input_videos (list): List of paths to input video files
         audio_files (list, optional): List of paths to audio files
@@ -189,15 +268,43 @@ def generate_batch(input_videos, audio_files=None, num_videos=5, min_clips=10, m
         stroke_width (int): Width of the text stroke (default: 2)
         text_opacity (float): Opacity of the text overlay (default: 1.00)
         progress_callback (callable): Function to report progress (progress_pct, status_message)
+        workers (int): Number of processes used to render outputs in parallel (default: 1).
+            Every output is planned up front, so clip selection and output naming
+            stay the same whichever value is used.
+        stream_copy (bool): Use the ffmpeg stream-copy fast path for outputs without
+            effects or text (default: True)
+        backend (str): "moviepy" to build frames with MoviePy, or "ffmpeg" to render each
+            output as a single ffmpeg filter_complex graph (default: "moviepy")
+        proxy_cache (ProxyCache, optional): Cache of normalized proxies to render from
+            instead of the original files
+        keyframe_mode (str, optional): "snap" to move segment starts to a nearby keyframe,
+            "prefer" to also fall back to a random keyframe when none is that close, or
+            None to keep the random start times (default: None)
+        keyframe_tolerance (float): How far (in seconds) a start may move to a keyframe (default: 0.5)
+        encode_profile (str or dict): Encode profile from encode_profiles.py ("draft",
+            "standard" or "archive") setting output size, x264 preset and CRF (default: "standard")
+        plans_path (str, optional): Also save the batch's plans to this JSON file, so chosen
+            outputs can be rendered again later (e.g. previews at full quality, see render_batch)
+        output_callback (callable, optional): Function called with the path of each video as
+            soon as it is written, e.g. to add it to a download archive
     
     Returns:
         list: Paths to the generated video files
     """
-    # Target duration for output videos (16 seconds)
-    TARGET_DURATION = 16.0
-    
     if not input_videos:
         raise ValueError("No input videos provided")
+    
+    # Fail on an unknown profile before any work is done
+    encode_settings(encode_profile)
+    
+    # Transcode each input once into a normalized proxy, reused by later batches.
+    # Remember the original of each proxy, so saved plans can still be rendered after
+    # the proxy was evicted (see resolve_sources)
+    originals = {}
+    if proxy_cache is not None:
+        proxies = proxy_cache.ingest(input_videos, progress_callback)
+        originals = {proxy: original for proxy, original in zip(proxies, input_videos) if proxy != original}
+        input_videos = proxies
 
     if progress_callback:
         progress_callback(0, f"Loading {len(input_videos)} videos...")
@@ -207,13 +314,16 @@ def generate_batch(input_videos, audio_files=None, num_videos=5, min_clips=10, m
     # Load all input videos as MoviePy clips
     try:
         input_clips = [VideoFileClip(video_path) for video_path in input_videos]
+        source_paths = list(input_videos)
     except Exception as e:
         # If we fail to load some videos, try to load them one by one to identify which ones work
         input_clips = []
+        source_paths = []
         for video_path in input_videos:
             try:
                 clip = VideoFileClip(video_path)
                 input_clips.append(clip)
+                source_paths.append(video_path)
                 if progress_callback:
                     progress_callback(5, f"Successfully loaded {os.path.basename(video_path)}")
                 else:
@@ -231,432 +341,1030 @@ def generate_batch(input_videos, audio_files=None, num_videos=5, min_clips=10, m
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Create a global history of used clip segments across all videos in batch
-    # This tracks which parts of which clips have been used to avoid reuse across the batch
-    clip_history = {}  # Maps clip_index to a list of (start_time, end_time) tuples
-    
     # Track visual similarity of clips to avoid similar looking clips
-    # Create a visual fingerprint for each video to compare similarity
+    # Fingerprint each video over time and find its shot cuts (one low-resolution
+    # decode per source), so segments can be compared, not just whole videos
+    if progress_callback:
+        progress_callback(5, "Creating visual signatures for clip diversity...")
+    window = 0.5
+    scans = scan_sources(source_paths, window, cache=video_analyzer.feature_cache)
+    timelines = [FingerprintTimeline(scan['timeline'], window) if scan is not None else None for scan in scans]
+    shots = [scan['shots'] if scan is not None else None for scan in scans]
+    
+    # Whole-video signatures for choosing the next source are the timeline averages
+    visual_signatures = None
     if len(input_clips) > 1:  # Only calculate if we have multiple clips
-        if progress_callback:
-            progress_callback(5, "Creating visual signatures for clip diversity...")
-        visual_signatures = create_video_signatures(input_clips)
+        visual_signatures = {
+            i: timeline.segment_vector(0, timeline.duration)
+            for i, timeline in enumerate(timelines) if timeline is not None and len(timeline)
+        }
+    
+    # Plan every output before rendering anything, so the random choices
+    # (and therefore the batch) do not depend on how the renders are scheduled
+    text_style = None
+    if use_text:
+        text_style = {
+            'color': text_color,
+            'stroke_color': stroke_color,
+            'font_size': font_size,
+            'stroke_width': stroke_width,
+            'opacity': text_opacity,
+        }
+    
+    sources = [describe_source(path, clip) for path, clip in zip(source_paths, input_clips)]
+    for source in sources:
+        if source['path'] in originals:
+            source['original'] = originals[source['path']]
+    
+    plans = plan_batch(
+        sources,
+        num_videos=num_videos,
+        audio_files=audio_files,
+        use_effects=use_effects,
+        use_text=use_text,
+        custom_text=custom_text,
+        text_style=text_style,
+        visual_signatures=visual_signatures,
+        timelines=timelines,
+        shots=shots,
+        keyframe_mode=keyframe_mode,
+        keyframe_tolerance=keyframe_tolerance,
+        progress_callback=progress_callback
+    )
+    
+    if plans_path:
+        save_plans(plans, plans_path)
+    
+    try:
+        output_paths = render_batch(
+            plans,
+            output_dir=output_dir,
+            num_videos=num_videos,
+            input_clips=input_clips,
+            backend=backend,
+            stream_copy=stream_copy,
+            encode_profile=encode_profile,
+            workers=workers,
+            progress_callback=progress_callback,
+            output_callback=output_callback
+        )
+    finally:
+        # Clean up
+        for clip in input_clips:
+            clip.close()
+    
+    return output_paths
+
+def render_batch(plans, output_dir="outputs", num_videos=None, input_clips=None, backend="moviepy",
+                 stream_copy=True, encode_profile=DEFAULT_PROFILE, workers=1,
+                 progress_callback=None, output_callback=None):
+    """
+    Render plans from plan_batch (or load_plans) with one encode profile.
+    
+    Rendering the same plans again with another profile gives the same edits, so a
+    batch can be previewed with the "preview" profile and only the chosen outputs
+    rendered at full quality.
+    
+    Args:
+        plans: Plans to render, e.g. a selection of a saved batch
+        output_dir: Directory to write the videos to
+        num_videos: Size of the batch the plans came from, for progress (default: len(plans))
+        input_clips: Loaded clips for the plans' sources; each render opens its own if None
+        backend: "moviepy" or "ffmpeg", as for generate_batch
+        stream_copy: Use the ffmpeg stream-copy fast path for plain plans
+        encode_profile: Encode profile name or dict, see encode_profiles.py
+        workers: Number of processes used to render outputs in parallel
+        progress_callback: Function to report progress (progress_pct, status_message)
+        output_callback: Function called with the path of each video as soon as it is written
+        
+    Returns:
+        list: Paths to the generated video files
+    """
+    render_settings = {
+        'num_videos': num_videos or max(len(plans), max((plan['index'] + 1 for plan in plans), default=0)),
+        'backend': backend,
+        'stream_copy': stream_copy,
+        'target_duration': TARGET_DURATION,
+        **encode_settings(encode_profile, workers=workers if workers and workers > 1 else 1),
+    }
+    
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    if workers and workers > 1 and len(plans) > 1:
+        output_paths = render_plans_parallel(plans, output_dir, render_settings, workers=workers,
+                                             progress_callback=progress_callback, output_callback=output_callback)
     else:
-        visual_signatures = None
+        output_paths = []
+        for plan in plans:
+            output_path = render_plan(plan, output_dir, render_settings, input_clips, progress_callback)
+            if output_path:
+                output_paths.append(output_path)
+                if output_callback:
+                    output_callback(output_path)
+    
+    # Final progress update
+    if progress_callback:
+        progress_callback(100, f"All {len(output_paths)} videos complete!")
+    
+    return output_paths
+
+# Version of the edit decision list (EDL) format produced by plan_output
+EDL_VERSION = 1
+
+# How many times an output is planned again when it repeats an earlier output's edit
+PLAN_ATTEMPTS = 3
+
+def describe_source(video_path, clip=None):
+    """
+    Describe an input video for a plan: path, duration, size and frame rate.
+    
+    Args:
+        video_path: Path to the video file
+        clip: Already loaded VideoFileClip for the path, to avoid probing it again
         
-    output_paths = []
+    Returns:
+        dict: Source description with path, duration, width, height, fps and has_audio
+    """
+    if clip is not None:
+        width, height = clip.size
+        return {
+            'path': video_path,
+            'duration': clip.duration,
+            'width': width,
+            'height': height,
+            'fps': clip.fps,
+            'has_audio': clip.audio is not None,
+        }
+    return probe_video(video_path)
+
+def plan_batch(sources, num_videos=5, audio_files=None, use_effects=False, use_text=False,
+               custom_text=None, text_style=None, visual_signatures=None, timelines=None,
+               shots=None, keyframe_mode=None, keyframe_tolerance=0.5, progress_callback=None):
+    """
+    Plan a batch of outputs without decoding or encoding anything.
     
-    # Set consistent dimensions for output videos
-    TARGET_WIDTH = 1080
-    TARGET_HEIGHT = 1920
+    Each plan is a JSON-serializable edit decision list (EDL) that render_plan
+    can turn into a video, now or later (see save_plans/load_plans).
     
+    Args:
+        sources: List of video paths or source dicts from describe_source
+        num_videos: Number of outputs to plan
+        audio_files: List of audio paths to choose from
+        use_effects: Whether effects and transitions may be used
+        use_text: Whether each output gets a caption
+        custom_text: Caption to use instead of a random one
+        text_style: Dict with color, stroke_color, font_size, stroke_width and opacity
+        visual_signatures: Dict of source index -> whole-video signature (or a SignatureMatrix), or None
+        timelines: FingerprintTimeline per source from build_timelines, or None; used to
+            place segments so they look unlike the ones just before them
+        shots: Sorted shot cut times per source (from source_scan), or None; segments are
+            kept inside a single shot where the free ranges allow it
+        keyframe_mode: "snap", "prefer" or None, see KeyframeIndex.place
+        keyframe_tolerance: How far (in seconds) "snap" may move a segment start
+        progress_callback: Function to report progress (progress_pct, status_message)
+        
+    Returns:
+        list: Plans for the outputs that got at least one segment
+    """
+    sources = [describe_source(source) if isinstance(source, str) else source for source in sources]
+    
+    # Compare signatures through one similarity matrix for the whole batch
+    if visual_signatures and not isinstance(visual_signatures, SignatureMatrix):
+        visual_signatures = SignatureMatrix(visual_signatures)
+    
+    # Create a global history of used clip segments across all videos in batch
+    # This tracks which parts of which clips have been used to avoid reuse across the batch
+    clip_history = {}  # Maps clip_index to a list of (start_time, end_time) tuples
+    
+    plans = []
+    fingerprints = set()
     for i in range(num_videos):
-        # Calculate overall progress: each video is worth (90/num_videos)% of progress
-        base_progress = 10 + (i * (80 / num_videos))
+        # Plan again when the edit repeats an earlier output (its segments are in
+        # clip_history by now, so the next attempt picks others)
+        for _ in range(PLAN_ATTEMPTS):
+            plan = plan_output(
+                i, num_videos, sources, clip_history, visual_signatures,
+                audio_files=audio_files,
+                use_effects=use_effects,
+                use_text=use_text,
+                custom_text=custom_text,
+                text_style=text_style,
+                timelines=timelines,
+                shots=shots,
+                keyframe_mode=keyframe_mode,
+                keyframe_tolerance=keyframe_tolerance,
+                progress_callback=progress_callback
+            )
+            fingerprint = plan_fingerprint(plan) if plan['segments'] else None
+            if fingerprint not in fingerprints:
+                break
+        
+        if fingerprint in fingerprints:
+            if progress_callback:
+                progress_callback(int(10 + (i * (80 / num_videos))), f"Warning: Video {i+1} repeats an earlier video, skipping it")
+            else:
+                print(f"Warning: {plan['output_name']} repeats an earlier output, skipping it")
+            continue
         
+        if not plan['segments']:
+            base_progress = 10 + (i * (80 / num_videos))
+            if progress_callback:
+                progress_callback(int(base_progress), f"Warning: No valid clips could be extracted for video {i+1}")
+            else:
+                print(f"Warning: No valid clips could be extracted for {plan['output_name']}")
+            continue
+        
+        fingerprints.add(fingerprint)
+        plans.append(plan)
+    
+    return plans
+
+def plan_output(i, num_videos, sources, clip_history, visual_signatures, audio_files=None,
+                use_effects=False, use_text=False, custom_text=None, text_style=None,
+                timelines=None, shots=None, keyframe_mode=None, keyframe_tolerance=0.5,
+                progress_callback=None):
+    """
+    Choose the clips, effects, caption and audio for a single output video.
+    
+    Nothing is decoded here: only source durations and visual signatures are used.
+    clip_history is updated in place so later outputs avoid the same segments.
+    
+    Args:
+        i: Index of the output in the batch
+        num_videos: Number of videos in the batch
+        sources: List of source dicts from describe_source
+        clip_history: Batch-wide dict of clip_index -> list of (start, end) tuples
+        visual_signatures: SignatureMatrix of the batch, or None
+        timelines: FingerprintTimeline per source, or None
+        shots: Sorted shot cut times per source, or None
+        audio_files: List of audio paths to choose from
+        use_effects: Whether effects and transitions may be used
+        use_text: Whether a caption should be picked
+        custom_text: Caption to use instead of a random one
+        text_style: Dict with color, stroke_color, font_size, stroke_width and opacity
+        keyframe_mode: "snap", "prefer" or None, see KeyframeIndex.place
+        keyframe_tolerance: How far (in seconds) "snap" may move a segment start
+        progress_callback: Function to report progress (progress_pct, status_message)
+        
+    Returns:
+        dict: Edit decision list with the output name, sources, segments
+        (source index, start, end, effects), caption and audio (path, offset)
+    """
+    # Calculate overall progress: each video is worth (90/num_videos)% of progress
+    base_progress = 10 + (i * (80 / num_videos))
+    
+    if progress_callback:
+        progress_callback(int(base_progress), f"Planning video {i+1}/{num_videos}...")
+    
+    # Calculate clip parameters based on target duration
+    # For 16 second videos, adjust number and duration of clips
+    # Aim for ~10-12 clips with 1.5-2 seconds each to fit in 16 seconds
+    min_clip_count = 8  # Reduced to fit target duration
+    max_clip_count = 15
+    num_clips = random.randint(min_clip_count, max_clip_count)
+    
+    # Calculate average clip duration to fit target duration
+    avg_clip_duration = TARGET_DURATION / num_clips
+    # Add some variation around the average
+    min_clip_dur = max(0.5, avg_clip_duration * 0.7)  # Min 0.5 seconds
+    max_clip_dur = avg_clip_duration * 1.3  # Max 1.3x the average
+    
+    # Randomly selected segments
+    segments = []
+    total_duration = 0
+    
+    # Track the already used clips for this video to avoid repetition
+    # Keep last N clips to avoid repetition of similar clips
+    used_clips_memory = []
+    memory_size = min(5, len(sources) // 2)  # Remember last 5 clips or half of available clips
+    
+    # Initialize local clip history for this video
+    local_clip_history = defaultdict(list)
+    
+    for j in range(num_clips):
+        # Progress update for clip selection
+        clip_progress = base_progress + ((j / num_clips) * (20 / num_videos))
         if progress_callback:
-            progress_callback(int(base_progress), f"Building video {i+1}/{num_videos}...")
-        else:
-            print(f"Building {output_dir}/output_{i+1:02d}.mp4 using MoviePy...")
+            progress_callback(int(clip_progress), f"Selecting clip {j+1}/{num_clips} for video {i+1}/{num_videos}")
         
-        # Generate unique output filename for this video
-        output_filename = f"output_{i+1:02d}.mp4"
-        output_path = os.path.join(output_dir, output_filename)
+        # Get available clip indices, avoiding recently used clips
+        available_clip_indices = list(range(len(sources)))
         
-        # Calculate clip parameters based on target duration
-        # For 16 second videos, adjust number and duration of clips
-        # Aim for ~10-12 clips with 1.5-2 seconds each to fit in 16 seconds
-        min_clip_count = 8  # Reduced to fit target duration
-        max_clip_count = 15
-        num_clips = random.randint(min_clip_count, max_clip_count)
-        
-        # Calculate average clip duration to fit target duration
-        avg_clip_duration = TARGET_DURATION / num_clips
-        # Add some variation around the average
-        min_clip_dur = max(0.5, avg_clip_duration * 0.7)  # Min 0.5 seconds
-        max_clip_dur = avg_clip_duration * 1.3  # Max 1.3x the average
-        
-        # Randomly select clips and durations
-        selected_clips = []
-        total_duration = 0
-        
-        # Track the already used clips for this video to avoid repetition
-        # Keep last N clips to avoid repetition of similar clips
-        used_clips_memory = []
-        memory_size = min(5, len(input_clips) // 2)  # Remember last 5 clips or half of available clips
-        
-        # Initialize local clip history for this video
-        local_clip_history = defaultdict(list)
-        
-        for j in range(num_clips):
-            # Progress update for clip selection
-            clip_progress = base_progress + ((j / num_clips) * (20 / num_videos))
-            if progress_callback:
-                progress_callback(int(clip_progress), f"Selecting clip {j+1}/{num_clips} for video {i+1}/{num_videos}")
-            
-            # Get available clip indices, avoiding recently used clips
-            available_clip_indices = list(range(len(input_clips)))
-            
-            # Remove recently used clips from consideration
-            for used_idx in used_clips_memory:
-                if used_idx in available_clip_indices and len(available_clip_indices) > 1:
-                    available_clip_indices.remove(used_idx)
-            
-            # If we have visual signatures, try to select dissimilar clips
-            if visual_signatures and len(available_clip_indices) > 1:
-                # If we have at least one selected clip already, try to find a dissimilar one
-                if selected_clips:
-                    clip_index = select_dissimilar_clip(
-                        available_clip_indices, 
-                        used_clips_memory, 
-                        visual_signatures
-                    )
-                else:
-                    # For the first clip, just choose randomly
-                    clip_index = random.choice(available_clip_indices)
+        # Remove recently used clips from consideration
+        for used_idx in used_clips_memory:
+            if used_idx in available_clip_indices and len(available_clip_indices) > 1:
+                available_clip_indices.remove(used_idx)
+        
+        # If we have visual signatures, try to select dissimilar clips
+        if visual_signatures and len(available_clip_indices) > 1:
+            # If we have at least one selected clip already, try to find a dissimilar one
+            if segments:
+                clip_index = select_dissimilar_clip(
+                    available_clip_indices, 
+                    used_clips_memory, 
+                    visual_signatures
+                )
             else:
-                # If no visual signatures or only one clip available, choose randomly
+                # For the first clip, just choose randomly
                 clip_index = random.choice(available_clip_indices)
-                
-            input_clip = input_clips[clip_index]
-            
-            # Add to used clips memory
-            used_clips_memory.append(clip_index)
-            if len(used_clips_memory) > memory_size:
-                used_clips_memory.pop(0)  # Remove oldest
-            
-            # Calculate remaining duration needed to hit the target
-            remaining_clips = num_clips - j
-            remaining_duration = max(0, TARGET_DURATION - total_duration)
-            
-            # Adjust duration for this clip
-            if remaining_clips > 1:
-                # Leave some duration for remaining clips
-                max_this_clip = min(max_clip_dur, remaining_duration / remaining_clips * 1.5)
-                clip_duration = random.uniform(min_clip_dur, max_this_clip)
-            else:
-                # Last clip - use remaining duration
-                clip_duration = min(max_clip_dur, remaining_duration)
-                clip_duration = max(min_clip_dur, clip_duration)  # Ensure minimum duration
+        else:
+            # If no visual signatures or only one clip available, choose randomly
+            clip_index = random.choice(available_clip_indices)
             
-            # Determine a random start time for the clip that avoids previously used segments
-            max_start = max(0, input_clip.duration - clip_duration)
-            if max_start <= 0:
-                continue  # Skip if the clip is too short
+        source_duration = sources[clip_index]['duration']
+        
+        # Add to used clips memory
+        used_clips_memory.append(clip_index)
+        if len(used_clips_memory) > memory_size:
+            used_clips_memory.pop(0)  # Remove oldest
+        
+        # Calculate remaining duration needed to hit the target
+        remaining_clips = num_clips - j
+        remaining_duration = max(0, TARGET_DURATION - total_duration)
+        
+        # Adjust duration for this clip
+        if remaining_clips > 1:
+            # Leave some duration for remaining clips
+            max_this_clip = min(max_clip_dur, remaining_duration / remaining_clips * 1.5)
+            clip_duration = random.uniform(min_clip_dur, max_this_clip)
+        else:
+            # Last clip - use remaining duration
+            clip_duration = min(max_clip_dur, remaining_duration)
+            clip_duration = max(min_clip_dur, clip_duration)  # Ensure minimum duration
+        
+        # Determine a random start time for the clip that avoids previously used segments
+        max_start = max(0, source_duration - clip_duration)
+        if max_start <= 0:
+            continue  # Skip if the clip is too short
+        
+        # Find available segments that haven't been used yet (globally or locally)
+        available_segments = find_available_segments(
+            clip_index, clip_duration, source_duration,
+            global_history=clip_history.get(clip_index, []),
+            local_history=local_clip_history.get(clip_index, [])
+        )
+        
+        # If no available segments, try another clip
+        if not available_segments:
+            continue
+        
+        # Keep the clip inside one shot when a free range allows it, so it
+        # doesn't start or end right on the other side of a cut
+        if shots is not None and shots[clip_index] is not None:
+            in_shot_segments = restrict_to_shots(available_segments, shots[clip_index], clip_duration)
+            if in_shot_segments:
+                available_segments = in_shot_segments
             
-            # Find available segments that haven't been used yet (globally or locally)
-            available_segments = find_available_segments(
-                clip_index, clip_duration, input_clip.duration,
-                global_history=clip_history.get(clip_index, []),
-                local_history=local_clip_history.get(clip_index, [])
+        # Choose a random segment from available ones; with fingerprint timelines, the
+        # placement least like the last few segments of this video wins
+        if timelines is not None and segments and timelines[clip_index] is not None:
+            recent_segments = [(s['source'], s['start'], s['end']) for s in segments[-max(1, memory_size):]]
+            segment_start, segment_end, start_time = select_dissimilar_segment(
+                clip_index, available_segments, clip_duration, recent_segments, timelines
             )
-            
-            # If no available segments, try another clip
-            if not available_segments:
-                # Try again with a different clip
-                j -= 1  # Repeat this iteration
-                continue
-                
-            # Choose a random segment from available ones
+        else:
             segment_start, segment_end = random.choice(available_segments)
             start_time = random.uniform(segment_start, segment_end - clip_duration)
-            
-            # Record this usage in both global and local history
-            used_segment = (start_time, start_time + clip_duration)
-            if clip_index not in clip_history:
-                clip_history[clip_index] = []
-            clip_history[clip_index].append(used_segment)
-            
-            if clip_index not in local_clip_history:
-                local_clip_history[clip_index] = []
-            local_clip_history[clip_index].append(used_segment)
-            
-            # Extract the subclip
-            try:
-                subclip = input_clip.subclip(start_time, start_time + clip_duration)
-                
-                # Ensure consistent dimensions and padding for all clips
-                processed_clip = ensure_consistent_dimensions(subclip)
-                
-                # Apply AI-powered effects if enabled (but with reduced probability)
-                if use_effects and random.random() < 0.3:  # Only 30% chance of effects
-                    try:
-                        processed_clip = apply_smart_effects(processed_clip, intensity=0.3)
-                    except Exception as e:
-                        print(f"Error applying effects to clip: {e}")
-                
-                selected_clips.append(processed_clip)
-                total_duration += clip_duration
-                
-            except Exception as e:
-                print(f"Error processing clip: {e}")
+        
+        # Start on a keyframe where possible, so the cut doesn't have to decode
+        # from the previous keyframe (stays inside the free segment)
+        if keyframe_mode:
+            start_time = keyframe_index.place(
+                sources[clip_index]['path'], start_time,
+                lower=segment_start, upper=segment_end - clip_duration,
+                tolerance=keyframe_tolerance, mode=keyframe_mode
+            )
+        
+        # Record this usage in both global and local history
+        used_segment = (start_time, start_time + clip_duration)
+        if clip_index not in clip_history:
+            clip_history[clip_index] = []
+        clip_history[clip_index].append(used_segment)
+        local_clip_history[clip_index].append(used_segment)
+        
+        # Pick AI-powered effects if enabled (but with reduced probability)
+        effects = []
+        if use_effects and random.random() < 0.3:  # Only 30% chance of effects
+            effect = choose_smart_effect()
+            if effect:
+                effects.append(effect)
+        
+        segments.append({
+            'source': clip_index,
+            'start': start_time,
+            'end': start_time + clip_duration,
+            'effects': effects,
+        })
+        total_duration += clip_duration
+        
+        # If we've reached the target duration, stop adding clips
+        if total_duration >= TARGET_DURATION:
+            break
+    
+    # Simple transitions: the first clip fades in, the last one fades out
+    if use_effects and segments:
+        segments[0]['effects'].append("fadein")
+        if len(segments) > 1:
+            segments[-1]['effects'].append("fadeout")
+    
+    # Pick the caption now so it doesn't depend on render order
+    caption = None
+    if use_text:
+        # Use custom text if provided, otherwise generate a random caption
+        if custom_text:
+            text = custom_text
+        else:
+            # Generate a random caption
+            captions = [
+                "WATCH TILL THE END 😱",
+                "POV: When the beat drops 🔥",
+                "This is INSANE 🤯",
+                "Wait for it... 👀",
+                "Best moments 💯",
+                "Try not to be amazed 😮",
+                "Crazy skills 💪",
+                "Ultimate compilation 🏆",
+                "The perfect edit doesn't exi- 😲",
+                "Caught in 4K 📸",
+                "Vibe check ✅",
+                f"Part {i+1} 🎬"
+            ]
+            text = random.choice(captions)
+        caption = dict(DEFAULT_TEXT_STYLE, **(text_style or {}), text=text)
+    
+    # Select audio
+    audio = None
+    if audio_files and len(audio_files) > 0:
+        audio = {'path': random.choice(audio_files), 'offset': 0.0}
+    
+    return {
+        'version': EDL_VERSION,
+        'index': i,
+        'output_name': f"output_{i+1:02d}.mp4",
+        # Same frame rate concatenate_videoclips would pick
+        'fps': max(source['fps'] for source in sources),
+        'sources': sources,
+        'segments': segments,
+        'caption': caption,
+        'audio': audio,
+    }
+
+# Text settings used when a plan's caption doesn't specify them
+DEFAULT_TEXT_STYLE = {
+    'color': '#FFFFFF',
+    'stroke_color': '#000000',
+    'font_size': 60,
+    'stroke_width': 2,
+    'opacity': 1.00,
+}
+
+def plan_fingerprint(plan):
+    """
+    Hash the edit of a plan (sources, segments, caption and audio), ignoring its
+    index and output name, so plan_batch can detect an output that repeats an earlier one.
+    
+    Returns:
+        str: Hex digest identifying the edit
+    """
+    edit = {
+        'segments': [
+            (plan['sources'][seg['source']]['path'], round(seg['start'], 2), round(seg['end'], 2), seg['effects'])
+            for seg in plan['segments']
+        ],
+        'caption': plan['caption'],
+        'audio': plan['audio'],
+    }
+    return hashlib.sha1(json.dumps(edit, sort_keys=True).encode('utf8')).hexdigest()
+
+def save_plans(plans, path):
+    """Write plans to a JSON file so they can be inspected or rendered later."""
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(plans, f, indent=2, ensure_ascii=False)
+    return path
+
+def load_plans(path):
+    """
+    Read plans written by save_plans.
+    
+    Raises:
+        ValueError: If a plan was written by an incompatible EDL version
+    """
+    with open(path, encoding="utf8") as f:
+        plans = json.load(f)
+    for plan in plans:
+        if plan.get('version') != EDL_VERSION:
+            raise ValueError(f"Unsupported plan version: {plan.get('version')}")
+    return plans
+
+def resolve_sources(plans, proxy_cache=None):
+    """
+    Make sure the sources of saved plans exist before rendering them again.
+    
+    A source rendered from a proxy keeps the path of its original video. If the proxy
+    was evicted since the plans were saved, it is transcoded again (or, without a
+    cache, the original is used instead).
+    
+    Args:
+        plans: Plans from load_plans (changed in place)
+        proxy_cache: ProxyCache the proxies came from, or None
+        
+    Returns:
+        list: The plans
+    """
+    resolved = set()
+    for plan in plans:
+        for source in plan['sources']:
+            if os.path.exists(source['path']) or not source.get('original'):
                 continue
-            
-            # If we've reached the target duration, stop adding clips
-            if total_duration >= TARGET_DURATION:
-                break
+            if proxy_cache is not None:
+                source['path'] = proxy_cache.get_proxy(source['original'], keep=resolved)
+            else:
+                source['path'] = source['original']
+            resolved.add(source['path'])
+    return plans
+
+def plan_files(plans):
+    """
+    List the input files plans render from: sources (and their originals) and audio.
+    
+    Returns:
+        set: File paths
+    """
+    paths = set()
+    for plan in plans:
+        for source in plan['sources']:
+            paths.add(source['path'])
+            if source.get('original'):
+                paths.add(source['original'])
+        if plan['audio']:
+            paths.add(plan['audio']['path'])
+    return paths
+
+def plan_has_effects(plan):
+    """Whether any segment of a plan has effects or transitions."""
+    return any(seg['effects'] for seg in plan['segments'])
+
+def is_plain_plan(plan):
+    """Whether a plan has no effects and no caption, so segments can be joined as-is."""
+    return not plan['caption'] and not plan_has_effects(plan)
+
+def plan_for_settings(plan, settings):
+    """The plan as rendered with these settings: a profile's fps caps the output frame rate."""
+    if settings.get('fps') and settings['fps'] < plan['fps']:
+        return dict(plan, fps=settings['fps'])
+    return plan
+
+def uses_moviepy(plan, settings):
+    """Whether render_plan will build a plan's frames with MoviePy (rather than ffmpeg alone)."""
+    return settings.get('backend', "moviepy") == "moviepy" and not (settings.get('stream_copy', True) and is_plain_plan(plan))
+
+def render_plan(plan, output_dir="outputs", settings=None, input_clips=None, progress_callback=None):
+    """
+    Build and encode one output video from a plan made by plan_batch.
+    
+    Args:
+        plan: Edit decision list from plan_output (or load_plans)
+        output_dir: Directory to write the video to
+        settings: Render settings dict with num_videos, backend, stream_copy,
+            target_duration and the encode settings from encode_settings
+            (defaults: 1, "moviepy", True, TARGET_DURATION and the "standard" profile)
+        input_clips: Loaded clips for plan['sources']; opened (and closed) here if None
+        progress_callback: Function to report progress (progress_pct, status_message)
         
-        if not selected_clips:
+    Returns:
+        str: Path to the written video, or None if rendering failed
+    """
+    settings = dict({
+        'num_videos': 1,
+        'backend': "moviepy",
+        'stream_copy': True,
+        'target_duration': TARGET_DURATION,
+        **encode_settings(DEFAULT_PROFILE),
+    }, **(settings or {}))
+    plan = plan_for_settings(plan, settings)
+    i = plan['index']
+    num_videos = settings['num_videos']
+    output_path = os.path.join(output_dir, plan['output_name'])
+    
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # Calculate overall progress: each video is worth (90/num_videos)% of progress
+    base_progress = 10 + (i * (80 / num_videos))
+    
+    # Effect-free, text-free outputs are cut and joined by ffmpeg directly
+    if settings['stream_copy'] and is_plain_plan(plan):
+        try:
+            return render_stream_copy(plan, output_path, settings, progress_callback)
+        except Exception as e:
             if progress_callback:
-                progress_callback(int(base_progress), f"Warning: No valid clips could be extracted for video {i+1}")
+                progress_callback(int(base_progress), f"Fast path failed for video {i+1}: {e}. Falling back to MoviePy...")
             else:
-                print(f"Warning: No valid clips could be extracted for {output_path}")
-            continue
-        
-        final_clip = None
-
+                print(f"Fast path failed for {output_path}: {e}. Falling back to MoviePy...")
+    
+    # The ffmpeg backend renders the whole plan as one filter graph
+    elif settings['backend'] == "ffmpeg":
         try:
-            # Progress update for effect stage
-            effect_progress = base_progress + (60 / num_videos)
+            return render_filter_complex(plan, output_path, settings, progress_callback)
+        except Exception as e:
             if progress_callback:
-                progress_callback(int(effect_progress), f"Applying effects and transitions for video {i+1}/{num_videos}")
-            
-            # If we're using effects, add simple transitions between clips
-            if use_effects:
-                final_clips = []
-                
-                # Process each clip
-                for idx, clip in enumerate(selected_clips):
-                    if idx == 0:
-                        # First clip gets a fade in
-                        clip = clip.fadein(0.3)
-                    elif idx == len(selected_clips) - 1:
-                        # Last clip gets a fade out
-                        clip = clip.fadeout(0.3)
-                    
-                    final_clips.append(clip)
-                
-                # Simple concatenation with crossfades
-                final_clip = concatenate_videoclips(final_clips, method="compose")
+                progress_callback(int(base_progress), f"ffmpeg backend failed for video {i+1}: {e}. Falling back to MoviePy...")
             else:
-                # Simple concatenation without transitions
-                final_clip = concatenate_videoclips(selected_clips)
-            
-            # Check final clip dimensions and ensure they're correct
-            final_clip = ensure_consistent_dimensions(final_clip)
+                print(f"ffmpeg backend failed for {output_path}: {e}. Falling back to MoviePy...")
+    
+    # Open the sources ourselves if the caller didn't pass loaded clips
+    opened_clips = []
+    if input_clips is None:
+        opened_clips = [VideoFileClip(source['path']) for source in plan['sources']]
+        input_clips = opened_clips
+    
+    try:
+        return _render_plan_moviepy(plan, output_path, settings, input_clips, progress_callback)
+    finally:
+        for clip in opened_clips:
+            clip.close()
+
+def _render_plan_moviepy(plan, output_path, settings, input_clips, progress_callback=None):
+    """
+    MoviePy backend for render_plan: frames are built by MoviePy and piped to ffmpeg.
+    """
+    i = plan['index']
+    num_videos = settings['num_videos']
+    target_width = settings['target_width']
+    target_height = settings['target_height']
+    target_duration = settings['target_duration']
+    
+    # Calculate overall progress: each video is worth (90/num_videos)% of progress
+    base_progress = 10 + (i * (80 / num_videos))
+    
+    if progress_callback:
+        progress_callback(int(base_progress), f"Building video {i+1}/{num_videos}...")
+    else:
+        print(f"Building {output_path} using MoviePy...")
+    
+    # Extract the planned subclips
+    selected_clips = []
+    for segment in plan['segments']:
+        try:
+            subclip = input_clips[segment['source']].subclip(segment['start'], segment['end'])
             
-            # Check if the final clip is too long and trim if necessary
-            if final_clip.duration > TARGET_DURATION + 1:  # Allow 1 second buffer
-                if progress_callback:
-                    progress_callback(int(effect_progress), f"Trimming video to target duration ({TARGET_DURATION}s)")
-                final_clip = final_clip.subclip(0, TARGET_DURATION)
+            # Ensure consistent dimensions and padding for all clips
+            processed_clip = ensure_consistent_dimensions(subclip, target_width=target_width,
+                                                          target_height=target_height)
             
-            # Add text overlay if enabled
-            if use_text:
-                text_progress = base_progress + (65 / num_videos)
-                if progress_callback:
-                    progress_callback(int(text_progress), f"Adding text overlay to video {i+1}/{num_videos}")
-                
+            # Apply the planned effects, if any
+            for effect in segment['effects']:
                 try:
-                    # Use custom text if provided, otherwise generate a random caption
-                    if custom_text:
-                        caption = custom_text
-                    else:
-                        # Generate a random caption
-                        captions = [
-                            "WATCH TILL THE END 😱",
-                            "POV: When the beat drops 🔥",
-                            "This is INSANE 🤯",
-                            "Wait for it... 👀",
-                            "Best moments 💯",
-                            "Try not to be amazed 😮",
-                            "Crazy skills 💪",
-                            "Ultimate compilation 🏆",
-                            "The perfect edit doesn't exi- 😲",
-                            "Caught in 4K 📸",
-                            "Vibe check ✅",
-                            f"Part {i+1} 🎬"
-                        ]
-                        caption = random.choice(captions)
-                    
-                    print(f"Creating text overlay with text: '{caption}', color: {text_color}, size: {font_size}, opacity: {text_opacity}")
-                    
-                    # Create text overlay with custom parameters
-                    txt_clip = create_text_overlay(
-                        caption,
-                        (int(final_clip.w), int(final_clip.h)),  # Ensure dimensions are integers
-                        color=text_color,
-                        font_size=font_size,
-                        opacity=text_opacity,
-                        stroke_color=stroke_color,
-                        stroke_width=stroke_width
-                    )
-                    
-                    # Add text to the video if creation was successful
-                    if txt_clip is not None:
-                        # Ensure the text duration matches the video
-                        txt_clip = txt_clip.set_duration(final_clip.duration)
-                        
-                        # Composite the text on top of the video
-                        final_clip = CompositeVideoClip([final_clip, txt_clip])
-                        
-                        if progress_callback:
-                            progress_callback(int(text_progress), f"Added text overlay: '{caption}'")
-                        else:
-                            print(f"Successfully added text overlay: '{caption}'")
+                    if effect == "fadein":
+                        # First clip gets a fade in
+                        processed_clip = processed_clip.fadein(0.3)
+                    elif effect == "fadeout":
+                        # Last clip gets a fade out
+                        processed_clip = processed_clip.fadeout(0.3)
                     else:
-                        if progress_callback:
-                            progress_callback(int(text_progress), f"Warning: Text overlay creation failed")
-                        else:
-                            print(f"Warning: Text overlay creation failed")
+                        processed_clip = apply_smart_effects(processed_clip, intensity=0.3, effect=effect)
                 except Exception as e:
-                    if progress_callback:
-                        progress_callback(int(text_progress), f"Error adding text: {e}")
-                    else:
-                        print(f"Error adding text overlay: {e}")
-                        import traceback
-                        traceback.print_exc()
+                    print(f"Error applying effects to clip: {e}")
+            
+            selected_clips.append(processed_clip)
             
-            # Progress update for audio stage
-            audio_progress = base_progress + (70 / num_videos)
+        except Exception as e:
+            print(f"Error processing clip: {e}")
+            continue
+    
+    if not selected_clips:
+        if progress_callback:
+            progress_callback(int(base_progress), f"Warning: No valid clips could be extracted for video {i+1}")
+        else:
+            print(f"Warning: No valid clips could be extracted for {output_path}")
+        return None
+    
+    final_clip = None
+    written_path = None
+
+    try:
+        # Progress update for effect stage
+        effect_progress = base_progress + (60 / num_videos)
+        if progress_callback:
+            progress_callback(int(effect_progress), f"Applying effects and transitions for video {i+1}/{num_videos}")
+        
+        # Clips with effects or transitions need to be composed over a background
+        if plan_has_effects(plan):
+            final_clip = concatenate_videoclips(selected_clips, method="compose")
+        else:
+            # Simple concatenation without transitions
+            final_clip = concatenate_videoclips(selected_clips)
+        
+        # Check final clip dimensions and ensure they're correct
+        final_clip = ensure_consistent_dimensions(final_clip, target_width=target_width,
+                                                  target_height=target_height)
+        
+        # Check if the final clip is too long and trim if necessary
+        if final_clip.duration > target_duration + 1:  # Allow 1 second buffer
             if progress_callback:
-                progress_callback(int(audio_progress), f"Adding audio to video {i+1}/{num_videos}")
+                progress_callback(int(effect_progress), f"Trimming video to target duration ({target_duration}s)")
+            final_clip = final_clip.subclip(0, target_duration)
+        
+        # Add text overlay if the plan has a caption
+        caption = plan['caption']
+        if caption:
+            text_progress = base_progress + (65 / num_videos)
+            if progress_callback:
+                progress_callback(int(text_progress), f"Adding text overlay to video {i+1}/{num_videos}")
+            
+            try:
+                print(f"Creating text overlay with text: '{caption['text']}', color: {caption['color']}, size: {caption['font_size']}, opacity: {caption['opacity']}")
                 
-            # Select or generate audio
-            if audio_files and len(audio_files) > 0:
-                audio_path = random.choice(audio_files)
-                try:
-                    audio = AudioFileClip(audio_path)
+                # Create text overlay with custom parameters, sized for this profile's resolution
+                scale = caption_scale(settings)
+                txt_clip = create_text_overlay(
+                    caption['text'],
+                    (int(final_clip.w), int(final_clip.h)),  # Ensure dimensions are integers
+                    color=caption['color'],
+                    font_size=max(1, int(round(caption['font_size'] * scale))),
+                    opacity=caption['opacity'],
+                    stroke_color=caption['stroke_color'],
+                    stroke_width=caption['stroke_width'] * scale
+                )
+                
+                # Add text to the video if creation was successful
+                if txt_clip is not None:
+                    # Ensure the text duration matches the video
+                    txt_clip = txt_clip.set_duration(final_clip.duration)
+                    
+                    # Composite the text on top of the video
+                    final_clip = CompositeVideoClip([final_clip, txt_clip])
                     
-                    # Ensure audio is exactly as long as the video
-                    target_duration = final_clip.duration
-                    if audio.duration < target_duration:
-                        # Loop the audio to match video duration exactly
-                        audio = loop(audio, duration=target_duration)
-                    else:
-                        # Trim audio to match video duration exactly
-                        audio = audio.subclip(0, target_duration)
-                        
-                    final_clip = final_clip.set_audio(audio)
                     if progress_callback:
-                        progress_callback(int(audio_progress), f"Added audio to video {i+1}/{num_videos}")
+                        progress_callback(int(text_progress), f"Added text overlay: '{caption['text']}'")
                     else:
-                        print(f"Added audio from {audio_path}")
-                except Exception as e:
+                        print(f"Successfully added text overlay: '{caption['text']}'")
+                else:
                     if progress_callback:
-                        progress_callback(int(audio_progress), f"Error adding audio: {e}")
+                        progress_callback(int(text_progress), f"Warning: Text overlay creation failed")
                     else:
-                        print(f"Error adding audio from {audio_path}: {e}")
-            
-            # Progress update for rendering stage
-            render_progress = base_progress + (75 / num_videos)
-            if progress_callback:
-                progress_callback(int(render_progress), f"Rendering video {i+1}/{num_videos}...")
-            else:
-                print(f"Writing audio for {output_path}...")
-            
-            # Ensure final clip has exact 9:16 dimensions before writing
-            if final_clip.w != TARGET_WIDTH or final_clip.h != TARGET_HEIGHT:
-                final_clip = final_clip.resize(width=TARGET_WIDTH, height=TARGET_HEIGHT)
+                        print(f"Warning: Text overlay creation failed")
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(int(text_progress), f"Error adding text: {e}")
+                else:
+                    print(f"Error adding text overlay: {e}")
+                    traceback.print_exc()
+        
+        # Progress update for audio stage
+        audio_progress = base_progress + (70 / num_videos)
+        if progress_callback:
+            progress_callback(int(audio_progress), f"Adding audio to video {i+1}/{num_videos}")
             
-            # Write the final video
+        # Add the planned audio
+        if plan['audio']:
+            audio_path = plan['audio']['path']
             try:
-                # Create a callback for write_videofile progress
-                def writing_callback(t):
-                    if progress_callback:
-                        # Map t from 0-duration to render_progress-(render_progress+20)
-                        write_pct = min(100, int(render_progress + (t / final_clip.duration) * (20 / num_videos)))
-                        progress_callback(write_pct, f"Rendering video {i+1}/{num_videos}: {int((t / final_clip.duration) * 100)}%")
+                audio = AudioFileClip(audio_path)
                 
-                # First try without callback which might not be supported in some MoviePy versions
-                try:
+                # Start the audio at the planned offset
+                offset = plan['audio']['offset'] % audio.duration if audio.duration else 0
+                if offset > 0:
+                    audio = audio.subclip(offset)
+                
+                # Ensure audio is exactly as long as the video
+                target_duration = final_clip.duration
+                if audio.duration < target_duration:
+                    # Loop the audio to match video duration exactly
+                    audio = loop(audio, duration=target_duration)
+                else:
+                    # Trim audio to match video duration exactly
+                    audio = audio.subclip(0, target_duration)
+                    
+                final_clip = final_clip.set_audio(audio)
+                if progress_callback:
+                    progress_callback(int(audio_progress), f"Added audio to video {i+1}/{num_videos}")
+                else:
+                    print(f"Added audio from {audio_path}")
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(int(audio_progress), f"Error adding audio: {e}")
+                else:
+                    print(f"Error adding audio from {audio_path}: {e}")
+        
+        # Progress update for rendering stage
+        render_progress = base_progress + (75 / num_videos)
+        if progress_callback:
+            progress_callback(int(render_progress), f"Rendering video {i+1}/{num_videos}...")
+        else:
+            print(f"Writing audio for {output_path}...")
+        
+        # Ensure final clip has exact 9:16 dimensions before writing
+        if final_clip.w != target_width or final_clip.h != target_height:
+            final_clip = final_clip.resize(width=target_width, height=target_height)
+        
+        # Write the final video
+        try:
+            # First try without callback which might not be supported in some MoviePy versions
+            try:
+                final_clip.write_videofile(
+                    output_path,
+                    codec="libx264",
+                    audio_codec="aac",
+                    fps=plan['fps'],
+                    preset=settings['preset'],
+                    threads=settings['threads'],
+                    ffmpeg_params=["-crf", str(settings['crf'])],
+                    logger=None
+                )
+            except TypeError as e:
+                # If first attempt fails with TypeError, it might be an old MoviePy version
+                if "unexpected keyword argument" in str(e):
                     final_clip.write_videofile(
                         output_path,
                         codec="libx264",
                         audio_codec="aac",
-                        preset="fast",
-                        threads=4,
-                        logger=None
+                        fps=plan['fps'],
+                        preset=settings['preset'],
+                        threads=settings['threads'],
+                        ffmpeg_params=["-crf", str(settings['crf'])]
                     )
-                except TypeError as e:
-                    # If first attempt fails with TypeError, it might be an old MoviePy version
-                    if "unexpected keyword argument" in str(e):
-                        final_clip.write_videofile(
-                            output_path,
-                            codec="libx264",
-                            audio_codec="aac",
-                            preset="fast",
-                            threads=4
-                        )
-                    else:
-                        raise
+                else:
+                    raise
+            
+            if progress_callback:
+                progress_callback(int(base_progress + (90 / num_videos)), f"Video {i+1}/{num_videos} complete!")
+            else:
+                print(f"Video {output_path} is ready!")
+            
+            # Report the output path
+            if os.path.exists(output_path):
+                written_path = output_path
+            else:
+                print(f"Warning: Output file was not created: {output_path}")
                 
+        except Exception as e:
+            if progress_callback:
+                progress_callback(int(render_progress), f"Error writing video file: {e}. Trying simplifier method...")
+            else:
+                print(f"Error writing video file {output_path}: {e}")
+            try:
+                # Try a simpler approach if the first attempt fails
                 if progress_callback:
-                    progress_callback(int(base_progress + (90 / num_videos)), f"Video {i+1}/{num_videos} complete!")
+                    progress_callback(int(render_progress), f"Using simplified render settings...")
                 else:
-                    print(f"Video {output_path} is ready!")
-                
-                # Add the output path to our list
+                    print("Trying with simpler options...")
+                final_clip.write_videofile(output_path)
                 if os.path.exists(output_path):
-                    output_paths.append(output_path)
+                    written_path = output_path
                 else:
                     print(f"Warning: Output file was not created: {output_path}")
-                    
-            except Exception as e:
+            except Exception as e2:
                 if progress_callback:
-                    progress_callback(int(render_progress), f"Error writing video file: {e}. Trying simplifier method...")
+                    progress_callback(int(render_progress), f"Failed again: {e2}")
                 else:
-                    print(f"Error writing video file {output_path}: {e}")
-                try:
-                    # Try a simpler approach if the first attempt fails
-                    if progress_callback:
-                        progress_callback(int(render_progress), f"Using simplified render settings...")
-                    else:
-                        print("Trying with simpler options...")
-                    final_clip.write_videofile(output_path)
-                    if os.path.exists(output_path):
-                        output_paths.append(output_path)
-                    else:
-                        print(f"Warning: Output file was not created: {output_path}")
-                except Exception as e2:
-                    if progress_callback:
-                        progress_callback(int(render_progress), f"Failed again: {e2}")
-                    else:
-                        print(f"Failed again: {e2}")
-                    
-        except Exception as e:
-            if progress_callback:
-                progress_callback(int(base_progress), f"Error creating final clip: {e}")
-            else:
-                print(f"Error creating final clip: {e}")
-                import traceback
-                traceback.print_exc()
+                    print(f"Failed again: {e2}")
+                
+    except Exception as e:
+        if progress_callback:
+            progress_callback(int(base_progress), f"Error creating final clip: {e}")
+        else:
+            print(f"Error creating final clip: {e}")
+            traceback.print_exc()
+    
+    # Clean up memory
+    if final_clip:
+        final_clip.close()
+    
+    for clip in selected_clips:
+        clip.close()
+    
+    return written_path
+
+# Input clips opened by the current worker process, keyed by path.
+# Each worker opens its own readers since MoviePy clips can't be pickled.
+_worker_clips = {}
+
+def _render_plan_worker(plan, output_dir, settings, progress_queue=None):
+    """
+    Process pool entry point: render one plan with this worker's own readers.
+    Progress messages are put on progress_queue for the parent process to relay.
+    """
+    input_clips = None
+    if uses_moviepy(plan, settings):
+        input_clips = []
+        for source in plan['sources']:
+            if source['path'] not in _worker_clips:
+                _worker_clips[source['path']] = VideoFileClip(source['path'])
+            input_clips.append(_worker_clips[source['path']])
+    
+    report = None
+    if progress_queue is not None:
+        report = lambda pct, message: progress_queue.put((pct, message))
+    
+    return render_plan(plan, output_dir, settings, input_clips, report)
+
+def _relay_progress(progress_queue, progress_callback):
+    """Forward queued worker progress messages to the callback in the calling thread."""
+    while True:
+        try:
+            pct, message = progress_queue.get_nowait()
+        except queue.Empty:
+            return
+        if progress_callback:
+            progress_callback(pct, message)
+
+def render_plans_parallel(plans, output_dir, settings, workers=2, progress_callback=None, output_callback=None):
+    """
+    Render plans in a process pool.
+    
+    Args:
+        plans: List of plans from plan_batch
+        output_dir: Directory to write the videos to
+        settings: Render settings dict, as for render_plan
+        workers: Number of worker processes
+        progress_callback: Function to report progress (progress_pct, status_message),
+            always called from the calling thread
+        output_callback: Function called with the path of each video as it finishes
+            (in completion order), from the calling thread
         
-        # Clean up memory
-        if final_clip:
-            final_clip.close()
+    Returns:
+        list: Paths to the generated videos, in plan order
+    """
+    results = {}
+    
+    with multiprocessing.Manager() as manager:
+        progress_queue = manager.Queue() if progress_callback else None
         
-        for clip in selected_clips:
-            clip.close()
+        with ProcessPoolExecutor(max_workers=min(workers, len(plans))) as executor:
+            futures = {
+                executor.submit(_render_plan_worker, plan, output_dir, settings, progress_queue): plan
+                for plan in plans
+            }
+            
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                if progress_queue is not None:
+                    _relay_progress(progress_queue, progress_callback)
+                
+                for future in done:
+                    plan = futures[future]
+                    try:
+                        results[plan['index']] = future.result()
+                        if output_callback and results[plan['index']]:
+                            output_callback(results[plan['index']])
+                    except Exception as e:
+                        if progress_callback:
+                            progress_callback(0, f"Error rendering video {plan['index']+1}: {e}")
+                        else:
+                            print(f"Error rendering {plan['output_name']}: {e}")
+        
+        if progress_queue is not None:
+            _relay_progress(progress_queue, progress_callback)
     
-    # Clean up
-    for clip in input_clips:
-        clip.close()
+    # Keep the batch order regardless of which worker finished first
+    return [results[index] for index in sorted(results) if results[index]]
+
+
+def choose_smart_effect():
+    """
+    Pick one of the minimal effects used by apply_smart_effects.
     
-    # Final progress update
-    if progress_callback:
-        progress_callback(100, f"All {len(output_paths)} videos complete!")
+    Returns:
+        str: "colorx", "crossfadein", or None for no effect
+    """
+    effect_choice = random.random()
     
-    return output_paths
+    if effect_choice < 0.4:  # 40% chance of slight color boost
+        return "colorx"
+    elif effect_choice < 0.6:  # 20% chance of slight fade
+        return "crossfadein"
+    else:  # 40% chance of no effect
+        return None
 
-def apply_smart_effects(clip, intensity=0.3):
+def apply_smart_effects(clip, intensity=0.3, effect=None):
     """
     Apply minimal effects to avoid freezing issues.
+    If effect is None, one is picked at random with choose_smart_effect.
     """
     # Only attempt one simple effect
-    effect_choice = random.random()
+    if effect is None:
+        effect = choose_smart_effect()
     
     try:
-        if effect_choice < 0.4:  # 40% chance of slight color boost
+        if effect == "colorx":
             return colorx(clip, 1.0 + (intensity * 0.2))
-        elif effect_choice < 0.6:  # 20% chance of slight fade
+        elif effect == "crossfadein":
             return clip.crossfadein(0.3)
-        else:  # 40% chance of no effect
+        else:
             return clip
     except Exception as e:
         print(f"Effect failed, returning original clip: {e}")
         return clip
 
+def caption_scale(settings):
+    """Scale factor for caption sizes, which are given for a full-size (TARGET_WIDTH) output."""
+    return settings['target_width'] / TARGET_WIDTH
+
 def create_text_overlay(text, size, color='white', font_size=60, opacity=1.00, stroke_color='black', stroke_width=2):
     """Create a text overlay with stroke effect."""
     try:
@@ -722,7 +1430,8 @@ def preserve_original_dimensions(original_clip, processed_clip):
     return processed_clip.resize(width=orig_w, height=orig_h)
 
 # Update ensure_consistent_dimensions to properly handle 9:16 videos
-def ensure_consistent_dimensions(clip, target_ratio=(9, 16)):
+def ensure_consistent_dimensions(clip, target_ratio=(9, 16), target_width=TARGET_WIDTH,
+                                 target_height=TARGET_HEIGHT):
     """
     Ensure consistent dimensions for all clips, properly handling vertical videos.
     For 9:16 videos, ensure they fill the screen with no black bars.
@@ -731,13 +1440,25 @@ def ensure_consistent_dimensions(clip, target_ratio=(9, 16)):
     if clip is None:
         raise ValueError("Clip cannot be None")
         
-    # Set fixed target dimensions for 9:16 videos (e.g., 1080x1920)
-    TARGET_WIDTH = 1080
-    TARGET_HEIGHT = 1920
+    # Target dimensions for 9:16 videos (1080x1920, or smaller for the draft profile)
+    TARGET_WIDTH = target_width
+    TARGET_HEIGHT = target_height
     
     # Get current dimensions
     w, h = clip.size
     
+    # Already at the target size (e.g. a normalized proxy), nothing to do
+    if (w, h) == (TARGET_WIDTH, TARGET_HEIGHT):
+        return clip
+    
+    # Normalize each frame with a single cv2.resize into a preallocated, letterboxed
+    # buffer, using a transform worked out once from the source size
+    if clip.mask is None:
+        return clip.fl_image(FrameNormalizer(w, h, TARGET_WIDTH, TARGET_HEIGHT))
+    
+    # Clips with a mask (e.g. composites) keep the MoviePy resize/crop/margin chain
+    # so the mask is transformed along with the frames
+    
     # For vertical videos (taller than wide)
     if h > w:  # This is a vertical video
         # Resize to fixed 9:16 dimensions (1080x1920)
@@ -779,8 +1500,9 @@ def select_dissimilar_clip(available_indices, recently_used, visual_signatures,
     Args:
         available_indices: List of available clip indices to choose from
         recently_used: List of recently used clip indices
-        visual_signatures: Dictionary of clip signatures for comparison
-        top_n: Number of candidates to consider
+        visual_signatures: SignatureMatrix of the batch (a signature dict is converted)
+        top_n: Number of candidates to consider (None for all available clips, or all
+            the index candidates in libraries larger than EXACT_LIMIT)
         
     Returns:
         Index of selected clip
@@ -789,44 +1511,60 @@ def select_dissimilar_clip(available_indices, recently_used, visual_signatures,
     if not recently_used or not visual_signatures:
         return random.choice(available_indices)
     
-    # Select a few random candidates
-    candidates = random.sample(
-        available_indices, 
-        min(top_n, len(available_indices))
-    )
+    if not isinstance(visual_signatures, SignatureMatrix):
+        visual_signatures = SignatureMatrix(visual_signatures)
     
-    # Calculate average dissimilarity score for each candidate
-    scores = []
-    for candidate in candidates:
-        # Skip if candidate doesn't have a signature
-        if candidate not in visual_signatures:
-            scores.append(0)
-            continue
-            
-        # Calculate average dissimilarity to recently used clips
-        dissimilarity = 0
-        count = 0
-        for used in recently_used:
-            if used in visual_signatures:
-                # Higher score means more dissimilar
-                dissimilarity += 1.0 - calculate_similarity(
-                    visual_signatures[candidate],
-                    visual_signatures[used]
-                )
-                count += 1
-        
-        # Average dissimilarity (higher is better)
-        avg_dissimilarity = dissimilarity / count if count > 0 else 0
-        scores.append(avg_dissimilarity)
+    # Select a few random candidates; in large libraries, draw them from the clips the
+    # ANN index finds farthest from the recent ones instead of scoring every clip
+    pool = available_indices
+    if len(available_indices) > EXACT_LIMIT:
+        pool = visual_signatures.farthest(available_indices, recently_used, k=max(16, 4 * (top_n or 4))) or pool
+    candidates = random.sample(pool, min(top_n or len(pool), len(pool)))
+    
+    # Average dissimilarity of each candidate to the recently used clips (higher is better),
+    # looked up in the precomputed similarity matrix
+    scores = visual_signatures.mean_dissimilarity(candidates, recently_used)
     
     # Select the most dissimilar candidate
-    if scores:
+    if len(scores):
         # Return the candidate with highest dissimilarity score
-        return candidates[scores.index(max(scores))]
+        return candidates[int(np.argmax(scores))]
     
     # Fallback to random selection
     return random.choice(available_indices)
 
+def select_dissimilar_segment(clip_index, available_segments, clip_duration, recent_segments,
+                              timelines, candidates=4):
+    """
+    Place a segment in a source so it looks unlike the segments used just before it.
+    
+    Args:
+        clip_index: Source the segment is taken from
+        available_segments: Free (start, end) ranges from find_available_segments
+        clip_duration: Length of the segment
+        recent_segments: (source, start, end) of the segments to stay away from
+        timelines: FingerprintTimeline per source
+        candidates: Number of random placements to compare
+        
+    Returns:
+        tuple: (range start, range end, start time) of the chosen placement
+    """
+    options = []
+    for _ in range(candidates):
+        segment_start, segment_end = random.choice(available_segments)
+        options.append((segment_start, segment_end, random.uniform(segment_start, segment_end - clip_duration)))
+    
+    recent_segments = [segment for segment in recent_segments if timelines[segment[0]] is not None]
+    if not recent_segments:
+        return options[0]
+    
+    # Each fingerprint is a slice-and-reduce over the source's timeline; no decoding here
+    option_vectors = segment_matrix(timelines, [(clip_index, start, start + clip_duration)
+                                                for _, _, start in options])
+    recent_vectors = segment_matrix(timelines, recent_segments)
+    dissimilarity = 1.0 - (option_vectors @ recent_vectors.T).mean(axis=1)
+    return options[int(np.argmax(dissimilarity))]
+
 # Calculate similarity between two visual signatures
 def calculate_similarity(sig1, sig2):
     """
@@ -849,63 +1587,6 @@ def calculate_similarity(sig1, sig2):
         
     return dot_product / (norm1 * norm2)
 
-# Create simple visual signatures for videos
-def create_video_signatures(clips, samples=5):
-    """
-    Create simple visual signatures for a list of video clips.
-    This is a simplified approach - in production, you'd use more sophisticated
-    visual feature extraction.
-    
-    Args:
-        clips: List of MoviePy VideoFileClip objects
-        samples: Number of frames to sample from each clip
-        
-    Returns:
-        Dictionary mapping clip index to signature
-    """
-    signatures = {}
-    
-    for i, clip in enumerate(clips):
-        try:
-            # Sample frames evenly throughout the clip
-            duration = clip.duration
-            if duration <= 0:
-                continue
-                
-            frame_times = np.linspace(0, duration * 0.9, samples)
-            
-            # Extract color features from each frame
-            signature = []
-            for t in frame_times:
-                try:
-                    # Get frame at this time
-                    frame = clip.get_frame(t)
-                    
-                    # Simple color histogram as signature
-                    # Average color values in each channel
-                    r_avg = np.mean(frame[:, :, 0])
-                    g_avg = np.mean(frame[:, :, 1])
-                    b_avg = np.mean(frame[:, :, 2])
-                    
-                    # Calculate dominant brightness
-                    brightness = (r_avg + g_avg + b_avg) / 3
-                    
-                    # Add to signature
-                    signature.extend([r_avg, g_avg, b_avg, brightness])
-                    
-                except Exception:
-                    # If we can't get a frame, add zeros
-                    signature.extend([0, 0, 0, 0])
-            
-            # Store normalized signature
-            signatures[i] = signature
-            
-        except Exception:
-            # If we can't process a clip, skip it
-            continue
-    
-    return signatures
-
 # Find available segments in a clip that haven't been used yet
 def find_available_segments(clip_index, desired_duration, clip_duration, 
                            global_history=None, local_history=None, 
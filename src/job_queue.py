@@ -0,0 +1,264 @@
+"""
+Local render job queue backed by SQLite, with a pool of worker threads.
+
+Jobs outlive the Streamlit script run that submitted them: the UI submits a job,
+stores nothing but its id, and polls the database for its state, progress and result.
+Several jobs can be queued at once, and workers pick them up in submission order.
+
+Each queue instance owns the jobs it runs and keeps their heartbeat fresh. Another
+instance sharing the database (a second server process, or a new instance after
+Streamlit's resource cache was cleared) only takes over running jobs whose heartbeat
+has stopped.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import traceback
+
+# Lifecycle of a job: queued -> running -> done | failed (queued jobs may be cancelled)
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+ACTIVE_STATES = ("queued", "running")
+
+# Columns added after the first version of the table, with their types
+_ADDED_COLUMNS = {'owner': "TEXT", 'heartbeat': "REAL"}
+
+class JobQueue:
+    """
+    Jobs persisted in an SQLite database and run by worker threads.
+
+    A job has a kind, JSON parameters and an owning session. Each kind is run by a handler,
+    a function (params, progress_callback) returning a JSON-serializable result.
+    """
+
+    def __init__(self, db_path, handlers, workers=1, poll_interval=0.5, heartbeat_interval=10,
+                 stale_seconds=60):
+        """
+        Open (or create) the queue and start its workers.
+
+        Running jobs whose owner stopped sending heartbeats (e.g. a crashed process) are
+        queued again; jobs another live instance is running are left alone.
+
+        Args:
+            db_path: Path of the SQLite database
+            handlers: Dict of job kind -> handler function
+            workers: Number of jobs run at the same time
+            poll_interval: Seconds an idle worker waits before looking for new jobs
+            heartbeat_interval: Seconds between heartbeats of this instance's running jobs
+            stale_seconds: Heartbeat age after which a running job is considered abandoned
+        """
+        self.db_path = db_path
+        self.handlers = dict(handlers)
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_seconds = stale_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = threading.Event()
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    session_id TEXT,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    progress REAL NOT NULL DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    owner TEXT,
+                    heartbeat REAL
+                )
+            """)
+            columns = {row['name'] for row in db.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in _ADDED_COLUMNS.items():
+                if name not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id, created)")
+            self._requeue_abandoned(db)
+
+        self.workers = []
+        for n in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name=f"render-worker-{n}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        threading.Thread(target=self._beat, name="render-heartbeat", daemon=True).start()
+
+    def _connect(self):
+        """Open a connection (one per call, as connections can't be shared between threads)."""
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return _Connection(db)
+
+    def submit(self, kind, params, session_id=None):
+        """
+        Queue a job.
+
+        Args:
+            kind: Job kind, a key of the handlers
+            params: JSON-serializable parameters passed to the handler
+            session_id: Session the job belongs to, for listing it later
+
+        Returns:
+            str: Id of the new job
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}. Choose from {', '.join(self.handlers)}")
+
+        job_id = uuid.uuid4().hex
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, session_id, kind, params, state, created) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, session_id, kind, json.dumps(params), time.time())
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Get a job.
+
+        Returns:
+            dict: The job (params and result decoded), or None if there is no such job
+        """
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def list_jobs(self, session_id=None, states=None):
+        """
+        List jobs, oldest first.
+
+        Args:
+            session_id: Only jobs of this session (None for all)
+            states: Only jobs in these states (None for all)
+
+        Returns:
+            list: Jobs as returned by get
+        """
+        query, args = "SELECT * FROM jobs WHERE 1 = 1", []
+        if session_id is not None:
+            query += " AND session_id = ?"
+            args.append(session_id)
+        if states:
+            query += f" AND state IN ({', '.join('?' for _ in states)})"
+            args.extend(states)
+        with self._connect() as db:
+            return [_job(row) for row in db.execute(query + " ORDER BY created", args)]
+
+    def active_sessions(self):
+        """Ids of the sessions with queued or running jobs."""
+        with self._connect() as db:
+            rows = db.execute("SELECT DISTINCT session_id FROM jobs WHERE state IN ('queued', 'running')")
+            return {row['session_id'] for row in rows if row['session_id']}
+
+    def cancel(self, job_id):
+        """
+        Cancel a job that hasn't started yet.
+
+        Returns:
+            bool: Whether the job was cancelled (False if it is already running or finished)
+        """
+        with self._connect() as db:
+            cursor = db.execute(
+                "UPDATE jobs SET state = 'cancelled', finished = ? WHERE id = ? AND state = 'queued'",
+                (time.time(), job_id)
+            )
+            return cursor.rowcount > 0
+
+    def _requeue_abandoned(self, db):
+        """Queue again the running jobs whose owner's heartbeat has gone stale."""
+        cursor = db.execute(
+            "UPDATE jobs SET state = 'queued', started = NULL, owner = NULL, heartbeat = NULL "
+            "WHERE state = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+            (time.time() - self.stale_seconds,)
+        )
+        if cursor.rowcount:
+            print(f"Re-queued {cursor.rowcount} abandoned render job(s)")
+
+    def _claim(self):
+        """Move the oldest queued job to running and return it, or None if there is none."""
+        with self._connect() as db:
+            # An immediate transaction keeps two workers from claiming the same job
+            db.execute("BEGIN IMMEDIATE")
+            self._requeue_abandoned(db)
+            row = db.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            now = time.time()
+            db.execute("UPDATE jobs SET state = 'running', started = ?, progress = 0, owner = ?, heartbeat = ? "
+                       "WHERE id = ?", (now, self.owner, now, row['id']))
+            db.execute("COMMIT")
+        return _job(row)
+
+    def _update(self, job_id, **fields):
+        """Set columns of a job this instance owns (not once another instance took it over)."""
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as db:
+            db.execute(f"UPDATE jobs SET {columns} WHERE id = ? AND owner = ?",
+                       list(fields.values()) + [job_id, self.owner])
+
+    def _beat(self):
+        """Heartbeat loop: mark this instance's running jobs as still alive."""
+        while True:
+            try:
+                with self._connect() as db:
+                    db.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND state = 'running'",
+                               (time.time(), self.owner))
+            except sqlite3.Error as e:
+                print(f"Could not update job heartbeats: {e}")
+            time.sleep(self.heartbeat_interval)
+
+    def _work(self):
+        """Worker loop: run queued jobs one after another."""
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Could not read the job queue: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            def progress_callback(progress_pct, status_message, job_id=job['id']):
+                self._update(job_id, progress=float(progress_pct), message=str(status_message))
+
+            try:
+                result = self.handlers[job['kind']](job['params'], progress_callback)
+                self._update(job['id'], state="done", progress=100.0, result=json.dumps(result),
+                             finished=time.time())
+            except Exception as e:
+                self._update(job['id'], state="failed", message=str(e), error=traceback.format_exc(),
+                             finished=time.time())
+
+class _Connection:
+    """Context manager that closes an sqlite3 connection (sqlite3's own only commits)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, *exc_info):
+        self.db.close()
+
+def _job(row):
+    """Turn a jobs row into a dict with decoded params and result."""
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
@@ -0,0 +1,142 @@
+"""
+Per-source keyframe index, used to place segment starts on (or near) keyframes.
+
+Seeking to a time that is not a keyframe makes ffmpeg decode everything from the
+previous keyframe, which is expensive on long-GOP phone footage.
+"""
+
+import os
+import re
+import json
+import random
+import hashlib
+import subprocess
+import numpy as np
+
+from .ffmpeg_utils import get_ffprobe_binary, run_ffmpeg
+
+def scan_keyframes(video_path):
+    """
+    List the keyframe timestamps of a video's first video stream.
+
+    Uses an ffprobe packet scan (no decoding) when ffprobe is available, otherwise
+    asks ffmpeg to decode keyframes only and reads their timestamps from showinfo.
+
+    Args:
+        video_path: Path to the video file
+
+    Returns:
+        numpy.ndarray: Sorted keyframe times in seconds
+    """
+    ffprobe = get_ffprobe_binary()
+    times = []
+
+    if ffprobe:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-select_streams", "v:0",
+             "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"ffprobe failed: {result.stderr.decode('utf8', errors='ignore').strip()}")
+
+        for line in result.stdout.decode('utf8', errors='ignore').splitlines():
+            fields = line.strip().split(",")
+            if len(fields) >= 2 and "K" in fields[1] and fields[0] not in ("", "N/A"):
+                times.append(float(fields[0]))
+    else:
+        log = run_ffmpeg(["-skip_frame", "nokey", "-i", video_path, "-map", "0:v:0",
+                          "-vf", "showinfo", "-f", "null", "-"], loglevel="info")
+        times = [float(t) for t in re.findall(r"pts_time:\s*([-\d.]+)", log)]
+
+    return np.unique(np.asarray(times, dtype=np.float64))
+
+class KeyframeIndex:
+    """
+    Keyframe times per source, scanned once and cached in memory and on disk.
+    """
+
+    def __init__(self, cache_dir=".keyframe_cache"):
+        """
+        Initialize the keyframe index.
+
+        Args:
+            cache_dir: Directory to store scanned keyframe lists, or None for memory only
+        """
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # Keyframe arrays keyed by (path, size, mtime)
+        self._keyframes = {}
+
+    def _cache_key(self, video_path):
+        stat = os.stat(video_path)
+        return (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+
+    def keyframes(self, video_path):
+        """
+        Get the keyframe times of a video, scanning it on first use.
+
+        Args:
+            video_path: Path to the video file
+
+        Returns:
+            numpy.ndarray: Sorted keyframe times in seconds
+        """
+        key = self._cache_key(video_path)
+        if key in self._keyframes:
+            return self._keyframes[key]
+
+        cache_path = None
+        if self.cache_dir:
+            name = hashlib.sha1(json.dumps(key).encode('utf8')).hexdigest()
+            cache_path = os.path.join(self.cache_dir, f"{name}.json")
+
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                keyframes = np.asarray(json.load(f), dtype=np.float64)
+        else:
+            keyframes = scan_keyframes(video_path)
+            if cache_path:
+                with open(cache_path, "w") as f:
+                    json.dump(keyframes.tolist(), f)
+
+        self._keyframes[key] = keyframes
+        return keyframes
+
+    def place(self, video_path, start_time, lower=0.0, upper=None, tolerance=0.5, mode="snap"):
+        """
+        Move a segment start onto a keyframe.
+
+        Args:
+            video_path: Path to the video file
+            start_time: Proposed start time
+            lower: Earliest allowed start time
+            upper: Latest allowed start time (None for no limit)
+            tolerance: How far (in seconds) the start may move to the nearest keyframe
+            mode: "snap" moves the start to the nearest keyframe within tolerance;
+                "prefer" does the same, but when no keyframe is that close it picks a
+                random keyframe anywhere in the allowed range
+
+        Returns:
+            float: The new start time, or start_time if no keyframe qualifies
+        """
+        try:
+            keyframes = self.keyframes(video_path)
+        except Exception as e:
+            print(f"Could not index keyframes for {video_path}: {e}")
+            return start_time
+
+        if upper is None:
+            upper = np.inf
+        allowed = keyframes[(keyframes >= lower) & (keyframes <= upper)]
+        if not len(allowed):
+            return start_time
+
+        nearest = allowed[np.argmin(np.abs(allowed - start_time))]
+        if abs(nearest - start_time) <= tolerance:
+            return float(nearest)
+        if mode == "prefer":
+            return float(random.choice(allowed))
+        return start_time
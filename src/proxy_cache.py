@@ -0,0 +1,184 @@
+"""
+Content-addressed cache of normalized proxy videos.
+
+Each input is transcoded once into a 9:16 proxy at the output size and frame rate,
+with frequent keyframes so segments can be cut with cheap seeks. Later batches that
+use the same file (by content, not by name) reuse the proxy.
+"""
+
+import os
+import threading
+
+from .ffmpeg_utils import run_ffmpeg, normalize_filter, probe_video
+from .utils import hash_file
+
+# Bump when the proxy encoding changes, so old proxies are not reused
+PROXY_VERSION = 1
+
+class ProxyCache:
+    """
+    Normalized proxies stored under a content hash, with a least-recently-used size cap.
+    """
+
+    def __init__(self, cache_dir=".proxy_cache", max_bytes=2 * 1024 ** 3,
+                 width=1080, height=1920, fps=30, keyframe_interval=0.5):
+        """
+        Initialize the proxy cache.
+
+        Args:
+            cache_dir: Directory to store proxies in
+            max_bytes: Total size the cache is trimmed to after adding a proxy
+            width: Proxy width in pixels
+            height: Proxy height in pixels
+            fps: Proxy frame rate
+            keyframe_interval: Seconds between keyframes in the proxy
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Content hashes of files already seen, keyed by (path, size, mtime)
+        self._hashes = {}
+
+    @property
+    def gop(self):
+        """Frames between keyframes in the proxies."""
+        return max(1, int(round(self.fps * self.keyframe_interval)))
+
+    def _content_hash(self, video_path):
+        """Hash a file's content, reusing the result while the file is unchanged."""
+        stat = os.stat(video_path)
+        key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+        if key not in self._hashes:
+            self._hashes[key] = hash_file(video_path)
+        return self._hashes[key]
+
+    def proxy_path(self, video_path):
+        """
+        Get the path the proxy for a video is (or would be) stored at.
+        """
+        content_hash = self._content_hash(video_path)
+        # The GOP is part of the key: keyframe placement and stream copy depend on it
+        name = f"{content_hash}_{self.width}x{self.height}_{self.fps}fps_g{self.gop}_v{PROXY_VERSION}.mp4"
+        return os.path.join(self.cache_dir, name)
+
+    def get_proxy(self, video_path, keep=()):
+        """
+        Get the normalized proxy for a video, transcoding it on first use.
+
+        Args:
+            video_path: Path to the original video
+            keep: Other proxy paths that must survive the eviction after a transcode
+
+        Returns:
+            str: Path to the proxy video
+        """
+        proxy_path = self.proxy_path(video_path)
+
+        if os.path.exists(proxy_path):
+            # Mark as recently used for LRU eviction
+            os.utime(proxy_path)
+            return proxy_path
+
+        source = probe_video(video_path)
+        vf = (f"{normalize_filter(source['width'], source['height'], self.width, self.height)},"
+              f"fps={self.fps},setsar=1,format=yuv420p")
+
+        # Write to a temporary name first so a failed or concurrent transcode (another
+        # process, or another render worker thread) never leaves a partial proxy behind
+        tmp_path = f"{proxy_path}.{os.getpid()}_{threading.get_ident()}.tmp.mp4"
+        try:
+            run_ffmpeg([
+                "-i", video_path,
+                "-vf", vf,
+                "-c:v", "libx264",
+                "-preset", "veryfast",
+                "-crf", "18",
+                "-g", str(self.gop),
+                "-keyint_min", str(self.gop),
+                "-sc_threshold", "0",
+                "-c:a", "aac",
+                "-movflags", "+faststart",
+                tmp_path
+            ])
+            os.replace(tmp_path, proxy_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.evict(keep={proxy_path, *keep})
+        return proxy_path
+
+    def ingest(self, video_paths, progress_callback=None):
+        """
+        Make sure every video has a proxy.
+
+        Args:
+            video_paths: List of original video paths
+            progress_callback: Function to report progress (progress_pct, status_message)
+
+        Returns:
+            list: Proxy paths in the same order; the original path is kept for any
+            video that could not be transcoded
+        """
+        proxies = []
+        for i, video_path in enumerate(video_paths):
+            if progress_callback:
+                progress_callback(int(5 * i / len(video_paths)), f"Preparing {os.path.basename(video_path)}...")
+            try:
+                # Never evict a proxy this batch is about to use
+                proxies.append(self.get_proxy(video_path, keep=proxies))
+            except Exception as e:
+                if progress_callback:
+                    progress_callback(int(5 * i / len(video_paths)), f"Could not prepare {os.path.basename(video_path)}: {e}")
+                else:
+                    print(f"Could not create proxy for {video_path}: {e}")
+                proxies.append(video_path)
+        return proxies
+
+    def usage(self):
+        """
+        Get the proxies currently in the cache.
+
+        Returns:
+            list: (path, size_in_bytes, last_used) tuples, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".mp4") and ".tmp." not in name and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used proxies until the cache fits in max_bytes.
+
+        Args:
+            keep: Proxy paths that must not be removed (e.g. ones in use by the current batch)
+
+        Returns:
+            int: Number of bytes freed
+        """
+        entries = self.usage()
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if keep and path in keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                freed += size
+            except OSError as e:
+                print(f"Could not evict proxy {path}: {e}")
+
+        return freed
@@ -0,0 +1,90 @@
+"""
+Handlers that run the app's renders as JobQueue jobs.
+
+Each handler takes the job's JSON parameters and a progress callback, and returns a
+JSON-serializable result, so a render can run in a worker thread while the Streamlit
+script that submitted it re-runs or disconnects.
+"""
+
+import threading
+
+from .generator import VideoGenerator
+from .proxy_cache import ProxyCache
+from .zip_export import BatchZip
+
+# Proxy caches shared by the jobs of this process, keyed by directory
+_proxy_caches = {}
+_proxy_caches_lock = threading.Lock()
+
+def get_proxy_cache(cache_dir):
+    """Get the process's ProxyCache for a directory, so jobs share its content hashes."""
+    with _proxy_caches_lock:
+        if cache_dir not in _proxy_caches:
+            _proxy_caches[cache_dir] = ProxyCache(cache_dir)
+        return _proxy_caches[cache_dir]
+
+def run_generate_job(params, progress_callback=None):
+    """
+    Generate a batch of scrambled videos (or low-resolution previews).
+
+    Args:
+        params: Dict with video_paths, audio_path, num_videos, segment_duration, output_dir,
+            text_overlay, use_effects, encode_profile, plans_path, preview, zip_dir
+            (optional: archive the outputs there as they finish, see zip_export.py) and
+            proxy_cache_dir (optional: render from normalized proxies cached there)
+        progress_callback: Function to report progress (progress_pct, status_message)
+
+    Returns:
+        dict: videos (output paths), plans_path, preview and zip_parts
+    """
+    archive = BatchZip(params['zip_dir']) if params.get('zip_dir') else None
+    proxy_cache = get_proxy_cache(params['proxy_cache_dir']) if params.get('proxy_cache_dir') else None
+    video_paths = params['video_paths']
+    generator = VideoGenerator(video_paths[0])
+    videos = generator.generate_scrambled_videos(
+        num_videos=params['num_videos'],
+        segment_duration=params['segment_duration'],
+        output_dir=params['output_dir'],
+        additional_videos=video_paths[1:] or None,
+        audio_path=params.get('audio_path'),
+        text_overlay=params.get('text_overlay'),
+        use_effects=params.get('use_effects', True),
+        encode_profile=params['encode_profile'],
+        plans_path=params.get('plans_path'),
+        proxy_cache=proxy_cache,
+        progress_callback=progress_callback,
+        output_callback=archive.add if archive else None
+    )
+    return {'videos': videos or [], 'plans_path': params.get('plans_path'), 'preview': params.get('preview', False),
+            'zip_parts': archive.finish() if archive else None}
+
+def run_render_selected_job(params, progress_callback=None):
+    """
+    Render approved previews again at full quality, from their saved plans.
+
+    Args:
+        params: Dict with plans_path, output_names, output_dir, encode_profile, zip_dir (optional)
+            and proxy_cache_dir (optional: where evicted proxies of the plans are rebuilt)
+        progress_callback: Function to report progress (progress_pct, status_message)
+
+    Returns:
+        dict: videos (output paths) and zip_parts
+    """
+    archive = BatchZip(params['zip_dir']) if params.get('zip_dir') else None
+    generator = VideoGenerator(None)
+    videos = generator.render_selected(
+        params['plans_path'],
+        params['output_names'],
+        output_dir=params['output_dir'],
+        encode_profile=params['encode_profile'],
+        proxy_cache=get_proxy_cache(params['proxy_cache_dir']) if params.get('proxy_cache_dir') else None,
+        progress_callback=progress_callback,
+        output_callback=archive.add if archive else None
+    )
+    return {'videos': videos or [], 'preview': False, 'zip_parts': archive.finish() if archive else None}
+
+# Job kinds the app submits, for JobQueue
+RENDER_JOB_HANDLERS = {
+    "generate": run_generate_job,
+    "render_selected": run_render_selected_job,
+}
@@ -0,0 +1,245 @@
+"""
+Batch-wide similarity lookups for clip selection: whole-source signatures and
+per-source fingerprint timelines for comparing individual segments.
+"""
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .encode_profiles import available_cpus
+from .source_scan import get_scan
+from .ann_index import SegmentIndex
+
+# Largest batch whose full pairwise similarity matrix is computed up front; larger
+# libraries compare only the rows a query needs and search through a SegmentIndex
+DENSE_LIMIT = 1024
+
+class SignatureMatrix:
+    """
+    Visual signatures of a batch as one L2-normalized float32 matrix, with every
+    pairwise cosine similarity computed up front in a single matmul.
+
+    Selecting clips then only indexes into the similarity matrix instead of
+    rebuilding arrays and norms for every candidate/used pair. Above DENSE_LIMIT
+    signatures the pairwise matrix is skipped and `index` answers searches instead.
+    """
+
+    def __init__(self, signatures):
+        """
+        Build the matrices.
+
+        Args:
+            signatures: Dict of clip index -> signature vector (e.g. a source timeline average)
+        """
+        self.keys = sorted(signatures)
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+
+        if self.keys:
+            width = max(len(signatures[key]) for key in self.keys)
+            matrix = np.zeros((len(self.keys), width), dtype=np.float32)
+            for row, key in enumerate(self.keys):
+                matrix[row, :len(signatures[key])] = signatures[key]
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        # Zero signatures stay zero, so their similarity to anything is 0 (as calculate_similarity)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        self.similarity = self.matrix @ self.matrix.T if len(self.keys) <= DENSE_LIMIT else None
+        self._index = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    @property
+    def index(self):
+        """SegmentIndex over the signatures, built on first use."""
+        if self._index is None:
+            self._index = SegmentIndex(self.matrix, self.keys)
+        return self._index
+
+    def _block(self, rows, columns):
+        """Similarities of some rows to some columns, from the dense matrix if there is one."""
+        if self.similarity is not None:
+            return self.similarity[np.ix_(rows, columns)]
+        return self.matrix[rows] @ self.matrix[columns].T
+
+    def pair_similarity(self, a, b):
+        """Cosine similarity of two clips' signatures (0 if either has none)."""
+        if a not in self.rows or b not in self.rows:
+            return 0.0
+        return float(self._block([self.rows[a]], [self.rows[b]])[0, 0])
+
+    def farthest(self, candidates, used, k=16):
+        """
+        Approximate k candidates with the highest average dissimilarity to the used clips,
+        without scoring every candidate (see SegmentIndex.farthest_from).
+
+        Returns:
+            list: Candidate clip indices, most dissimilar first (may be fewer than k)
+        """
+        used_rows = [self.rows[key] for key in used if key in self.rows]
+        if not used_rows:
+            return []
+        allowed = set(candidates)
+
+        # Ask for extra results, as some of them may not be candidates
+        found = self.index.farthest_from(self.matrix[used_rows], k=k * 4, exclude=used)
+        return [key for key, _ in found if key in allowed][:k]
+
+    def mean_dissimilarity(self, candidates, used):
+        """
+        Average dissimilarity (1 - cosine similarity) of each candidate to the used clips.
+
+        Args:
+            candidates: Clip indices to score
+            used: Clip indices to compare against (repeats count more than once)
+
+        Returns:
+            numpy.ndarray: One score per candidate, higher is more dissimilar; 0 for candidates
+            without a signature or when none of the used clips has one
+        """
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        used_rows = [self.rows[key] for key in used if key in self.rows]
+        if not used_rows:
+            return scores
+
+        known = [n for n, key in enumerate(candidates) if key in self.rows]
+        if known:
+            candidate_rows = [self.rows[candidates[n]] for n in known]
+            block = self._block(candidate_rows, used_rows)
+            scores[known] = 1.0 - block.mean(axis=1)
+        return scores
+
+class FingerprintTimeline:
+    """
+    Fingerprints of one source every `window` seconds, as a contiguous (windows, features)
+    float32 array, with prefix sums so any time range reduces to one subtraction.
+    """
+
+    def __init__(self, features, window):
+        """
+        Args:
+            features: Array of shape (windows, features), one row per window
+            window: Seconds covered by each row
+        """
+        self.features = np.ascontiguousarray(features, dtype=np.float32)
+        self.window = window
+        self.prefix = np.zeros((len(self.features) + 1, self.features.shape[1]), dtype=np.float64)
+        np.cumsum(self.features, axis=0, out=self.prefix[1:])
+
+    def __len__(self):
+        return len(self.features)
+
+    @property
+    def duration(self):
+        return len(self.features) * self.window
+
+    def segment_vector(self, start, end):
+        """
+        Average fingerprint of the windows overlapping [start, end).
+
+        Returns:
+            numpy.ndarray: Feature vector (zeros if the timeline is empty)
+        """
+        if not len(self.features):
+            return np.zeros(self.features.shape[1], dtype=np.float32)
+        first = min(max(0, int(start / self.window)), len(self.features) - 1)
+        last = min(max(first + 1, int(np.ceil(end / self.window))), len(self.features))
+        return ((self.prefix[last] - self.prefix[first]) / (last - first)).astype(np.float32)
+
+def build_timeline(video_path, window=0.5, cache=None):
+    """
+    Fingerprint a source: one small RGB thumbnail (scaled to 0-1) every `window`
+    seconds, from the shared low-resolution analysis decode (see source_scan.py).
+
+    Args:
+        video_path: Path to the video file
+        window: Seconds between fingerprints
+        cache: FeatureCache to load the fingerprints from / store them in, or None
+
+    Returns:
+        FingerprintTimeline: The source's timeline
+    """
+    return FingerprintTimeline(get_scan(video_path, window, cache)['timeline'], window)
+
+def segment_matrix(timelines, segments):
+    """
+    L2-normalized fingerprints of several segments, one row each.
+
+    Args:
+        timelines: Dict or list of FingerprintTimeline, indexed by source
+        segments: List of (source, start, end)
+
+    Returns:
+        numpy.ndarray: float32 array of shape (len(segments), features)
+    """
+    vectors = np.asarray([timelines[source].segment_vector(start, end) for source, start, end in segments],
+                         dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def cosine_similarity_matrix(a, b):
+    """
+    Cosine similarity of every row of `a` with every row of `b`, in one matrix product.
+
+    Args:
+        a: Stacked feature vectors, shape (n, features)
+        b: Stacked feature vectors, shape (m, features)
+
+    Returns:
+        numpy.ndarray: float32 array of shape (n, m); rows that are all zeros score 0
+    """
+    def normalize(matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    return normalize(a) @ normalize(b).T
+
+def segment_similarity(timelines, segment1, segment2):
+    """
+    Cosine similarity of two (source, start, end) segments, from their timelines.
+    """
+    vectors = segment_matrix(timelines, [segment1, segment2])
+    return float(vectors[0] @ vectors[1])
+
+def scan_sources(video_paths, window=0.5, workers=None, cache=None):
+    """
+    Run the shared analysis decode of several sources in parallel (one ffmpeg decode each).
+
+    Args:
+        video_paths: List of video paths
+        window: Seconds between fingerprints
+        workers: Number of sources decoded at once (default: usable CPUs)
+        cache: FeatureCache shared by all sources, or None
+
+    Returns:
+        list: Analysis arrays per path (see source_scan.get_scan), or None where a
+        source could not be decoded
+    """
+    if workers is None:
+        workers = available_cpus()
+
+    def scan(video_path):
+        try:
+            return get_scan(video_path, window, cache)
+        except Exception as e:
+            print(f"Could not analyse {video_path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(video_paths) or 1))) as executor:
+        return list(executor.map(scan, video_paths))
+
+def build_timelines(video_paths, window=0.5, workers=None, cache=None):
+    """
+    Build the timelines of several sources in parallel (one ffmpeg decode each).
+
+    Returns:
+        list: FingerprintTimeline per path, or None where a source could not be decoded
+    """
+    scans = scan_sources(video_paths, window, workers, cache)
+    return [FingerprintTimeline(scan['timeline'], window) if scan is not None else None for scan in scans]
@@ -0,0 +1,185 @@
+"""
+One low-resolution decode per source feeding every per-source analysis: fingerprint
+timeline, per-second interest metrics and shot boundaries.
+"""
+
+import random
+import numpy as np
+import cv2
+
+from .ffmpeg_utils import iter_frames
+
+# Frame rate and size (width, height) of the shared analysis decode
+SCAN_FPS = 4
+SCAN_SIZE = (64, 114)
+
+# Thumbnail size (width, height) of each fingerprint window
+FINGERPRINT_SIZE = (9, 16)
+
+# Histogram distance (0-1, total variation over 32 gray levels) above which
+# consecutive frames are treated as a hard cut
+CUT_THRESHOLD = 0.4
+
+def scan_source(video_path, window=0.5, fps=SCAN_FPS, size=SCAN_SIZE):
+    """
+    Decode a video once and compute all per-source analysis arrays.
+
+    Args:
+        video_path: Path to the video file
+        window: Seconds per fingerprint row (rounded to whole decoded frames)
+        fps: Frames decoded per second of video
+        size: Decode (width, height)
+
+    Returns:
+        dict: 'timeline' (windows, features) float32 fingerprints scaled to 0-1,
+        'interest' (seconds, 3) float32 entropy, motion and brightness per second, and
+        'shots' sorted float64 times of detected cuts
+    """
+    frames_per_window = max(1, int(round(window * fps)))
+    thumb_width, thumb_height = FINGERPRINT_SIZE
+
+    fingerprints = []  # Per window: sum of thumbnails, frames
+    interest = []      # Per second: entropy sum, motion sum, brightness sum, frames, motion samples
+    shots = []
+    history = []
+    previous_hist = None
+
+    for k, frame in enumerate(iter_frames(video_path, size[0], size[1], fps=fps)):
+        # Fingerprint: average thumbnail of the frames in each window
+        if k // frames_per_window == len(fingerprints):
+            fingerprints.append([np.zeros(thumb_width * thumb_height * 3, dtype=np.float32), 0])
+        thumbnail = cv2.resize(frame, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+        fingerprints[-1][0] += thumbnail.reshape(-1)
+        fingerprints[-1][1] += 1
+
+        second = k // fps
+        if second == len(interest):
+            interest.append([0.0, 0.0, 0.0, 0, 0])
+        bucket = interest[second]
+
+        # Calculate brightness (simple average)
+        bucket[2] += np.mean(frame) / 255.0
+
+        # Calculate visual entropy (how much information/detail in the frame)
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+        hist = hist / hist.sum()  # Normalize
+        non_zero_hist = hist[hist > 0]
+        bucket[0] += -np.sum(non_zero_hist * np.log2(non_zero_hist))
+        bucket[3] += 1
+
+        # Calculate motion against the frame one second earlier (simple difference)
+        history.append(gray)
+        if len(history) > fps:
+            previous = history.pop(0)
+            bucket[1] += np.mean(np.abs(gray.astype(np.float32) - previous.astype(np.float32))) / 255.0
+            bucket[4] += 1
+
+        # Shot boundaries: a large jump in the coarse gray histogram between consecutive frames
+        coarse = hist.reshape(32, 8).sum(axis=1)
+        if previous_hist is not None and 0.5 * np.abs(coarse - previous_hist).sum() > CUT_THRESHOLD:
+            shots.append(k / fps)
+        previous_hist = coarse
+
+    timeline = np.zeros((len(fingerprints), thumb_width * thumb_height * 3), dtype=np.float32)
+    for row, (total, frames) in enumerate(fingerprints):
+        timeline[row] = total / frames / 255.0
+
+    metrics = np.zeros((len(interest), 3), dtype=np.float32)
+    for second, (entropy, motion, brightness, frames, motion_samples) in enumerate(interest):
+        metrics[second] = (entropy / frames, motion / motion_samples if motion_samples else 0.0, brightness / frames)
+
+    return {
+        'timeline': timeline,
+        'interest': metrics,
+        'shots': np.asarray(shots, dtype=np.float64),
+    }
+
+def get_scan(video_path, window=0.5, cache=None):
+    """
+    Get a source's analysis arrays, from the FeatureCache when possible.
+
+    Args:
+        video_path: Path to the video file
+        window: Seconds per fingerprint row
+        cache: FeatureCache to load from / store in, or None
+
+    Returns:
+        dict: Arrays as returned by scan_source (possibly memory-mapped)
+    """
+    if cache is None:
+        return scan_source(video_path, window)
+
+    params = {'window': window, 'fps': SCAN_FPS, 'size': list(SCAN_SIZE),
+              'fingerprint_size': list(FINGERPRINT_SIZE), 'cut_threshold': CUT_THRESHOLD}
+    scan = {kind: cache.load(video_path, kind, params) for kind in ('timeline', 'interest', 'shots')}
+    if any(array is None for array in scan.values()):
+        scan = scan_source(video_path, window)
+        for kind, array in scan.items():
+            try:
+                cache.save(video_path, kind, params, array)
+            except OSError as e:
+                print(f"Could not cache {kind} features for {video_path}: {e}")
+    return scan
+
+def shot_ranges(boundaries, duration, clip_duration, lower=0.0, upper=None):
+    """
+    Start-time ranges for a clip that doesn't straddle a cut.
+
+    Args:
+        boundaries: Sorted cut times from scan_source
+        duration: Duration of the source
+        clip_duration: Length of the clip
+        lower: Earliest allowed start
+        upper: Latest allowed start (default: duration - clip_duration)
+
+    Returns:
+        list: (earliest start, latest start) per shot long enough for the clip
+    """
+    if upper is None:
+        upper = duration - clip_duration
+    edges = np.concatenate(([0.0], np.asarray(boundaries, dtype=np.float64), [duration]))
+
+    ranges = []
+    for shot_start, shot_end in zip(edges[:-1], edges[1:]):
+        start = max(shot_start, lower)
+        end = min(shot_end - clip_duration, upper)
+        if end >= start:
+            ranges.append((float(start), float(end)))
+    return ranges
+
+def restrict_to_shots(segments, boundaries, clip_duration):
+    """
+    Narrow free (start, end) segments so a clip placed in them stays inside one shot.
+
+    Args:
+        segments: Free ranges as (start, end), e.g. from find_available_segments
+        boundaries: Sorted cut times of the source
+        clip_duration: Length of the clip
+
+    Returns:
+        list: (start, end) ranges that each hold the whole clip within a single shot
+    """
+    restricted = []
+    for segment_start, segment_end in segments:
+        for start, latest in shot_ranges(boundaries, segment_end, clip_duration, lower=segment_start):
+            restricted.append((start, latest + clip_duration))
+    return restricted
+
+def candidate_starts(boundaries, duration, clip_duration, count):
+    """
+    Draw clip start times that don't straddle a cut, at most one per shot.
+
+    Args:
+        boundaries: Sorted cut times of the source
+        duration: Duration of the source
+        clip_duration: Length of the clip
+        count: Maximum number of candidates
+
+    Returns:
+        list: Start times (empty if no shot is long enough)
+    """
+    ranges = shot_ranges(boundaries, duration, clip_duration)
+    if len(ranges) > count:
+        ranges = random.sample(ranges, count)
+    return [random.uniform(start, end) for start, end in ranges]
@@ -0,0 +1,134 @@
+"""
+Session-scoped store of uploaded files, addressed by content.
+
+Streamlit re-runs the whole script on every widget change, handing the same uploads
+back each time. The store remembers what it has already written (by Streamlit file id
+and by content hash), so a rerun costs a dictionary lookup instead of rewriting every
+upload, and metadata computed for an upload (e.g. its probed duration) is kept with it.
+"""
+
+import os
+import shutil
+
+from .utils import save_stream
+
+def upload_key(uploaded_file):
+    """
+    Identify an upload across reruns without reading it.
+
+    Uses Streamlit's file id where available, otherwise the name and size.
+    """
+    file_id = getattr(uploaded_file, "file_id", None) or getattr(uploaded_file, "id", None)
+    if file_id is not None:
+        return str(file_id)
+    return f"{uploaded_file.name}:{getattr(uploaded_file, 'size', '')}"
+
+class UploadStore:
+    """
+    Uploaded files of one session, each stored once under its content hash.
+    """
+
+    def __init__(self, root_dir):
+        """
+        Initialize the store.
+
+        Args:
+            root_dir: Directory the uploads are written to (one subdirectory per content hash)
+        """
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+        # Upload key -> content hash, and content hash -> entry
+        self._keys = {}
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, uploaded_file):
+        """
+        Store an upload, unless this upload (or the same content) is already stored.
+
+        Args:
+            uploaded_file: Streamlit UploadedFile (or any named, readable file-like object)
+
+        Returns:
+            dict: Entry with path, name, sha1, size, metadata and written (False when the
+            upload was already stored and nothing was written)
+        """
+        key = upload_key(uploaded_file)
+        sha1 = self._keys.get(key)
+        if sha1 in self._entries and os.path.exists(self._entries[sha1]['path']):
+            return dict(self._entries[sha1], written=False)
+
+        # The directory is gone if the workspace evicted this session while it was idle
+        os.makedirs(self.root_dir, exist_ok=True)
+
+        # Write under a temporary name while hashing, then move into the content's directory
+        tmp_path = os.path.join(self.root_dir, f".{os.getpid()}_{os.path.basename(uploaded_file.name)}")
+        sha1, size = save_stream(uploaded_file, tmp_path)
+        self._keys[key] = sha1
+
+        entry = self._entries.get(sha1)
+        if entry is not None and os.path.exists(entry['path']):
+            # Same content uploaded again (e.g. under another name): keep the stored copy
+            os.remove(tmp_path)
+            return dict(entry, written=False)
+
+        content_dir = os.path.join(self.root_dir, sha1[:16])
+        os.makedirs(content_dir, exist_ok=True)
+        path = os.path.join(content_dir, os.path.basename(uploaded_file.name))
+        os.replace(tmp_path, path)
+
+        entry = {'path': path, 'name': uploaded_file.name, 'sha1': sha1, 'size': size, 'metadata': {}}
+        self._entries[sha1] = entry
+        return dict(entry, written=True)
+
+    def metadata(self, sha1, name, compute):
+        """
+        Get a piece of metadata for a stored upload, computing it only the first time.
+
+        Args:
+            sha1: Content hash of the upload (from add)
+            name: Name of the metadata, e.g. "probe"
+            compute: Function of the stored path returning the value
+
+        Returns:
+            The (possibly previously computed) value
+        """
+        entry = self._entries[sha1]
+        if name not in entry['metadata']:
+            entry['metadata'][name] = compute(entry['path'])
+        return entry['metadata'][name]
+
+    def retain(self, uploaded_files, keep_paths=()):
+        """
+        Delete stored uploads that are no longer among the given uploads.
+
+        Args:
+            uploaded_files: Uploads still present in the session (across all uploaders)
+            keep_paths: Stored paths to keep even if their upload is gone, e.g. files
+                a queued render or a saved preview's plans still use
+
+        Returns:
+            int: Number of bytes freed
+        """
+        active = {self._keys.get(upload_key(uploaded_file)) for uploaded_file in uploaded_files}
+        keep_paths = set(keep_paths)
+        active.update(sha1 for sha1, entry in self._entries.items() if entry['path'] in keep_paths)
+        freed = 0
+        for sha1 in [sha1 for sha1 in self._entries if sha1 not in active]:
+            entry = self._entries.pop(sha1)
+            freed += entry['size']
+            shutil.rmtree(os.path.dirname(entry['path']), ignore_errors=True)
+        self._keys = {key: sha1 for key, sha1 in self._keys.items() if sha1 in self._entries}
+        return freed
+
+    def usage(self):
+        """
+        Get the total size of the stored uploads.
+
+        Returns:
+            int: Bytes stored
+        """
+        return sum(entry['size'] for entry in self._entries.values())
@@ -1,4 +1,6 @@
+import os
 import glob
+import hashlib
 import random
 from moviepy.editor import VideoFileClip
 from moviepy.video.fx.fadeout import fadeout
@@ -23,10 +25,68 @@ def get_video_duration(video_path):
         print(f"Error getting video duration: {e}")
         return 0
 
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """
+    Hash the content of a file in fixed-size chunks, so large videos are never
+    held in memory at once.
+    
+    Args:
+        file_path: Path to the file
+        chunk_size: Number of bytes read per chunk
+        
+    Returns:
+        str: SHA-1 hex digest of the file content
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def save_stream(stream, file_path, chunk_size=1024 * 1024):
+    """
+    Copy a file-like object (e.g. a Streamlit upload) to disk in fixed-size chunks,
+    hashing it on the way, so the copy adds no more than one chunk of memory.
+    
+    This doesn't reduce the memory an upload itself takes: Streamlit keeps every
+    UploadedFile in memory until the session drops it, which is bounded only by
+    server.maxUploadSize (see .streamlit/config.toml).
+    
+    The data is written to a temporary name and moved into place when complete, so
+    an interrupted copy never leaves a truncated file at file_path.
+    
+    Args:
+        stream: Readable binary file-like object (read from its start if seekable)
+        file_path: Destination path
+        chunk_size: Number of bytes copied per chunk
+        
+    Returns:
+        tuple: (SHA-1 hex digest of the content, number of bytes written)
+    """
+    digest = hashlib.sha1()
+    size = 0
+    tmp_path = f"{file_path}.{os.getpid()}.part"
+    
+    if hasattr(stream, "seek"):
+        stream.seek(0)
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    return digest.hexdigest(), size
+
 def get_video_files(input_folder):
     return glob.glob(f"{input_folder}/*.mp4") + glob.glob(f"{input_folder}/*.mov")
 
-def get_random_clip(video_path, duration=4, used_segments=None):
+def get_random_clip(video_path, duration=4, used_segments=None, keyframe_index=None,
+                    keyframe_mode="snap", keyframe_tolerance=0.5):
     """
     Get a random clip from a video file, avoiding previously used segments.
     
@@ -34,6 +94,9 @@ def get_random_clip(video_path, duration=4, used_segments=None):
         video_path: Path to the video file
         duration: Desired duration of the clip (in seconds)
         used_segments: List of (video_path, start_time, end_time) tuples of segments already used
+        keyframe_index: KeyframeIndex used to move the start onto a keyframe, or None
+        keyframe_mode: "snap" or "prefer", see KeyframeIndex.place
+        keyframe_tolerance: How far (in seconds) a start may move in "snap" mode
     
     Returns:
         A VideoFileClip object with the random segment
@@ -44,10 +107,17 @@ def get_random_clip(video_path, duration=4, used_segments=None):
     if clip.duration <= duration:
         return clip.subclip(0, clip.duration)
     
+    def subclip_at(start):
+        # Place the start on a keyframe so the seek doesn't decode from an earlier one
+        if keyframe_index is not None:
+            start = keyframe_index.place(video_path, start, lower=0, upper=clip.duration - duration,
+                                         tolerance=keyframe_tolerance, mode=keyframe_mode)
+        return clip.subclip(start, start + duration)
+    
     # If no used segments for this video, just pick a random start time
     if used_segments is None or not any(s[0] == video_path for s in used_segments):
         start = random.uniform(0, clip.duration - duration)
-        return clip.subclip(start, start + duration)
+        return subclip_at(start)
     
     # Get all used segments for this specific video
     video_used_segments = [(s[1], s[2]) for s in used_segments if s[0] == video_path]
@@ -69,7 +139,7 @@ def get_random_clip(video_path, duration=4, used_segments=None):
         
         # If no overlap, use this segment
         if not overlap:
-            return clip.subclip(start, end)
+            return subclip_at(start)
     
     # If we couldn't find a non-overlapping segment after max attempts,
     # try to find the segment with the least overlap
@@ -97,11 +167,11 @@ def get_random_clip(video_path, duration=4, used_segments=None):
     
     # Use the segment with the least overlap
     if best_start is not None:
-        return clip.subclip(best_start, best_start + duration)
+        return subclip_at(best_start)
     
     # Fallback: just use a random segment
     start = random.uniform(0, clip.duration - duration)
-    return clip.subclip(start, start + duration)
+    return subclip_at(start)
 
 def pad_clip_to_ratio(clip, target_ratio=(9,16)):
     """
@@ -126,6 +196,38 @@ def pad_clip_to_ratio(clip, target_ratio=(9,16)):
     padding = (target_height - clip.h) / 2
     return clip.margin(top=int(padding), bottom=int(padding), color=(0,0,0))
 
+def normalize_geometry(width, height, target_width=1080, target_height=1920):
+    """
+    Work out how a frame of the given size maps onto the target frame.
+    
+    Vertical videos (height > width) are center-cropped to the target aspect ratio
+    so they fill the frame; other videos are scaled to the target width and
+    letterboxed with black bars on top and bottom.
+    
+    Args:
+        width: Source width in pixels
+        height: Source height in pixels
+        target_width: Output width in pixels
+        target_height: Output height in pixels
+        
+    Returns:
+        tuple: ((crop_x, crop_y, crop_w, crop_h), (dest_x, dest_y, dest_w, dest_h)),
+        the source region to use and where it goes in the output frame
+    """
+    if height > width:
+        # Crop the source to the target aspect ratio (even sizes keep yuv420p happy)
+        target_aspect = target_width / target_height
+        if width / height > target_aspect:
+            crop_w, crop_h = int(height * target_aspect) // 2 * 2, height
+        else:
+            crop_w, crop_h = width, int(width / target_aspect) // 2 * 2
+        crop = ((width - crop_w) // 2, (height - crop_h) // 2, crop_w, crop_h)
+        return crop, (0, 0, target_width, target_height)
+    
+    # Scale by width, then pad top and bottom
+    dest_h = min(target_height, int(round(height * target_width / width / 2)) * 2)
+    return (0, 0, width, height), (0, (target_height - dest_h) // 2, target_width, dest_h)
+
 def prepare_clip_for_concat(clip, add_transitions=True):
     """
     Prepare a clip for concatenation by adding subtle effects
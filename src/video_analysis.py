@@ -1,10 +1,67 @@
 import os
 import numpy as np
 import cv2
-from moviepy.editor import VideoFileClip
 import random
 from collections import defaultdict
 
+from .similarity import build_timeline, segment_matrix, cosine_similarity_matrix
+from .feature_cache import FeatureCache
+from .ffmpeg_utils import probe_video, read_frames, sample_frames
+from .source_scan import get_scan, candidate_starts, SCAN_SIZE
+from .ann_index import SegmentIndex
+
+# Length of the segments indexed for large libraries (see library_index)
+INDEX_SEGMENT_SECONDS = 4.0
+
+class InterestTimeline:
+    """
+    Per-second entropy, motion and brightness of one source, with prefix sums so the
+    interestingness of any window is O(1).
+    """
+    
+    def __init__(self, metrics):
+        """
+        Args:
+            metrics: Array of shape (seconds, 3) with mean entropy (bits), motion (0-1)
+                and brightness (0-1) for each second of the video
+        """
+        self.metrics = np.asarray(metrics, dtype=np.float32).reshape(-1, 3)
+        self.prefix = np.zeros((len(self.metrics) + 1, 3), dtype=np.float64)
+        np.cumsum(self.metrics, axis=0, out=self.prefix[1:])
+    
+    def __len__(self):
+        return len(self.metrics)
+    
+    def score(self, start_time, end_time):
+        """
+        Score how interesting one or more windows are, on the same 0-10 scale as
+        score_clip_interestingness.
+        
+        Args:
+            start_time: Window start in seconds (a number or an array)
+            end_time: Window end in seconds (same shape as start_time)
+            
+        Returns:
+            The score(s), as a float or an array matching the inputs
+        """
+        if not len(self.metrics):
+            return np.zeros(np.shape(start_time), dtype=np.float32) if np.ndim(start_time) else 0.0
+        
+        # Whole seconds touched by each window
+        first = np.clip(np.floor(np.asarray(start_time, dtype=np.float64)).astype(int), 0, len(self.metrics) - 1)
+        last = np.clip(np.ceil(np.asarray(end_time, dtype=np.float64)).astype(int), first + 1, len(self.metrics))
+        means = (self.prefix[last] - self.prefix[first]) / (last - first)[..., None]
+        visual_entropy, motion_score, brightness_score = means[..., 0] / 8.0, means[..., 1], means[..., 2]
+        
+        # Calculate combined score (0-10), weighted as in score_clip_interestingness
+        combined_score = (
+            3.0 * visual_entropy +  # Detail/information
+            5.0 * motion_score +    # Movement (most important)
+            2.0 * brightness_score  # Brightness
+        )
+        scores = np.clip(combined_score * 10, 0, 10)
+        return scores if np.ndim(start_time) else float(scores)
+
 class VideoContentAnalyzer:
     """
     A class that provides AI-based video content analysis features:
@@ -13,65 +70,103 @@ class VideoContentAnalyzer:
     3. Scores clip "interestingness" for better content selection
     """
     
-    def __init__(self, cache_dir=".clip_cache"):
+    def __init__(self, cache_dir=".clip_cache", max_cache_bytes=512 * 1024 ** 2, interest_mode="timeline"):
         """
         Initialize the video analyzer.
         
         Args:
             cache_dir: Directory to store processed frame features
+            max_cache_bytes: Size the on-disk feature cache is kept under
+            interest_mode: "timeline" to score clips from per-second metrics (one decode per
+                source), or "sampled" to decode each clip's frames on every call
         """
         self.cache_dir = cache_dir
         os.makedirs(cache_dir, exist_ok=True)
         
+        # Features persisted across sessions, keyed by file content
+        self.feature_cache = FeatureCache(cache_dir, max_bytes=max_cache_bytes)
+        
         # Frame features cache to avoid recomputing for the same clip
         self.frame_features_cache = {}
         
+        # Fingerprint timelines per video, for comparing time ranges
+        self.timelines = {}
+        
+        # Interest timelines per video, for scoring time ranges
+        self.interest_mode = interest_mode
+        self.interest_timelines = {}
+        
+        # ANN indexes of whole libraries, keyed by their path in the feature cache
+        self.library_indexes = {}
+        
         # Track clip similarity scores between clips
         self.similarity_scores = defaultdict(dict)
         
         # Track clips used in each output video
         self.clips_used_in_videos = defaultdict(list)
     
-    def extract_frame_features(self, video_path, num_frames=10):
+    def extract_frame_features(self, video_path, num_frames=10, sampling="accurate", return_times=False):
         """
         Extract visual features from key frames of the video.
         
         Args:
             video_path: Path to the video file
             num_frames: Number of frames to sample from the video
+            sampling: "accurate" for frames at evenly spaced times, or "keyframes" to decode
+                only keyframes and use the one nearest each of those times (much faster,
+                good enough for coarse comparisons)
+            return_times: Also return the times the frames were actually taken from
             
         Returns:
-            A list of feature vectors for sampled frames
+            An array with one feature vector (row) per sampled frame, or a
+            (features, times) tuple if return_times is set
         """
         # Check if we've already processed this video
-        cache_key = f"{video_path}_{num_frames}"
-        if cache_key in self.frame_features_cache:
-            return self.frame_features_cache[cache_key]
-        
-        # Open video and get frame features
-        video = VideoFileClip(video_path)
-        
-        # Sample frames evenly throughout the video
-        frame_times = np.linspace(0, video.duration, num_frames)
-        features = []
-        
-        for time in frame_times:
-            # Get frame at specified time
-            frame = video.get_frame(time)
+        cache_key = f"{video_path}_{num_frames}_{sampling}"
+        if cache_key not in self.frame_features_cache:
+            params = {'num_frames': num_frames, 'size': [32, 32], 'scale': "area", 'sampling': sampling}
             
-            # Convert frame to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-            
-            # Resize to a standard size for comparison
-            resized = cv2.resize(gray, (32, 32))
+            # Load from disk (memory-mapped) if this content was analysed before
+            features = self.feature_cache.load(video_path, "frames", params)
+            times = self.feature_cache.load(video_path, "frame_times", params)
+            if features is None or times is None:
+                info = probe_video(video_path)
+                
+                # Sample frames evenly throughout the video, as 32x32 grayscale straight from ffmpeg
+                frame_times = np.linspace(0, info['duration'], num_frames)
+                frames, times = sample_frames(video_path, frame_times, 32, 32, pix_fmt="gray",
+                                              strategy=sampling, fps=info['fps'])
+                
+                # Flatten and normalize
+                features = frames.reshape(len(frames), -1).astype(np.float32) / 255.0
+                try:
+                    self.feature_cache.save(video_path, "frames", params, features)
+                    self.feature_cache.save(video_path, "frame_times", params, times)
+                except OSError as e:
+                    print(f"Could not cache frame features for {video_path}: {e}")
             
-            # Flatten and normalize
-            flat_features = resized.flatten() / 255.0
-            features.append(flat_features)
+            # Store in cache
+            self.frame_features_cache[cache_key] = (features, times)
         
-        # Store in cache and return
-        self.frame_features_cache[cache_key] = features
-        return features
+        features, times = self.frame_features_cache[cache_key]
+        return (features, times) if return_times else features
+    
+    def fingerprint_timeline(self, video_path, window=0.5):
+        """
+        Get a video's fingerprint timeline (features every `window` seconds),
+        decoding the video once on first use.
+        
+        Args:
+            video_path: Path to the video file
+            window: Seconds between fingerprints
+            
+        Returns:
+            FingerprintTimeline for the video
+        """
+        cache_key = (video_path, window)
+        if cache_key not in self.timelines:
+            self.timelines[cache_key] = build_timeline(video_path, window, cache=self.feature_cache)
+        return self.timelines[cache_key]
     
     def calculate_clip_similarity(self, clip1_path, clip1_start, clip1_end, 
                                  clip2_path, clip2_start, clip2_end):
@@ -89,53 +184,159 @@ class VideoContentAnalyzer:
         Returns:
             A similarity score between 0 and 1, where 1 means identical
         """
-        # If comparing the same clip in the same video, they're identical
-        if (clip1_path == clip2_path and 
-            abs(clip1_start - clip2_start) < 0.1 and 
-            abs(clip1_end - clip2_end) < 0.1):
-            return 1.0
+        scores = self.batch_clip_similarity(
+            [(clip1_path, clip1_start, clip1_end)],
+            [(clip2_path, clip2_start, clip2_end)]
+        )
+        return float(scores[0, 0])
+    
+    def batch_clip_similarity(self, clips1, clips2):
+        """
+        Calculate the similarity of every clip in clips1 to every clip in clips2 at once.
+        
+        Args:
+            clips1: List of (video_path, start_time, end_time) tuples
+            clips2: List of (video_path, start_time, end_time) tuples
             
+        Returns:
+            An array of shape (len(clips1), len(clips2)) with scores between 0 and 1,
+            where 1 means identical
+        """
+        if not clips1 or not clips2:
+            return np.zeros((len(clips1), len(clips2)), dtype=np.float32)
+        
+        # Compare the fingerprints of the time ranges: all pairs in one matrix product
+        timelines = {path: self.fingerprint_timeline(path) for path, _, _ in list(clips1) + list(clips2)}
+        scores = cosine_similarity_matrix(segment_matrix(timelines, clips1), segment_matrix(timelines, clips2))
+        
+        paths1 = np.array([path for path, _, _ in clips1], dtype=object)
+        paths2 = np.array([path for path, _, _ in clips2], dtype=object)
+        starts1, ends1 = np.array([(start, end) for _, start, end in clips1], dtype=np.float64).T
+        starts2, ends2 = np.array([(start, end) for _, start, end in clips2], dtype=np.float64).T
+        same_video = paths1[:, None] == paths2[None, :]
+        
         # If they're from the same video and overlap significantly, high similarity
-        if clip1_path == clip2_path:
-            # Calculate overlap
-            overlap_start = max(clip1_start, clip2_start)
-            overlap_end = min(clip1_end, clip2_end)
+        overlap = np.minimum(ends1[:, None], ends2[None, :]) - np.maximum(starts1[:, None], starts2[None, :])
+        shortest = np.minimum((ends1 - starts1)[:, None], (ends2 - starts2)[None, :])
+        overlapping = same_video & (overlap > 0)
+        scores[overlapping] = (overlap / np.maximum(shortest, 1e-9))[overlapping]
+        
+        # If comparing the same clip in the same video, they're identical
+        identical = (same_video &
+                     (np.abs(starts1[:, None] - starts2[None, :]) < 0.1) &
+                     (np.abs(ends1[:, None] - ends2[None, :]) < 0.1))
+        scores[identical] = 1.0
+        
+        return scores
+    
+    def interest_timeline(self, video_path):
+        """
+        Get a video's interest timeline, decoding the video once on first use.
+        
+        Args:
+            video_path: Path to the video file
             
-            if overlap_end > overlap_start:
-                overlap_duration = overlap_end - overlap_start
-                clip1_duration = clip1_end - clip1_start
-                clip2_duration = clip2_end - clip2_start
-                
-                # Normalized overlap (0 to 1)
-                overlap_ratio = overlap_duration / min(clip1_duration, clip2_duration)
-                return overlap_ratio
-        
-        # For different videos or non-overlapping segments, compare frame features
-        # (simplified - in a real implementation, we'd compute features for specific time ranges)
-        clip1_features = self.extract_frame_features(clip1_path)
-        clip2_features = self.extract_frame_features(clip2_path)
-        
-        # Compare feature sets (using a simple average for demonstration)
-        # In a real implementation, we'd use more sophisticated comparison
-        similarity_sum = 0
-        comparisons = 0
-        
-        for f1 in clip1_features:
-            for f2 in clip2_features:
-                # Calculate cosine similarity
-                dot_product = np.dot(f1, f2)
-                norm_f1 = np.linalg.norm(f1)
-                norm_f2 = np.linalg.norm(f2)
-                
-                if norm_f1 > 0 and norm_f2 > 0:
-                    similarity = dot_product / (norm_f1 * norm_f2)
-                    similarity_sum += similarity
-                    comparisons += 1
-        
-        # Return average similarity
-        if comparisons > 0:
-            return similarity_sum / comparisons
-        return 0.0
+        Returns:
+            InterestTimeline for the video
+        """
+        if video_path not in self.interest_timelines:
+            metrics = get_scan(video_path, cache=self.feature_cache)['interest']
+            self.interest_timelines[video_path] = InterestTimeline(metrics)
+        return self.interest_timelines[video_path]
+    
+    def shot_boundaries(self, video_path):
+        """
+        Get the times of the hard cuts in a video (found in the same decode as the
+        other timelines).
+        
+        Args:
+            video_path: Path to the video file
+            
+        Returns:
+            A sorted array of cut times in seconds
+        """
+        return get_scan(video_path, cache=self.feature_cache)['shots']
+    
+    def library_index(self, video_files, segment_seconds=INDEX_SEGMENT_SECONDS):
+        """
+        Get an ANN index over fixed-length segments of every video in a library.
+        
+        The index is stored next to the feature cache, keyed by the files' paths, sizes
+        and modification times, so it is only rebuilt when the library changes.
+        
+        Args:
+            video_files: List of video file paths
+            segment_seconds: Length of each indexed segment
+            
+        Returns:
+            SegmentIndex with (video_path, start_time) keys, or None if nothing could be indexed
+        """
+        files = []
+        for video_path in video_files:
+            try:
+                stat = os.stat(video_path)
+                files.append((os.path.abspath(video_path), stat.st_size, stat.st_mtime))
+            except OSError:
+                continue
+        path = self.feature_cache.index_path("library", {'segment_seconds': segment_seconds, 'files': files})
+        
+        index = self.library_indexes.get(path) or SegmentIndex.load(path)
+        if index is None:
+            keys, vectors = [], []
+            for video_path in video_files:
+                try:
+                    timeline = self.fingerprint_timeline(video_path)
+                except Exception as e:
+                    print(f"Error indexing {video_path}: {str(e)}")
+                    continue
+                last_start = max(0.0, timeline.duration - segment_seconds)
+                for start in np.arange(0.0, last_start + 1e-9, segment_seconds):
+                    keys.append((video_path, float(start)))
+                    vectors.append(timeline.segment_vector(start, start + segment_seconds))
+            if not vectors:
+                return None
+            
+            index = SegmentIndex(np.asarray(vectors, dtype=np.float32), keys)
+            try:
+                index.save(path)
+                self.feature_cache.evict(keep={path})
+            except OSError as e:
+                print(f"Could not cache library index: {e}")
+        
+        self.library_indexes[path] = index
+        return index
+    
+    def dissimilar_sources(self, video_files, history, max_sources):
+        """
+        Pick the videos worth analysing in a large library: those holding the segments
+        farthest from the clips already used, skipping near-duplicates of those clips.
+        
+        Args:
+            video_files: List of video file paths
+            history: List of (video_path, start_time, end_time) clips already used
+            max_sources: Number of videos to return
+            
+        Returns:
+            A list of at most max_sources video paths
+        """
+        if not history:
+            return random.sample(list(video_files), max_sources)
+        
+        index = self.library_index(video_files)
+        if index is None:
+            return random.sample(list(video_files), max_sources)
+        
+        timelines = {path: self.fingerprint_timeline(path) for path, _, _ in history}
+        history_vectors = segment_matrix(timelines, history)
+        duplicates = {key for vector in history_vectors for key, _ in index.near_duplicates(vector)}
+        
+        selected = []
+        for (video_path, _), _ in index.farthest_from(history_vectors, k=4 * max_sources, exclude=duplicates):
+            if video_path not in selected:
+                selected.append(video_path)
+            if len(selected) == max_sources:
+                break
+        return selected or random.sample(list(video_files), max_sources)
     
     def score_clip_interestingness(self, video_path, start_time, end_time):
         """
@@ -149,12 +350,15 @@ class VideoContentAnalyzer:
         Returns:
             An "interestingness" score from 0-10
         """
-        # Extract features for the specific time range
-        video = VideoFileClip(video_path).subclip(start_time, end_time)
+        if self.interest_mode == "timeline":
+            return self.interest_timeline(video_path).score(start_time, end_time)
         
-        # Sample frames evenly throughout the clip
+        # Sample frames evenly throughout the clip, decoded small (global means and
+        # histograms don't need full resolution)
         num_frames = 5
-        frame_times = np.linspace(0, video.duration, num_frames)
+        frame_times = np.linspace(start_time, end_time, num_frames)
+        width, height = SCAN_SIZE
+        frames = read_frames(video_path, frame_times, width, height, pix_fmt="rgb24")
         
         # Metrics to evaluate interestingness
         visual_entropy = 0
@@ -162,10 +366,7 @@ class VideoContentAnalyzer:
         brightness_score = 0
         
         prev_frame = None
-        for i, time in enumerate(frame_times):
-            # Get frame at specified time
-            frame = video.get_frame(time)
-            
+        for frame in frames:
             # Calculate brightness (simple average)
             brightness = np.mean(frame)
             brightness_score += brightness / 255.0
@@ -205,7 +406,7 @@ class VideoContentAnalyzer:
         return min(10, max(0, combined_score * 10))
     
     def find_best_clips(self, video_files, num_clips=4, clip_duration=4.0, 
-                        used_segments=None, batch_id=None):
+                        used_segments=None, batch_id=None, max_sources=64):
         """
         Find the best clips for a video based on content analysis.
         
@@ -215,6 +416,8 @@ class VideoContentAnalyzer:
             clip_duration: Duration of each clip
             used_segments: Previously used segments to avoid
             batch_id: ID for the current batch to track usage
+            max_sources: In libraries with more videos than this, only the videos found
+                farthest from the batch's clips (by the library ANN index) are analysed
             
         Returns:
             A list of (video_path, start_time, end_time, score) tuples
@@ -222,24 +425,36 @@ class VideoContentAnalyzer:
         if used_segments is None:
             used_segments = []
         
+        batch_history = self.clips_used_in_videos.get(batch_id, []) if batch_id is not None else []
+        if max_sources and len(video_files) > max_sources:
+            video_files = self.dissimilar_sources(video_files, batch_history, max_sources)
+        
         # Track all candidate clips and their scores
         candidate_clips = []
         
         # Analyze each video file
         for video_path in video_files:
             try:
-                video = VideoFileClip(video_path)
+                duration = probe_video(video_path)['duration']
                 
                 # Skip if video is too short
-                if video.duration <= clip_duration:
+                if duration <= clip_duration:
                     continue
                 
                 # Try multiple positions in the video
-                num_positions = min(20, int(video.duration / clip_duration))
+                num_positions = min(20, int(duration / clip_duration))
                 
-                for _ in range(num_positions):
-                    # Pick a random start time
-                    start = random.uniform(0, video.duration - clip_duration)
+                # Seed the positions from the shots (one per shot, so clips don't straddle
+                # a cut), topped up with random start times
+                starts = []
+                if self.interest_mode == "timeline":
+                    starts = candidate_starts(self.shot_boundaries(video_path), duration,
+                                              clip_duration, num_positions)
+                while len(starts) < num_positions:
+                    starts.append(random.uniform(0, duration - clip_duration))
+
+                positions = []
+                for start in starts:
                     end = start + clip_duration
                     
                     # Check if this segment overlaps with any used segment
@@ -251,21 +466,30 @@ class VideoContentAnalyzer:
                                 break
                     
                     if not overlap:
-                        # Score the clip
-                        score = self.score_clip_interestingness(video_path, start, end)
-                        
-                        # Adjust score based on similarity to clips used in this batch
-                        if batch_id is not None:
-                            for used_clip in self.clips_used_in_videos.get(batch_id, []):
-                                used_vid, used_start, used_end = used_clip
-                                similarity = self.calculate_clip_similarity(
-                                    video_path, start, end, used_vid, used_start, used_end)
-                                
-                                # Penalize similar clips
-                                penalty = similarity * 5.0  # Stronger penalty for similar clips
-                                score = max(0, score - penalty)
-                        
-                        candidate_clips.append((video_path, start, end, score))
+                        positions.append((video_path, start, end))
+                
+                # Score the clips: every window at once from the source's interest timeline,
+                # or one decode per clip in "sampled" mode
+                if self.interest_mode == "timeline":
+                    scores = self.interest_timeline(video_path).score(
+                        np.array([start for _, start, _ in positions], dtype=np.float64),
+                        np.array([end for _, _, end in positions], dtype=np.float64)
+                    ).astype(np.float32)
+                else:
+                    scores = np.array([self.score_clip_interestingness(path, start, end)
+                                       for path, start, end in positions], dtype=np.float32)
+                
+                # Adjust scores based on similarity to clips used in this batch,
+                # comparing every position with the whole batch history at once
+                if positions and batch_history:
+                    similarity = self.batch_clip_similarity(positions, batch_history)
+                    
+                    # Penalize similar clips
+                    penalty = similarity.sum(axis=1) * 5.0  # Stronger penalty for similar clips
+                    scores = np.maximum(0, scores - penalty)
+                
+                for (path, start, end), score in zip(positions, scores):
+                    candidate_clips.append((path, start, end, float(score)))
             
             except Exception as e:
                 print(f"Error analyzing {video_path}: {str(e)}")
@@ -0,0 +1,210 @@
+"""
+Per-session working directories under one root, kept under a global disk budget.
+
+Every Streamlit session gets a directory with one subdirectory per artifact type
+(uploads, previews, outputs, zips). The manager measures what each session uses and,
+when the root grows past its budget, deletes whole sessions that have been inactive the
+longest, so a long-running instance doesn't fill its disk.
+
+Artifacts handed to browsers as files (rendered videos and download archives) can be
+kept under a separate public directory, e.g. Streamlit's static folder, and are still
+accounted to their session.
+"""
+
+import os
+import time
+import shutil
+import threading
+
+# Subdirectories a session's files are kept in
+ARTIFACT_TYPES = ("uploads", "preview", "output", "zips")
+
+# Artifact types kept under the public directory, when there is one
+PUBLIC_ARTIFACT_TYPES = ("preview", "output", "zips")
+
+# File whose modification time records a session's last activity
+ACTIVITY_FILE = ".last_active"
+
+class WorkspaceManager:
+    """
+    Session directories with usage accounting and least-recently-active eviction.
+    """
+
+    def __init__(self, root_dir, max_bytes=4 * 1024 ** 3, idle_seconds=30 * 60, max_idle_seconds=24 * 3600,
+                 public_dir=None):
+        """
+        Initialize the workspace manager.
+
+        Args:
+            root_dir: Directory holding one subdirectory per session
+            max_bytes: Disk budget for all sessions together
+            idle_seconds: How long a session must be inactive before it may be evicted
+                to get back under the budget
+            max_idle_seconds: Sessions inactive for longer than this are always removed
+            public_dir: Directory for PUBLIC_ARTIFACT_TYPES (one subdirectory per session),
+                or None to keep them with the session's other files
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.public_dir = public_dir
+        os.makedirs(root_dir, exist_ok=True)
+
+        # Sessions of one server share the manager, so eviction runs one at a time
+        self._lock = threading.Lock()
+
+        # Last measurement, as (time measured, usage), for callers that can use a recent one
+        self._usage_cache = None
+
+    def session_dir(self, session_id):
+        """
+        Get a session's directory (created if needed) and mark the session as active.
+
+        Returns:
+            str: Path of the session directory
+        """
+        path = os.path.join(self.root_dir, session_id)
+        os.makedirs(path, exist_ok=True)
+        self.touch(session_id)
+        return path
+
+    def artifact_dir(self, session_id, artifact):
+        """
+        Get the directory a session keeps one type of artifact in (created if needed).
+
+        Args:
+            session_id: Session the files belong to
+            artifact: One of ARTIFACT_TYPES
+
+        Returns:
+            str: Path of the directory
+        """
+        if artifact not in ARTIFACT_TYPES:
+            raise ValueError(f"Unknown artifact type: {artifact}. Choose from {', '.join(ARTIFACT_TYPES)}")
+        session_dir = self.session_dir(session_id)
+        if self.public_dir and artifact in PUBLIC_ARTIFACT_TYPES:
+            session_dir = os.path.join(self.public_dir, session_id)
+        path = os.path.join(session_dir, artifact)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def touch(self, session_id):
+        """Record activity in a session, so it is the last to be evicted."""
+        marker = os.path.join(self.root_dir, session_id, ACTIVITY_FILE)
+        with open(marker, "a"):
+            pass
+        os.utime(marker)
+
+    def last_active(self, session_id):
+        """Time of a session's last activity (seconds since the epoch)."""
+        path = os.path.join(self.root_dir, session_id)
+        marker = os.path.join(path, ACTIVITY_FILE)
+        return os.path.getmtime(marker if os.path.exists(marker) else path)
+
+    def _session_usage(self, session_id):
+        """Bytes used by a session, in total and per artifact type."""
+        by_type = {}
+        for path in self._session_paths(session_id):
+            for dirpath, _, filenames in os.walk(path):
+                relative = os.path.relpath(dirpath, path)
+                artifact = relative.split(os.sep)[0]
+                if artifact not in ARTIFACT_TYPES:
+                    artifact = "other"
+                for filename in filenames:
+                    if filename == ACTIVITY_FILE:
+                        continue
+                    try:
+                        size = os.path.getsize(os.path.join(dirpath, filename))
+                    except OSError:
+                        continue  # Removed while we were walking
+                    by_type[artifact] = by_type.get(artifact, 0) + size
+        return {'bytes': sum(by_type.values()), 'by_type': by_type, 'last_active': self.last_active(session_id)}
+
+    def usage(self, max_age=None):
+        """
+        Measure the disk use of every session.
+
+        Measuring walks every session's files, so callers that poll (e.g. on every
+        rerun) can pass max_age to reuse a recent measurement.
+
+        Args:
+            max_age: Seconds an earlier measurement may be reused for, or None to
+                always measure
+
+        Returns:
+            dict: total_bytes, max_bytes and sessions (session id -> bytes, by_type
+            and last_active), least recently active session first
+        """
+        cached = self._usage_cache
+        if max_age is not None and cached is not None and time.time() - cached[0] <= max_age:
+            return cached[1]
+
+        measured_at = time.time()
+        sessions = {}
+        for session_id in os.listdir(self.root_dir):
+            if os.path.isdir(os.path.join(self.root_dir, session_id)):
+                try:
+                    sessions[session_id] = self._session_usage(session_id)
+                except OSError:
+                    continue
+        sessions = dict(sorted(sessions.items(), key=lambda item: item[1]['last_active']))
+        usage = {
+            'total_bytes': sum(session['bytes'] for session in sessions.values()),
+            'max_bytes': self.max_bytes,
+            'sessions': sessions,
+        }
+        self._usage_cache = (measured_at, usage)
+        return usage
+
+    def _session_paths(self, session_id):
+        """Directories holding a session's files: its session directory and its public one."""
+        paths = [os.path.join(self.root_dir, session_id)]
+        if self.public_dir:
+            paths.append(os.path.join(self.public_dir, session_id))
+        return paths
+
+    def remove_session(self, session_id):
+        """Delete a session's directories and everything in them."""
+        for path in self._session_paths(session_id):
+            shutil.rmtree(path, ignore_errors=True)
+        self._usage_cache = None
+
+    def enforce(self, protect=None):
+        """
+        Remove expired sessions, then evict inactive sessions, least recently active
+        first, until the workspace fits in max_bytes.
+
+        Args:
+            protect: Session ids that must not be removed (e.g. the current session)
+
+        Returns:
+            int: Number of bytes freed
+        """
+        protect = set(protect or ())
+        with self._lock:
+            usage = self.usage()
+            total = usage['total_bytes']
+            now = time.time()
+            freed = 0
+
+            for session_id, session in usage['sessions'].items():
+                if session_id in protect:
+                    continue
+                idle = now - session['last_active']
+                expired = idle > self.max_idle_seconds
+                if expired or (total > self.max_bytes and idle > self.idle_seconds):
+                    self.remove_session(session_id)
+                    total -= session['bytes']
+                    freed += session['bytes']
+
+            # Public files left behind by sessions whose directory is gone (e.g. a cleared temp dir)
+            if self.public_dir and os.path.isdir(self.public_dir):
+                for session_id in os.listdir(self.public_dir):
+                    if session_id not in usage['sessions'] and session_id not in protect:
+                        shutil.rmtree(os.path.join(self.public_dir, session_id), ignore_errors=True)
+
+            if total > self.max_bytes:
+                print(f"Workspace uses {total / 1024 ** 2:.0f} MB of its {self.max_bytes / 1024 ** 2:.0f} MB "
+                      f"budget, but every remaining session is active")
+            return freed
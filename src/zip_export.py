@@ -0,0 +1,134 @@
+"""
+Download archives of a batch of outputs, written as outputs finish.
+
+The outputs are MP4s, which don't compress any further, so entries are stored
+uncompressed: adding a video is a chunked file copy, with no CPU spent on deflate and
+nothing held in memory. Archives are split into parts small enough for Streamlit's
+static file serving to stream them from disk.
+"""
+
+import os
+import json
+import zipfile
+
+# Largest file Streamlit serves from the app's static directory
+STATIC_FILE_LIMIT = 200 * 1024 ** 2
+
+# Bytes a zip entry adds besides the file (local header, central directory record, zip64 extras)
+ZIP_ENTRY_OVERHEAD = 200
+
+class BatchZip:
+    """
+    Stored-mode zip of a batch's outputs, appended to one output at a time.
+
+    The parts are listed in a manifest once the batch is finished, so a finished
+    archive is reused instead of being written again.
+    """
+
+    def __init__(self, zip_dir, name="all_videos", max_part_bytes=STATIC_FILE_LIMIT):
+        """
+        Start an archive.
+
+        Args:
+            zip_dir: Directory the parts are written to
+            name: Base name of the parts ("all_videos.zip", "all_videos_2.zip", ...)
+            max_part_bytes: Size a part is kept under (a single larger file gets a part of its own)
+        """
+        self.zip_dir = zip_dir
+        self.name = name
+        self.max_part_bytes = max_part_bytes
+        self.parts = []
+        self.files = []
+        self._part_bytes = 0
+        os.makedirs(zip_dir, exist_ok=True)
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.zip_dir, f"{self.name}.json")
+
+    def add(self, file_path, arcname=None):
+        """
+        Append a file to the archive, starting a new part when the current one is full.
+
+        Args:
+            file_path: File to add
+            arcname: Name in the archive (default: the file's name)
+        """
+        arcname = arcname or os.path.basename(file_path)
+        size = os.path.getsize(file_path) + ZIP_ENTRY_OVERHEAD + 2 * len(arcname)
+
+        if not self.parts or self._part_bytes + size > self.max_part_bytes:
+            suffix = f"_{len(self.parts) + 1}" if self.parts else ""
+            self.parts.append(os.path.join(self.zip_dir, f"{self.name}{suffix}.zip"))
+            mode = "w"
+        else:
+            mode = "a"
+
+        # ZipFile.write copies the file in chunks; appending only rewrites the central directory
+        with zipfile.ZipFile(self.parts[-1], mode, compression=zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            zipf.write(file_path, arcname=arcname)
+        self._part_bytes = os.path.getsize(self.parts[-1])
+        self.files.append(file_path)
+
+    def finish(self):
+        """
+        Mark the archive as complete by writing its manifest.
+
+        Returns:
+            list: Paths of the parts
+        """
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({'parts': [os.path.basename(part) for part in self.parts],
+                       'files': [os.path.basename(path) for path in self.files]}, f)
+        os.replace(tmp_path, self.manifest_path)
+        return list(self.parts)
+
+def finished_parts(zip_dir, file_paths, name="all_videos"):
+    """
+    Get the parts of a finished archive of these files, if there is one.
+
+    Returns:
+        list: Paths of the parts, or None if the archive is missing, unfinished or
+        holds other files
+    """
+    manifest_path = os.path.join(zip_dir, f"{name}.json")
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    parts = [os.path.join(zip_dir, part) for part in manifest['parts']]
+    if sorted(manifest['files']) != sorted(os.path.basename(path) for path in file_paths):
+        return None
+    if not all(os.path.exists(part) for part in parts):
+        return None
+    return parts
+
+def zip_batch(file_paths, zip_dir, name="all_videos", max_part_bytes=STATIC_FILE_LIMIT):
+    """
+    Get a stored-mode archive of a batch, reusing it if it was already written.
+
+    Args:
+        file_paths: Files to archive
+        zip_dir: Directory of the batch's archive
+        name: Base name of the parts
+        max_part_bytes: Size a part is kept under
+
+    Returns:
+        list: Paths of the parts
+    """
+    parts = finished_parts(zip_dir, file_paths, name)
+    if parts is not None:
+        return parts
+
+    # Start over: an unfinished archive may end in a partly written entry
+    for filename in os.listdir(zip_dir) if os.path.isdir(zip_dir) else []:
+        if filename.startswith(name) and filename.endswith(".zip"):
+            os.remove(os.path.join(zip_dir, filename))
+
+    archive = BatchZip(zip_dir, name, max_part_bytes)
+    for file_path in file_paths:
+        archive.add(file_path)
+    return archive.finish()